@@ -0,0 +1,282 @@
+'''
+Streaming Batch Processing for the Delta E Calculator
+
+This module runs the batch (file upload) side of compute_DeltaE.py as a streaming pipeline.
+Color pairs are read from a CSV, Parquet or Excel (.xlsx) file a chunk at a time, each chunk
+is compared with the vectorized functions in color_arrays.py, and the results are written out
+incrementally as CSV, Parquet or Excel. Only one chunk is held in memory at any point, so peak
+memory depends on the chunk size and not on the size of the uploaded file.
+
+'''
+import os
+import numpy as np
+import pandas as pd
+from color_arrays import compare_hex_arrays
+from metrics import span
+
+# Supported input and output file types
+INPUT_FORMATS = ('.xlsx', '.csv', '.parquet')
+OUTPUT_FORMATS = ('xlsx', 'csv', 'parquet')
+
+# Default number of color pairs processed per chunk
+DEFAULT_CHUNK_SIZE = 100_000
+
+# Excel worksheets cannot hold more rows than this (including the header)
+EXCEL_MAX_ROWS = 1_048_576
+
+DELTA_E_COLUMNS = ['∆E 1976', '∆E 1994', '∆E 2000']
+
+
+# Function to format a column of (N, 3) values as strings, using 'N/A' (or the given placeholder) for invalid rows
+def format_triplets(values, decimals=None, placeholder='N/A'):
+    invalid = np.isnan(values).any(axis=1)
+    if decimals is None:
+        rows = np.where(invalid[:, None], 0, values).astype(np.int64)
+        formatted = list(map('({}, {}, {})'.format, *rows.T.tolist()))
+    else:
+        formatted = list(map('[{!r}, {!r}, {!r}]'.format, *np.round(values, decimals).T.tolist()))
+    return np.where(invalid, placeholder, np.array(formatted, dtype=object))
+
+
+# Function to build the batch results table for two columns of hex colors
+def build_results_frame(hex_colors1, hex_colors2):
+    result = compare_hex_arrays(hex_colors1, hex_colors2)
+
+    def delta_e_column(values):
+        column = values.astype(object)
+        column[np.isnan(values)] = 'N/A'
+        return column
+
+    # Increase precision for XYZ and Lab values in the Excel output
+    return pd.DataFrame({
+        'Color 1 (Hex)': hex_colors1,
+        'Color 2 (Hex)': hex_colors2,
+        'RGB 1': format_triplets(result['rgb1'], placeholder='None'),
+        'RGB 2': format_triplets(result['rgb2'], placeholder='None'),
+        'XYZ 1': format_triplets(result['xyz1'], 4),
+        'XYZ 2': format_triplets(result['xyz2'], 4),
+        'Lab 1': format_triplets(result['lab1'], 4),
+        'Lab 2': format_triplets(result['lab2'], 4),
+        DELTA_E_COLUMNS[0]: delta_e_column(result['delta_e_76']),
+        DELTA_E_COLUMNS[1]: delta_e_column(result['delta_e_94']),
+        DELTA_E_COLUMNS[2]: delta_e_column(result['delta_e_00'])
+    })
+
+
+# Function to turn a chunk of raw cell values into two stripped hex color columns
+def _hex_columns(chunk):
+    if chunk.shape[1] < 2:
+        raise ValueError('File must have at least two columns')
+    # Assuming the first two columns contain the hex color codes
+    hex_colors1 = chunk.iloc[:, 0].astype(str).str.strip().to_numpy()
+    hex_colors2 = chunk.iloc[:, 1].astype(str).str.strip().to_numpy()
+    return hex_colors1, hex_colors2
+
+
+# Function to read an Excel sheet row by row (read-only mode) and yield DataFrame chunks
+def _read_excel_chunks(filepath, chunk_size):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        next(rows, None)  # The first row holds the column headers
+        buffer = []
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            # Empty cells become 'nan', just like pd.read_excel followed by str()
+            buffer.append(['nan' if value is None else value for value in row[:2]])
+            if len(buffer) >= chunk_size:
+                yield pd.DataFrame(buffer)
+                buffer = []
+        if buffer:
+            yield pd.DataFrame(buffer)
+    finally:
+        workbook.close()
+
+
+# Function to read a Parquet file batch by batch and yield DataFrame chunks
+def _read_parquet_chunks(filepath, chunk_size):
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(filepath)
+    columns = parquet_file.schema_arrow.names[:2]
+    for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+        yield batch.to_pandas()
+
+
+# Function to yield (hex_colors1, hex_colors2) chunks from a CSV, Parquet or Excel file
+def read_color_chunks(filepath, chunk_size=DEFAULT_CHUNK_SIZE):
+    extension = os.path.splitext(filepath)[1].lower()
+    if extension == '.csv':
+        # Read as strings so codes like 000000 are not turned into numbers
+        chunks = pd.read_csv(filepath, usecols=[0, 1], dtype=str, chunksize=chunk_size)
+    elif extension == '.parquet':
+        chunks = _read_parquet_chunks(filepath, chunk_size)
+    elif extension == '.xlsx':
+        chunks = _read_excel_chunks(filepath, chunk_size)
+    else:
+        raise ValueError(f'Unsupported file type: {extension}')
+
+    for chunk in chunks:
+        yield _hex_columns(chunk)
+
+
+# Function to count the color pairs in a file without loading it (None if unknown)
+def count_color_rows(filepath):
+    extension = os.path.splitext(filepath)[1].lower()
+    if extension == '.csv':
+        # Count line breaks block by block (an estimate if cells contain quoted newlines)
+        lines, last_block = 0, b''
+        with open(filepath, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                lines += block.count(b'\n')
+                last_block = block
+        if last_block and not last_block.endswith(b'\n'):
+            lines += 1
+        return max(lines - 1, 0)
+    if extension == '.parquet':
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(filepath).metadata.num_rows
+    if extension == '.xlsx':
+        from openpyxl import load_workbook
+        workbook = load_workbook(filepath, read_only=True)
+        try:
+            max_row = workbook.active.max_row
+        finally:
+            workbook.close()
+        return max(max_row - 1, 0) if max_row else None
+    return None
+
+
+# Writer that appends result chunks to a CSV file
+class CsvResultsWriter:
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.header_written = False
+
+    def write(self, results_df):
+        results_df.to_csv(self.filepath, mode='a' if self.header_written else 'w',
+                          header=not self.header_written, index=False)
+        self.header_written = True
+
+    def close(self):
+        if not self.header_written:
+            build_results_frame(np.array([], dtype=str), np.array([], dtype=str)).to_csv(self.filepath, index=False)
+
+
+# Writer that appends result chunks as row groups of a Parquet file
+class ParquetResultsWriter:
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.writer = None
+
+    def write(self, results_df):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        # Parquet columns need a single type, so invalid Delta E values are stored as nulls
+        results_df = results_df.copy()
+        for column in DELTA_E_COLUMNS:
+            results_df[column] = pd.to_numeric(results_df[column], errors='coerce').astype('float64')
+        table = pa.Table.from_pandas(results_df, preserve_index=False)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.filepath, table.schema)
+        self.writer.write_table(table.cast(self.writer.schema))
+
+    def close(self):
+        if self.writer is None:
+            self.write(build_results_frame(np.array([], dtype=str), np.array([], dtype=str)))
+        self.writer.close()
+
+
+# Writer that streams result chunks into a write-only Excel workbook
+class ExcelResultsWriter:
+    def __init__(self, filepath):
+        from openpyxl import Workbook
+
+        self.filepath = filepath
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet()
+        self.rows_written = 0
+
+    def write(self, results_df):
+        if self.rows_written == 0:
+            self.sheet.append(list(results_df.columns))
+            self.rows_written = 1
+        if self.rows_written + len(results_df) > EXCEL_MAX_ROWS:
+            raise ValueError('Too many rows for an Excel file. Please choose CSV or Parquet output')
+        for row in results_df.itertuples(index=False, name=None):
+            self.sheet.append(row)
+        self.rows_written += len(results_df)
+
+    def close(self):
+        if self.rows_written == 0:
+            self.write(build_results_frame(np.array([], dtype=str), np.array([], dtype=str)))
+        self.workbook.save(self.filepath)
+
+
+RESULTS_WRITERS = {
+    'csv': CsvResultsWriter,
+    'parquet': ParquetResultsWriter,
+    'xlsx': ExcelResultsWriter,
+}
+
+
+# Function to stream a whole color file through the Delta E pipeline
+def process_color_file(input_path, output_path, output_format='xlsx', chunk_size=DEFAULT_CHUNK_SIZE,
+                       progress_callback=None):
+    """Compare every color pair in ``input_path`` and write the results to ``output_path``.
+
+    :param input_path: CSV, Parquet or .xlsx file whose first two columns hold hex colors
+    :param output_path: where to write the results
+    :param output_format: 'xlsx', 'csv' or 'parquet'
+    :param chunk_size: number of rows read, compared and written at a time
+    :param progress_callback: optional function called with the running row count after each chunk
+    :return: number of color pairs processed
+    """
+    if output_format not in RESULTS_WRITERS:
+        raise ValueError(f'Unsupported output format: {output_format}')
+
+    writer = RESULTS_WRITERS[output_format](output_path)
+    rows_processed = 0
+    try:
+        chunks = read_color_chunks(input_path, chunk_size)
+        while True:
+            with span('read_chunk'):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            hex_colors1, hex_colors2 = chunk
+            # Includes the hex_parse, lab_convert and delta_e stages of compare_hex_arrays
+            with span('build_results'):
+                results = build_results_frame(hex_colors1, hex_colors2)
+            with span('write_chunk'):
+                writer.write(results)
+            rows_processed += len(hex_colors1)
+            if progress_callback is not None:
+                progress_callback(rows_processed)
+        writer.close()
+    except Exception:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+    return rows_processed
+
+
+# Job function for the background queue: process an uploaded file inside its job directory
+def delta_e_job(job, input_path, output_format='xlsx', chunk_size=DEFAULT_CHUNK_SIZE):
+    total_rows = count_color_rows(input_path)
+    output_filename = f'color_comparison_results.{output_format}'
+
+    def report_progress(rows_processed):
+        progress = rows_processed / total_rows if total_rows else None
+        job.update(progress=progress, message=f'{rows_processed} color pairs processed')
+
+    try:
+        rows_processed = process_color_file(input_path, job.path(output_filename), output_format=output_format,
+                                            chunk_size=chunk_size, progress_callback=report_progress)
+    finally:
+        os.remove(input_path)
+    return {'rows': rows_processed, 'filename': output_filename}
@@ -0,0 +1,74 @@
+'''
+Lab Table Benchmark
+
+Compares converting RGB colors to XYZ and Lab directly (rgb_to_xyz_array + xyz_to_lab_array)
+with looking them up in the precomputed, memory-mapped table from lab_table.py, for batches of
+random colors of increasing size. The table is built first if the file does not exist yet.
+
+For each batch size it reports both times and the largest difference between the two results,
+then runs compare_hex_arrays both ways on the largest batch and counts the rounded Delta E values
+that differ.
+
+Usage:
+    python benchmark_lab_table.py [table path]
+
+'''
+import os
+import sys
+import time
+import numpy as np
+from color_arrays import rgb_to_xyz_array, xyz_to_lab_array, compare_hex_arrays, use_lab_table
+from lab_table import DEFAULT_LAB_TABLE, build_lab_table, open_lab_table, lookup_xyz_lab
+
+BATCH_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+REPEATS = 5
+
+
+# Function to time the best of REPEATS calls
+def best_time(fn, *args):
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = fn(*args)
+        times.append(time.perf_counter() - start)
+    return result, min(times)
+
+
+def direct_xyz_lab(rgb):
+    xyz = rgb_to_xyz_array(rgb)
+    return xyz, xyz_to_lab_array(xyz)
+
+
+def main(table_path):
+    if not os.path.exists(table_path):
+        print(f'Building {table_path}...')
+        start = time.perf_counter()
+        build_lab_table(table_path)
+        print(f'Built in {time.perf_counter() - start:.1f} s\n')
+    table = open_lab_table(table_path)
+    rng = np.random.default_rng(0)
+
+    print(f"{'colors':>10} {'direct ms':>10} {'table ms':>10} {'speedup':>8} {'max XYZ diff':>13} {'max Lab diff':>13}")
+    for n in BATCH_SIZES:
+        rgb = rng.integers(0, 256, size=(n, 3)).astype(np.float64)
+        (xyz, lab), direct_time = best_time(direct_xyz_lab, rgb)
+        (table_xyz, table_lab), table_time = best_time(lookup_xyz_lab, table, rgb)
+        print(f'{n:>10,} {direct_time * 1000:>10.2f} {table_time * 1000:>10.2f} '
+              f'{direct_time / max(table_time, 1e-9):>7.1f}x {np.abs(xyz - table_xyz).max():>13.2e} '
+              f'{np.abs(lab - table_lab).max():>13.2e}')
+
+    # End to end: hex parsing, conversions and the three Delta E formulas
+    hex1 = np.array([f'#{v:06x}' for v in rng.integers(0, 1 << 24, size=BATCH_SIZES[-1])])
+    hex2 = np.array([f'#{v:06x}' for v in rng.integers(0, 1 << 24, size=BATCH_SIZES[-1])])
+    use_lab_table(None)
+    direct, direct_time = best_time(compare_hex_arrays, hex1, hex2)
+    use_lab_table(table_path)
+    looked_up, table_time = best_time(compare_hex_arrays, hex1, hex2)
+    use_lab_table(None)
+    mismatches = {key: int((direct[key] != looked_up[key]).sum()) for key in ('delta_e_76', 'delta_e_94', 'delta_e_00')}
+    print(f'\ncompare_hex_arrays on {len(hex1):,} pairs: direct {direct_time:.3f} s, table {table_time:.3f} s; '
+          f'rounded Delta E values that differ: {mismatches}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_LAB_TABLE)
@@ -0,0 +1,265 @@
+'''
+Vectorized Color Conversions and Delta E
+
+This module holds the array-based versions of the conversions used by compute_DeltaE.py.
+Instead of building one colormath object per color, every function works on whole NumPy
+arrays at once: an (N, 3) array of RGB, XYZ or Lab values in, an (N, 3) or (N,) array out.
+
+The formulas (sRGB companding, the sRGB -> XYZ matrix, the D65 reference white and the
+CIE76 / CIE94 / CIEDE2000 difference formulas) are the same ones colormath uses, so the
+results match what compute_DeltaE.py produced before, to the rounding shown to the user.
+Invalid colors are carried through as NaN rows.
+
+When a precomputed sRGB -> XYZ / Lab table is in use (see lab_table.py and use_lab_table),
+hex_to_lab_array and compare_hex_arrays look the conversions up in it instead of computing them.
+
+'''
+import os
+import numpy as np
+from metrics import span
+
+# sRGB (D65) -> XYZ working space matrix, as used by colormath's sRGBColor
+RGB_TO_XYZ_MATRIX = np.array([
+    [0.412424, 0.357579, 0.180464],
+    [0.212656, 0.715158, 0.0721856],
+    [0.0193324, 0.119193, 0.950444],
+])
+
+# D65 reference white (2 degree observer)
+D65_WHITE = np.array([0.95047, 1.00000, 1.08883])
+
+# CIE constants for the Lab transfer function
+CIE_E = 216.0 / 24389.0
+
+# Lookup table mapping an ASCII byte to its hex digit value (-1 for anything else)
+_HEX_DIGITS = np.full(256, -1, dtype=np.int16)
+for _i, _c in enumerate(b'0123456789abcdef'):
+    _HEX_DIGITS[_c] = _i
+for _i, _c in enumerate(b'ABCDEF'):
+    _HEX_DIGITS[_c] = 10 + _i
+
+# Environment variable naming the lookup table file. It is inherited by job worker processes,
+# which then open (memory-map) the same file on first use.
+LAB_TABLE_ENV = 'DELTAE_LAB_TABLE'
+_lab_table = None
+
+
+# Function to switch the precomputed sRGB -> XYZ / Lab table on (path) or off (None)
+def use_lab_table(path):
+    global _lab_table
+    _lab_table = None
+    if path is None:
+        os.environ.pop(LAB_TABLE_ENV, None)
+        return
+    os.environ[LAB_TABLE_ENV] = path
+    get_lab_table()
+
+
+# Function to get the memory-mapped lookup table (None when it is not in use)
+def get_lab_table():
+    global _lab_table
+    path = os.environ.get(LAB_TABLE_ENV)
+    if _lab_table is None and path:
+        from lab_table import open_lab_table
+        _lab_table = open_lab_table(path)
+    return _lab_table
+
+
+# Function to convert a single hex color to RGB (returns None for invalid input)
+def hex_to_rgb(hex_color):
+    try:
+        hex_color = hex_color.lstrip('#')
+        return tuple(int(hex_color[i:i + 2], 16) for i in (0, 2, 4))
+    except ValueError:
+        return None
+
+
+# Function to convert an array of hex colors to an (N, 3) RGB array
+def hex_to_rgb_array(hex_colors):
+    """Parse hex color strings into RGB values (0-255).
+
+    Rows that cannot be parsed are filled with NaN, matching ``hex_to_rgb`` returning None.
+
+    :param hex_colors: sequence of hex color strings (with or without '#')
+    :return: (N, 3) float64 array of RGB values
+    """
+    hex_colors = np.asarray(hex_colors, dtype=str)
+    n = hex_colors.shape[0]
+    rgb = np.full((n, 3), np.nan)
+    if n == 0:
+        return rgb
+
+    # Fast path: view the strings as unicode code points, skip one leading '#' and decode
+    # the next six characters through the lookup table
+    width = max(hex_colors.dtype.itemsize // 4, 7)
+    codes = hex_colors.astype(f'U{width}').view(np.uint32).reshape(n, width)
+    offset = (codes[:, 0] == ord('#')).astype(np.intp)
+    chars = np.take_along_axis(codes, offset[:, None] + np.arange(6), axis=1)
+    digits = np.where(chars < 256, _HEX_DIGITS[np.minimum(chars, 255)], -1)
+    valid = (digits >= 0).all(axis=1) & (codes[:, 1] != ord('#'))
+    values = digits[valid]
+    rgb[valid] = values[:, 0::2] * 16 + values[:, 1::2]
+
+    # Anything the fast path rejected ('##' prefixes, short strings, inputs like '+f' or ' f'
+    # that int() is lenient about) goes through the scalar parser
+    for i in np.flatnonzero(~valid):
+        value = hex_to_rgb(str(hex_colors[i]))
+        if value is not None:
+            rgb[i] = value
+    return rgb
+
+
+# Function to convert an (N, 3) RGB array (0-255) to XYZ (D65)
+def rgb_to_xyz_array(rgb):
+    rgb = np.asarray(rgb, dtype=np.float64) / 255.0
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    xyz = (linear[:, 0, None] * RGB_TO_XYZ_MATRIX[:, 0]
+           + linear[:, 1, None] * RGB_TO_XYZ_MATRIX[:, 1]
+           + linear[:, 2, None] * RGB_TO_XYZ_MATRIX[:, 2])
+    # colormath clamps negative results to zero
+    return np.maximum(xyz, 0.0, where=~np.isnan(xyz), out=xyz)
+
+
+# Function to convert an (N, 3) XYZ array to Lab (D65)
+def xyz_to_lab_array(xyz):
+    scaled = np.asarray(xyz, dtype=np.float64) / D65_WHITE
+    with np.errstate(invalid='ignore'):
+        f = np.where(scaled > CIE_E, np.cbrt(scaled), (7.787 * scaled) + (16.0 / 116.0))
+    lab = np.empty_like(f)
+    lab[:, 0] = (116.0 * f[:, 1]) - 16.0
+    lab[:, 1] = 500.0 * (f[:, 0] - f[:, 1])
+    lab[:, 2] = 200.0 * (f[:, 1] - f[:, 2])
+    return lab
+
+
+# Function to convert an (N, 3) RGB array to XYZ and Lab, from the lookup table when in use
+def rgb_to_xyz_lab_array(rgb):
+    table = get_lab_table()
+    if table is not None:
+        from lab_table import lookup_xyz_lab
+        return lookup_xyz_lab(table, rgb)
+    xyz = rgb_to_xyz_array(rgb)
+    return xyz, xyz_to_lab_array(xyz)
+
+
+# Function to convert an array of hex colors straight to Lab
+def hex_to_lab_array(hex_colors):
+    return rgb_to_xyz_lab_array(hex_to_rgb_array(hex_colors))[1]
+
+
+# Function to calculate Delta E (CIE 1976) row by row
+def delta_e_cie76_array(lab1, lab2):
+    diff = np.asarray(lab1, dtype=np.float64) - np.asarray(lab2, dtype=np.float64)
+    return np.sqrt(np.sum(diff ** 2, axis=-1))
+
+
+# Function to calculate Delta E (CIE 1994, graphic arts weights) row by row
+def delta_e_cie94_array(lab1, lab2, K_L=1, K_C=1, K_H=1, K_1=0.045, K_2=0.015):
+    """CIE94 difference. Like colormath, the weights are taken from the first color."""
+    lab1 = np.asarray(lab1, dtype=np.float64)
+    lab2 = np.asarray(lab2, dtype=np.float64)
+    C_1 = np.sqrt(lab1[..., 1] ** 2 + lab1[..., 2] ** 2)
+    C_2 = np.sqrt(lab2[..., 1] ** 2 + lab2[..., 2] ** 2)
+
+    delta_L = lab1[..., 0] - lab2[..., 0]
+    delta_C = C_1 - C_2
+    delta_a = lab1[..., 1] - lab2[..., 1]
+    delta_b = lab1[..., 2] - lab2[..., 2]
+    delta_H_sq = -(delta_C ** 2) + delta_a ** 2 + delta_b ** 2
+    delta_H = np.sqrt(np.clip(delta_H_sq, 0, None))
+
+    S_L = 1
+    S_C = 1 + K_1 * C_1
+    S_H = 1 + K_2 * C_1
+    return np.sqrt((delta_L / (K_L * S_L)) ** 2
+                   + (delta_C / (K_C * S_C)) ** 2
+                   + (delta_H / (K_H * S_H)) ** 2)
+
+
+# Function to calculate Delta E (CIEDE2000) row by row
+def delta_e_cie2000_array(lab1, lab2, Kl=1, Kc=1, Kh=1):
+    """CIEDE2000 difference, following colormath's formulation term for term."""
+    lab1 = np.asarray(lab1, dtype=np.float64)
+    lab2 = np.asarray(lab2, dtype=np.float64)
+    L1, a1, b1 = lab1[..., 0], lab1[..., 1], lab1[..., 2]
+    L2, a2, b2 = lab2[..., 0], lab2[..., 1], lab2[..., 2]
+
+    avg_Lp = (L1 + L2) / 2.0
+
+    C1 = np.sqrt(a1 ** 2 + b1 ** 2)
+    C2 = np.sqrt(a2 ** 2 + b2 ** 2)
+    avg_C1_C2 = (C1 + C2) / 2.0
+
+    G = 0.5 * (1 - np.sqrt(np.power(avg_C1_C2, 7.0) / (np.power(avg_C1_C2, 7.0) + np.power(25.0, 7.0))))
+
+    a1p = (1.0 + G) * a1
+    a2p = (1.0 + G) * a2
+
+    C1p = np.sqrt(a1p ** 2 + b1 ** 2)
+    C2p = np.sqrt(a2p ** 2 + b2 ** 2)
+    avg_C1p_C2p = (C1p + C2p) / 2.0
+
+    h1p = np.degrees(np.arctan2(b1, a1p))
+    h1p += (h1p < 0) * 360
+    h2p = np.degrees(np.arctan2(b2, a2p))
+    h2p += (h2p < 0) * 360
+
+    avg_Hp = (((np.fabs(h1p - h2p) > 180) * 360) + h1p + h2p) / 2.0
+
+    T = 1 - 0.17 * np.cos(np.radians(avg_Hp - 30)) + \
+        0.24 * np.cos(np.radians(2 * avg_Hp)) + \
+        0.32 * np.cos(np.radians(3 * avg_Hp + 6)) - \
+        0.2 * np.cos(np.radians(4 * avg_Hp - 63))
+
+    diff_h2p_h1p = h2p - h1p
+    delta_hp = diff_h2p_h1p + (np.fabs(diff_h2p_h1p) > 180) * 360
+    delta_hp -= (h2p > h1p) * 720
+
+    delta_Lp = L2 - L1
+    delta_Cp = C2p - C1p
+    delta_Hp = 2 * np.sqrt(C2p * C1p) * np.sin(np.radians(delta_hp) / 2.0)
+
+    S_L = 1 + ((0.015 * np.power(avg_Lp - 50, 2)) / np.sqrt(20 + np.power(avg_Lp - 50, 2.0)))
+    S_C = 1 + 0.045 * avg_C1p_C2p
+    S_H = 1 + 0.015 * avg_C1p_C2p * T
+
+    delta_ro = 30 * np.exp(-(np.power(((avg_Hp - 275) / 25), 2.0)))
+    R_C = np.sqrt((np.power(avg_C1p_C2p, 7.0)) / (np.power(avg_C1p_C2p, 7.0) + np.power(25.0, 7.0)))
+    R_T = -2 * R_C * np.sin(2 * np.radians(delta_ro))
+
+    return np.sqrt(
+        np.power(delta_Lp / (S_L * Kl), 2) +
+        np.power(delta_Cp / (S_C * Kc), 2) +
+        np.power(delta_Hp / (S_H * Kh), 2) +
+        R_T * (delta_Cp / (S_C * Kc)) * (delta_Hp / (S_H * Kh)))
+
+
+# Function to run the full hex -> RGB -> XYZ -> Lab -> Delta E pipeline on two columns of colors
+def compare_hex_arrays(hex_colors1, hex_colors2):
+    """Compare two equally long sequences of hex colors pair by pair.
+
+    :param hex_colors1: sequence of hex color strings
+    :param hex_colors2: sequence of hex color strings
+    :return: dict of (N, 3) arrays ('rgb1', 'xyz1', 'lab1', ...) and (N,) arrays
+             ('delta_e_76', 'delta_e_94', 'delta_e_00'), with Delta E rounded to 2 places
+             and NaN wherever either color was invalid
+    """
+    with span('hex_parse'):
+        rgb1 = hex_to_rgb_array(hex_colors1)
+        rgb2 = hex_to_rgb_array(hex_colors2)
+    with span('lab_convert'):
+        xyz1, lab1 = rgb_to_xyz_lab_array(rgb1)
+        xyz2, lab2 = rgb_to_xyz_lab_array(rgb2)
+
+    with span('delta_e'), np.errstate(invalid='ignore'):
+        delta_e_76 = np.round(delta_e_cie76_array(lab1, lab2), 2)
+        delta_e_94 = np.round(delta_e_cie94_array(lab1, lab2), 2)
+        delta_e_00 = np.round(delta_e_cie2000_array(lab1, lab2), 2)
+
+    return {
+        'rgb1': rgb1, 'xyz1': xyz1, 'lab1': lab1,
+        'rgb2': rgb2, 'xyz2': xyz2, 'lab2': lab2,
+        'delta_e_76': delta_e_76,
+        'delta_e_94': delta_e_94,
+        'delta_e_00': delta_e_00,
+    }
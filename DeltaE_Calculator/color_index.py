@@ -0,0 +1,137 @@
+'''
+Nearest-Color Index
+
+Finds the closest colors of a large color library (e.g. named or brand colors) to a batch of
+query colors, such as the hex codes returned by the Color Palette Extractor's process_image.
+
+The library is converted to Lab once, when the index is built, and kept in a NumPy array with
+a KD-tree over it (scipy.spatial.cKDTree). Queries are then answered in one pass per batch:
+
+    - 'cie76':   CIE76 is the straight-line distance in Lab, so the KD-tree answers it exactly.
+    - 'cie94' and 'cie2000': the KD-tree first picks the `candidates` nearest library colors in
+      Lab (prefilter), then the exact CIE94 / CIEDE2000 difference is computed for those and they
+      are re-ranked. Colors that are close under CIEDE2000 are also close in Lab, so a few dozen
+      candidates find the same neighbours as comparing against the whole library; raise
+      `candidates` (or set it to the library size for a full comparison) to trade speed for certainty.
+
+'''
+import os
+import numpy as np
+import pandas as pd
+from color_arrays import hex_to_lab_array, delta_e_cie76_array, delta_e_cie94_array, delta_e_cie2000_array
+
+METRICS = {
+    'cie76': delta_e_cie76_array,
+    'cie94': delta_e_cie94_array,
+    'cie2000': delta_e_cie2000_array,
+}
+DEFAULT_METRIC = 'cie2000'
+DEFAULT_CANDIDATES = 64
+
+# Column names recognised in a library file (case-insensitive)
+HEX_COLUMNS = ('hex', 'hex_code', 'color', 'colour')
+NAME_COLUMNS = ('name', 'color_name', 'colour_name')
+
+
+# Function to read a color library file (.csv, .xlsx or .parquet) into (hex codes, names)
+def read_color_library(filepath):
+    """Read a library of colors.
+
+    The hex codes come from a column named hex / hex_code / color (or the first column if there
+    is none), the names from a column named name / color_name (or the hex codes themselves).
+    """
+    extension = os.path.splitext(filepath)[1].lower()
+    if extension == '.csv':
+        df = pd.read_csv(filepath, dtype=str)
+    elif extension == '.parquet':
+        df = pd.read_parquet(filepath)
+    elif extension == '.xlsx':
+        df = pd.read_excel(filepath, dtype=str)
+    else:
+        raise ValueError(f'Unsupported color library type: {extension} (use .csv, .xlsx or .parquet)')
+
+    columns = {str(column).strip().lower(): column for column in df.columns}
+    hex_column = next((columns[c] for c in HEX_COLUMNS if c in columns), df.columns[0])
+    name_column = next((columns[c] for c in NAME_COLUMNS if c in columns), hex_column)
+    return df[hex_column].fillna('').astype(str).tolist(), df[name_column].fillna('').astype(str).tolist()
+
+
+class ColorIndex:
+    """Array-backed nearest-color index over a library of hex colors.
+
+    :param hex_codes: library colors as hex strings (invalid entries are skipped)
+    :param names: optional name for each color (defaults to the hex code)
+    """
+
+    def __init__(self, hex_codes, names=None):
+        from scipy.spatial import cKDTree
+
+        hex_codes = np.asarray(hex_codes, dtype=str)
+        names = hex_codes if names is None else np.asarray(names, dtype=str)
+        lab = hex_to_lab_array(hex_codes)
+        valid = ~np.isnan(lab).any(axis=1)
+
+        self.hex_codes = hex_codes[valid]
+        self.names = names[valid]
+        self.lab = lab[valid]
+        self.skipped = int((~valid).sum())
+        self.tree = cKDTree(self.lab) if len(self.lab) else None
+
+    @classmethod
+    def from_file(cls, filepath):
+        hex_codes, names = read_color_library(filepath)
+        return cls(hex_codes, names)
+
+    def __len__(self):
+        return len(self.lab)
+
+    def query(self, hex_colors, k=5, metric=DEFAULT_METRIC, candidates=DEFAULT_CANDIDATES):
+        """Find the k closest library colors to each query color.
+
+        :param hex_colors: sequence of query hex colors
+        :param k: number of matches per query
+        :param metric: 'cie76', 'cie94' or 'cie2000'
+        :param candidates: library colors prefiltered by Lab distance before the exact CIE94 /
+                           CIEDE2000 re-ranking
+        :return: (indices, delta_e), both (N, k) arrays sorted from closest to farthest; rows for
+                 invalid query colors hold -1 and NaN
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric '{metric}'. Choose one of: {', '.join(METRICS)}")
+        lab = hex_to_lab_array(hex_colors)
+        k = min(k, len(self))
+        indices = np.full((len(lab), k), -1, dtype=np.int64)
+        delta_e = np.full((len(lab), k), np.nan)
+        valid = ~np.isnan(lab).any(axis=1)
+        if k == 0 or not valid.any():
+            return indices, delta_e
+        query_lab = lab[valid]
+
+        if metric == 'cie76':
+            distances, nearest = self.tree.query(query_lab, k=k)
+            indices[valid] = nearest.reshape(-1, k)
+            delta_e[valid] = distances.reshape(-1, k)
+            return indices, delta_e
+
+        # Prefilter by Lab distance, then re-rank the candidates by the exact difference
+        n_candidates = min(max(candidates, k), len(self))
+        _, nearest = self.tree.query(query_lab, k=n_candidates)
+        nearest = nearest.reshape(-1, n_candidates)
+        exact = METRICS[metric](query_lab[:, None, :], self.lab[nearest])
+        order = np.argsort(exact, axis=1, kind='stable')[:, :k]
+        indices[valid] = np.take_along_axis(nearest, order, axis=1)
+        delta_e[valid] = np.take_along_axis(exact, order, axis=1)
+        return indices, delta_e
+
+    def matches(self, hex_colors, k=5, metric=DEFAULT_METRIC, candidates=DEFAULT_CANDIDATES):
+        """Like query(), but as a list (one per query color) of [{'name', 'hex', 'delta_e'}, ...]
+        lists, with None for invalid query colors."""
+        indices, delta_e = self.query(hex_colors, k=k, metric=metric, candidates=candidates)
+        results = []
+        for row_indices, row_delta_e in zip(indices, delta_e):
+            if len(row_indices) == 0 or row_indices[0] < 0:
+                results.append(None)
+                continue
+            results.append([{'name': str(self.names[i]), 'hex': str(self.hex_codes[i]), 'delta_e': round(float(d), 2)}
+                            for i, d in zip(row_indices, row_delta_e)])
+        return results
@@ -11,71 +11,104 @@ The results are displayed in a user-friendly format, and the user can download t
 
 '''
 import numpy as np
-from colormath.color_objects import sRGBColor, XYZColor, LabColor
-from colormath.color_conversions import convert_color
-from colormath.color_diff import delta_e_cie1976, delta_e_cie1994, delta_e_cie2000
 from flask import Flask, render_template, request, jsonify, send_file
 import webbrowser
 import threading
-import pandas as pd
 import os
+import json
+import uuid
+from color_arrays import LAB_TABLE_ENV, compare_hex_arrays, use_lab_table
+from metrics import REGISTRY, init_metrics_folder, instrument_app, span
+from batch_processing import INPUT_FORMATS, OUTPUT_FORMATS, DEFAULT_CHUNK_SIZE, delta_e_job
+from job_queue import JobManager, DONE
+from color_index import ColorIndex, METRICS, DEFAULT_METRIC, DEFAULT_CANDIDATES
+from delta_e_matrix import DENSE_FORMATS, SPARSE_FORMATS, DEFAULT_BLOCK_SIZE, delta_e_matrix_job
 
 # Create a Flask application
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
 if not os.path.exists(app.config['UPLOAD_FOLDER']):
     os.makedirs(app.config['UPLOAD_FOLDER'])
-
-# Patch np.asscalar to make it compatible with the newer versions of numpy
-def _patch_asscalar(a):
-    """Alias for np.item(). Patch np.asscalar for colormath.
-
-    :param a: numpy array
-    :return: input array as scalar
-    """
-    return a.item()
-
-# Applying the patch
-np.asscalar = _patch_asscalar
-
-# Function to convert hex color to RGB
-def hex_to_rgb(hex_color):
+# Largest request accepted; bigger uploads are answered with 413 Request Entity Too Large
+app.config['MAX_CONTENT_LENGTH'] = 256 * 2**20
+# Number of color pairs read, compared and written at a time in batch mode
+app.config['CHUNK_SIZE'] = DEFAULT_CHUNK_SIZE
+# Batch files are processed as background jobs, each in its own folder under JOBS_FOLDER
+app.config['JOBS_FOLDER'] = 'jobs'
+app.config['MAX_WORKERS'] = None  # None = one worker process per CPU
+
+# Matrix mode computes the Delta E matrix in tiles of MATRIX_BLOCK_SIZE x MATRIX_BLOCK_SIZE pairs
+app.config['MATRIX_BLOCK_SIZE'] = DEFAULT_BLOCK_SIZE
+
+# Precomputed sRGB -> XYZ / Lab table (built with `python lab_table.py`). Off by default: the lookups
+# are not faster than computing the conversions, and their float32 values can round a Delta E 0.01
+# differently. Set DELTAE_LAB_TABLE (or LAB_TABLE in create_app) to the table's path to memory-map it.
+app.config['LAB_TABLE'] = os.environ.get(LAB_TABLE_ENV)
+if app.config['LAB_TABLE']:
+    use_lab_table(app.config['LAB_TABLE'])
+
+job_manager = JobManager(app.config['JOBS_FOLDER'], max_workers=app.config['MAX_WORKERS'])
+
+# Request, stage and queue metrics are served at /metrics; job workers leave theirs in METRICS_FOLDER.
+# Set ENABLE_PROFILER=1 to also serve /debug/profile?seconds=10 (flame graph samples).
+app.config['METRICS_FOLDER'] = 'metrics'
+app.config['PROFILING'] = os.environ.get('ENABLE_PROFILER', '0') == '1'
+init_metrics_folder(app.config['METRICS_FOLDER'])
+instrument_app(app, profiling=app.config['PROFILING'])
+REGISTRY.gauge('job_queue_depth', 'Jobs submitted by this process that have not finished yet.').set_function(
+    job_manager.queue_depth)
+
+# Color library for nearest-color lookups (.csv, .xlsx or .parquet with hex and name columns).
+# It is loaded into a ColorIndex on first use, or replaced by uploading a new one to /library.
+# The path of the uploaded library is recorded in ACTIVE_LIBRARY, so every worker process picks it up.
+app.config['COLOR_LIBRARY'] = 'color_library.csv'
+app.config['ACTIVE_LIBRARY'] = os.path.join(app.config['UPLOAD_FOLDER'], 'active_library.json')
+app.config['MAX_NEAREST_K'] = 50
+# Limits on the work one /nearest request can ask for
+app.config['MAX_NEAREST_CANDIDATES'] = 1024
+app.config['MAX_NEAREST_PAIRS'] = 2_000_000  # Query colors x candidates compared exactly
+LIBRARY_FORMATS = ('.csv', '.xlsx', '.parquet')
+
+color_index = None
+color_index_source = None  # (path, modification time, size) of the file color_index was loaded from
+color_index_lock = threading.Lock()
+
+# Function to find the library file in use: the last one uploaded to /library, otherwise COLOR_LIBRARY
+def active_library_path():
     try:
-        hex_color = hex_color.lstrip('#')
-        return tuple(int(hex_color[i:i + 2], 16) for i in (0, 2, 4))
-    except ValueError:
-        return None
-
-# Function to convert RGB to XYZ
-def rgb_to_xyz(rgb_value):
-    if rgb_value is None:
-        return None
+        with open(app.config['ACTIVE_LIBRARY']) as file:
+            return json.load(file)['path']
+    except (OSError, ValueError, KeyError):
+        return app.config['COLOR_LIBRARY']
+
+# Function to get the color library index, (re)loading it whenever the library file in use changes
+def get_color_index():
+    global color_index, color_index_source
+    path = active_library_path()
     try:
-        rgb_color = sRGBColor(rgb_value[0], rgb_value[1], rgb_value[2], is_upscaled=True)
-        return convert_color(rgb_color, XYZColor)
-    except Exception:
+        stat = os.stat(path)
+    except OSError:
+        return color_index
+    source = (path, stat.st_mtime_ns, stat.st_size)
+    with color_index_lock:
+        if source != color_index_source:
+            color_index = ColorIndex.from_file(path)
+            color_index_source = source
+        return color_index
+
+# Helpers for turning the vectorized results into JSON friendly values
+def rgb_to_serializable(rgb_value):
+    if np.isnan(rgb_value).any():
         return None
+    return tuple(int(v) for v in rgb_value)
 
-# Function to convert XYZ to Lab
-def xyz_to_lab(xyz_value):
-    if xyz_value is None:
-        return None
-    try:
-        return convert_color(xyz_value, LabColor)
-    except Exception:
+def triplet_to_serializable(values, decimals):
+    if np.isnan(values).any():
         return None
+    return np.round(values, decimals).tolist()
 
-# Function to calculate Delta E values
-def calculate_delta_e(lab1, lab2):
-    if lab1 is None or lab2 is None:
-        return None, None, None
-    try:
-        delta_e_76 = round(delta_e_cie1976(lab1, lab2), 2)
-        delta_e_94 = round(delta_e_cie1994(lab1, lab2), 2)
-        delta_e_00 = round(delta_e_cie2000(lab1, lab2), 2)
-        return delta_e_76, delta_e_94, delta_e_00
-    except Exception:
-        return None, None, None
+def delta_e_to_serializable(delta_e):
+    return None if np.isnan(delta_e) else float(delta_e)
 
 
 # Route for the main page
@@ -89,39 +122,21 @@ def process_single():
     hex_color1 = request.form['color1']
     hex_color2 = request.form['color2']
 
-    rgb_value1 = hex_to_rgb(hex_color1)
-    rgb_value2 = hex_to_rgb(hex_color2)
-
-    xyz_color1 = rgb_to_xyz(rgb_value1)
-    xyz_color2 = rgb_to_xyz(rgb_value2)
-
-    lab_color1 = xyz_to_lab(xyz_color1)
-    lab_color2 = xyz_to_lab(xyz_color2)
-
-    delta_e_76, delta_e_94, delta_e_00 = calculate_delta_e(lab_color1, lab_color2)
-
-    # Convert XYZColor to a list for JSON serialization and round the values (4 decimal places for HTML display)
-    xyz_color1_serializable = [round(xyz_color1.xyz_x, 4), round(xyz_color1.xyz_y, 4), round(xyz_color1.xyz_z, 4)] if xyz_color1 else None
-    xyz_color2_serializable = [round(xyz_color2.xyz_x, 4), round(xyz_color2.xyz_y, 4), round(xyz_color2.xyz_z, 4)] if xyz_color2 else None
-
-    # Convert LabColor to a list for JSON serialization and round the values (2 decimal places for HTML display)
-    lab_color1_serializable = [round(lab_color1.lab_l, 2), round(lab_color1.lab_a, 2), round(lab_color1.lab_b, 2)] if lab_color1 else None
-    lab_color2_serializable = [round(lab_color2.lab_l, 2), round(lab_color2.lab_a, 2), round(lab_color2.lab_b, 2)] if lab_color2 else None
-
+    result = compare_hex_arrays([hex_color1], [hex_color2])
 
     return jsonify({
-        'rgb1': rgb_value1,
-        'xyz1': xyz_color1_serializable,
-        'lab1': lab_color1_serializable,
-        'rgb2': rgb_value2,
-        'xyz2': xyz_color2_serializable,
-        'lab2': lab_color2_serializable,
-        'deltaE76': delta_e_76,
-        'deltaE94': delta_e_94,
-        'deltaE00': delta_e_00
+        'rgb1': rgb_to_serializable(result['rgb1'][0]),
+        'xyz1': triplet_to_serializable(result['xyz1'][0], 4),  # 4 decimal places for HTML display
+        'lab1': triplet_to_serializable(result['lab1'][0], 2),  # 2 decimal places for HTML display
+        'rgb2': rgb_to_serializable(result['rgb2'][0]),
+        'xyz2': triplet_to_serializable(result['xyz2'][0], 4),
+        'lab2': triplet_to_serializable(result['lab2'][0], 2),
+        'deltaE76': delta_e_to_serializable(result['delta_e_76'][0]),
+        'deltaE94': delta_e_to_serializable(result['delta_e_94'][0]),
+        'deltaE00': delta_e_to_serializable(result['delta_e_00'][0])
     })
 
-# Route for processing uploaded Excel file
+# Route for processing an uploaded file of color pairs (Excel, CSV or Parquet)
 @app.route('/upload', methods=['POST'])
 def upload_file():
     if 'file' not in request.files:
@@ -132,85 +147,182 @@ def upload_file():
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
 
-    if file and file.filename.endswith('.xlsx'):
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-        file.save(filepath)
-
-        try:
-            df = pd.read_excel(filepath)
-
-            # Ensure the DataFrame has at least two columns
-            if df.shape[1] < 2:
-                os.remove(filepath)
-                return jsonify({'error': 'Excel file must have at least two columns'}), 400
-
-            # Assuming the first two columns contain the hex color codes
-            df.columns = ['color1_hex', 'color2_hex']
-
-            results = []
-            for index, row in df.iterrows():
-                hex_color1 = str(row['color1_hex']).strip()
-                hex_color2 = str(row['color2_hex']).strip()
-
-                rgb_value1 = hex_to_rgb(hex_color1)
-                rgb_value2 = hex_to_rgb(hex_color2)
-
-                xyz_color1 = rgb_to_xyz(rgb_value1)
-                xyz_color2 = rgb_to_xyz(rgb_value2)
+    output_format = request.form.get('output_format', 'xlsx').lower()
+    if output_format not in OUTPUT_FORMATS:
+        return jsonify({'error': f'Invalid output format. Choose one of: {", ".join(OUTPUT_FORMATS)}'}), 400
 
-                lab_color1 = xyz_to_lab(xyz_color1)
-                lab_color2 = xyz_to_lab(xyz_color2) # Corrected line
-
-                delta_e_76, delta_e_94, delta_e_00 = calculate_delta_e(lab_color1, lab_color2)
-
-                # Increase precision for XYZ and Lab values in the Excel output
-                xyz1_str = str([round(xyz_color1.xyz_x, 4), round(xyz_color1.xyz_y, 4), round(xyz_color1.xyz_z, 4)]) if xyz_color1 else 'N/A'
-                xyz2_str = str([round(xyz_color2.xyz_x, 4), round(xyz_color2.xyz_y, 4), round(xyz_color2.xyz_z, 4)]) if xyz_color2 else 'N/A'
-                lab1_str = str([round(lab_color1.lab_l, 4), round(lab_color1.lab_a, 4), round(lab_color1.lab_b, 4)]) if lab_color1 else 'N/A'
-                lab2_str = str([round(lab_color2.lab_l, 4), round(lab_color2.lab_a, 4), round(lab_color2.lab_b, 4)]) if lab_color2 else 'N/A'
+    if file and file.filename.lower().endswith(INPUT_FORMATS):
+        # Save the upload into a fresh job folder and process it in the background
+        job_id, job_dir = job_manager.create(filename=file.filename, output_format=output_format)
+        extension = os.path.splitext(file.filename)[1].lower()
+        filepath = os.path.join(job_dir, f'input{extension}')
+        file.save(filepath)
+        job_manager.start(job_id, delta_e_job, filepath, output_format=output_format,
+                          chunk_size=app.config['CHUNK_SIZE'])
 
+        return jsonify({
+            'message': 'File queued for processing.',
+            'job_id': job_id,
+            'status_url': f'/jobs/{job_id}'
+        }), 202
 
-                results.append({
-                    'Color 1 (Hex)': hex_color1,
-                    'Color 2 (Hex)': hex_color2,
-                    'RGB 1': str(rgb_value1),
-                    'RGB 2': str(rgb_value2),
-                    'XYZ 1': xyz1_str,
-                    'XYZ 2': xyz2_str,
-                    'Lab 1': lab1_str,
-                    'Lab 2': lab2_str,
-                    '∆E 1976': delta_e_76 if delta_e_76 is not None else 'N/A',
-                    '∆E 1994': delta_e_94 if delta_e_94 is not None else 'N/A',
-                    '∆E 2000': delta_e_00 if delta_e_00 is not None else 'N/A'
-                })
+    else:
+        return jsonify({'error': 'Invalid file type. Please upload an .xlsx, .csv or .parquet file'}), 400
 
-            results_df = pd.DataFrame(results)
-            results_filepath = os.path.join(app.config['UPLOAD_FOLDER'], 'color_comparison_results.xlsx')
-            results_df.to_excel(results_filepath, index=False)
+# Route for computing the all-pairs Delta E matrix of an uploaded color set (or two sets)
+@app.route('/matrix', methods=['POST'])
+def upload_matrix():
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
+    if not file.filename.lower().endswith(INPUT_FORMATS):
+        return jsonify({'error': 'Invalid file type. Please upload an .xlsx, .csv or .parquet file'}), 400
+
+    output = request.form.get('output', 'dense').lower()
+    metric = request.form.get('metric', DEFAULT_METRIC).lower()
+    output_format = request.form.get('output_format', 'csv').lower()
+    if output not in ('dense', 'sparse'):
+        return jsonify({'error': 'Invalid output. Choose dense or sparse'}), 400
+    if metric not in METRICS:
+        return jsonify({'error': f'Invalid metric. Choose one of: {", ".join(METRICS)}'}), 400
+    formats = SPARSE_FORMATS if output == 'sparse' else DENSE_FORMATS
+    if output_format not in formats:
+        return jsonify({'error': f'Invalid output format. Choose one of: {", ".join(formats)}'}), 400
+    threshold = None
+    if output == 'sparse':
+        try:
+            threshold = float(request.form.get('threshold', ''))
+        except ValueError:
+            return jsonify({'error': 'A numeric Delta E threshold is required for sparse output'}), 400
 
-            os.remove(filepath)
+    job_id, job_dir = job_manager.create(filename=file.filename, mode='matrix', output=output, metric=metric)
+    extension = os.path.splitext(file.filename)[1].lower()
+    filepath = os.path.join(job_dir, f'input{extension}')
+    file.save(filepath)
+    job_manager.start(job_id, delta_e_matrix_job, filepath, output=output, metric=metric, threshold=threshold,
+                      output_format=output_format, block_size=app.config['MATRIX_BLOCK_SIZE'])
 
-            return jsonify({
-                'message': 'File processed successfully.',
-                'download_url': '/download/color_comparison_results.xlsx'
-            })
+    return jsonify({
+        'message': 'File queued for processing.',
+        'job_id': job_id,
+        'status_url': f'/jobs/{job_id}'
+    }), 202
+
+# Route for checking the status and progress of a batch job
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    status = job_manager.status(job_id)
+    if status is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if status['status'] == DONE:
+        status['download_url'] = f'/jobs/{job_id}/download'
+    return jsonify(status)
+
+# Route for cancelling a queued or running batch job
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    if job_manager.status(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if not job_manager.cancel(job_id):
+        return jsonify({'error': 'Job has already finished'}), 409
+    return jsonify({'message': 'Job cancelled.'})
+
+# Route to download the results of a finished batch job
+@app.route('/jobs/<job_id>/download')
+def download_job_result(job_id):
+    status = job_manager.status(job_id)
+    if status is None or status['status'] != DONE:
+        return jsonify({'error': 'File not found'}), 404
+    filepath = os.path.join(job_manager.job_dir(job_id), status['result']['filename'])
+    return send_file(os.path.abspath(filepath), as_attachment=True)
+
+# Route for uploading a color library, which replaces the current one
+@app.route('/library', methods=['POST'])
+def upload_library():
+    global color_index, color_index_source
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
+    extension = os.path.splitext(file.filename)[1].lower()
+    if extension not in LIBRARY_FORMATS:
+        return jsonify({'error': 'Invalid file type. Please upload an .xlsx, .csv or .parquet file'}), 400
 
-        except Exception as e:
-            os.remove(filepath)
-            return jsonify({'error': f'Error processing file: {str(e)}'}), 500
+    # Check the upload before it replaces the library in use
+    temp_path = os.path.join(app.config['UPLOAD_FOLDER'], f'color_library-{uuid.uuid4().hex}{extension}')
+    file.save(temp_path)
+    try:
+        index = ColorIndex.from_file(temp_path)
+    except Exception as e:
+        os.remove(temp_path)
+        return jsonify({'error': f'Could not read the color library: {e}'}), 400
+
+    # Move it into place and record it as the active library; the other workers reload it on their next lookup
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], f'color_library{extension}')
+    os.replace(temp_path, filepath)
+    pointer_path = app.config['ACTIVE_LIBRARY']
+    with open(f'{pointer_path}.{os.getpid()}.tmp', 'w') as pointer:
+        json.dump({'path': filepath}, pointer)
+    os.replace(f'{pointer_path}.{os.getpid()}.tmp', pointer_path)
+    stat = os.stat(filepath)
+    with color_index_lock:
+        color_index = index
+        color_index_source = (filepath, stat.st_mtime_ns, stat.st_size)
+    return jsonify({'message': 'Color library loaded.', 'colors': len(index), 'skipped': index.skipped})
+
+# Route for information about the loaded color library
+@app.route('/library')
+def library_info():
+    index = get_color_index()
+    if index is None:
+        return jsonify({'error': 'No color library loaded'}), 404
+    return jsonify({'colors': len(index), 'skipped': index.skipped, 'metrics': list(METRICS)})
+
+# Route for finding the closest library colors to a batch of colors
+@app.route('/nearest', methods=['POST'])
+def nearest_colors():
+    """JSON body: {"colors": [...], "k": 5, "metric": "cie2000"}.
+
+    "colors" is a list of hex codes (e.g. process_image's palette) or an object of lists
+    (e.g. process_image_all_colors' {"pink": [...], ...}); the results have the same shape.
+    """
+    index = get_color_index()
+    if index is None:
+        return jsonify({'error': 'No color library loaded'}), 404
 
+    body = request.get_json(silent=True) or {}
+    colors = body.get('colors')
+    metric = str(body.get('metric', DEFAULT_METRIC)).lower()
+    try:
+        k = int(body.get('k', 5))
+        candidates = int(body.get('candidates', DEFAULT_CANDIDATES))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'k and candidates must be integers'}), 400
+    if metric not in METRICS:
+        return jsonify({'error': f'Invalid metric. Choose one of: {", ".join(METRICS)}'}), 400
+    if not 1 <= k <= app.config['MAX_NEAREST_K']:
+        return jsonify({'error': f'k must be between 1 and {app.config["MAX_NEAREST_K"]}'}), 400
+    if not 1 <= candidates <= app.config['MAX_NEAREST_CANDIDATES']:
+        return jsonify({'error': f'candidates must be between 1 and {app.config["MAX_NEAREST_CANDIDATES"]}'}), 400
+
+    if isinstance(colors, dict) and all(isinstance(v, list) for v in colors.values()):
+        groups = colors
+    elif isinstance(colors, list):
+        groups = {None: colors}
     else:
-        return jsonify({'error': 'Invalid file type. Please upload an .xlsx file'}), 400
-
-# Route to download the results file
-@app.route('/download/<filename>')
-def download_file(filename):
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    if os.path.exists(filepath):
-        return send_file(filepath, as_attachment=True)
-    else:
-        return jsonify({'error': 'File not found'}), 404
-
+        return jsonify({'error': 'colors must be a list of hex codes or an object of lists'}), 400
+
+    # Answer every group in one batch
+    queries = [str(color) for group in groups.values() for color in group]
+    n_candidates = min(max(candidates, k), len(index))
+    if len(queries) * n_candidates > app.config['MAX_NEAREST_PAIRS']:
+        return jsonify({'error': f'Too many comparisons ({len(queries)} colors x {n_candidates} candidates); '
+                                 f'send at most {app.config["MAX_NEAREST_PAIRS"]} per request'}), 400
+    with span('nearest_lookup'):
+        matches = iter(index.matches(queries, k=k, metric=metric, candidates=candidates))
+    results = {name: [{'query': str(color), 'matches': next(matches)} for color in group]
+               for name, group in groups.items()}
+
+    return jsonify({'metric': metric, 'k': k, 'results': results[None] if None in results else results})
 
 # Function to open the browser
 def open_browser():
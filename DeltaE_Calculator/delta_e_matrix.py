@@ -0,0 +1,238 @@
+'''
+All-Pairs Delta E Matrix
+
+Computes the Delta E between every color of one set and every color of another (N x M), or
+between every two colors of a single set (N x N), e.g. to find near-duplicates inside a palette.
+
+The matrix is computed in square tiles of block_size x block_size pairs with the vectorized
+formulas from color_arrays.py, and each part is written out before the next one is computed, so
+memory use depends on the block size and not on N x M. The .npy and sparse outputs are written
+tile by tile. CSV rows must be written whole, so the CSV table is written in strips of as many
+rows as fit in block_size x block_size values (at least one row, so at most max(block_size^2, M)
+values). There are two outputs:
+
+    - dense:  the full matrix for one metric, as a labelled CSV table or a float32 .npy file
+    - sparse: only the pairs whose Delta E (for the chosen metric) is at most a threshold, one row
+              per pair with all three Delta E values, as CSV or Parquet. For a single set each
+              pair is listed once (i < j) and colors are not compared with themselves.
+
+CIE94 is not symmetric: like colormath, its weights come from the first color, which here is
+the row color.
+
+'''
+import os
+import numpy as np
+import pandas as pd
+from color_arrays import hex_to_lab_array, delta_e_cie76_array, delta_e_cie94_array, delta_e_cie2000_array
+from color_index import METRICS, DEFAULT_METRIC
+from batch_processing import DELTA_E_COLUMNS
+from metrics import span
+
+DEFAULT_BLOCK_SIZE = 512
+
+DENSE_FORMATS = ('csv', 'npy')
+SPARSE_FORMATS = ('csv', 'parquet')
+
+
+# Function to read one or two color sets from the first two columns of a CSV, Parquet or Excel file
+def read_color_sets(filepath):
+    """Return (hex_colors1, hex_colors2); hex_colors2 is None when the file has a single column
+    (or an empty second column), meaning the first set is compared with itself."""
+    extension = os.path.splitext(filepath)[1].lower()
+    if extension == '.csv':
+        df = pd.read_csv(filepath, dtype=str)
+    elif extension == '.parquet':
+        df = pd.read_parquet(filepath)
+    elif extension == '.xlsx':
+        df = pd.read_excel(filepath, dtype=str)
+    else:
+        raise ValueError(f'Unsupported file type: {extension}')
+    if df.shape[1] == 0:
+        raise ValueError('File must have at least one column')
+
+    # The two sets can have different lengths, so drop the empty cells of each column separately
+    sets = [df.iloc[:, i].dropna().astype(str).str.strip().to_numpy() for i in range(min(df.shape[1], 2))]
+    if len(sets) == 1 or len(sets[1]) == 0:
+        return sets[0], None
+    return sets[0], sets[1]
+
+
+# Function to compute one tile of the matrix: Delta E between every row color and every column color
+def delta_e_tile(lab_rows, lab_cols, metric=DEFAULT_METRIC):
+    with span('matrix_tile'), np.errstate(invalid='ignore'):
+        return METRICS[metric](lab_rows[:, None, :], lab_cols[None, :, :])
+
+
+# Function to yield (row_start, col_start, tile) for every tile of the matrix, one band of rows at a time
+def iter_matrix_tiles(lab_rows, lab_cols, metric=DEFAULT_METRIC, block_size=DEFAULT_BLOCK_SIZE):
+    for row_start in range(0, len(lab_rows), block_size):
+        rows = lab_rows[row_start:row_start + block_size]
+        for col_start in range(0, len(lab_cols), block_size):
+            yield row_start, col_start, delta_e_tile(rows, lab_cols[col_start:col_start + block_size], metric)
+
+
+# Function to yield (row_start, matrix rows) strips of whole rows, of at most block_size x block_size
+# values (or one row, when a row alone is longer than that)
+def iter_matrix_blocks(lab_rows, lab_cols, metric=DEFAULT_METRIC, block_size=DEFAULT_BLOCK_SIZE):
+    rows_per_block = max(1, min(block_size, block_size * block_size // max(len(lab_cols), 1)))
+    for row_start in range(0, len(lab_rows), rows_per_block):
+        rows = lab_rows[row_start:row_start + rows_per_block]
+        block = np.empty((len(rows), len(lab_cols)), dtype=np.float32)
+        for col_start in range(0, len(lab_cols), block_size):
+            col_end = col_start + block_size
+            block[:, col_start:col_end] = delta_e_tile(rows, lab_cols[col_start:col_end], metric)
+        yield row_start, block
+
+
+# Function to compute the dense matrix in memory (for sets small enough to hold N x M values)
+def delta_e_matrix(hex_colors1, hex_colors2=None, metric=DEFAULT_METRIC, block_size=DEFAULT_BLOCK_SIZE):
+    lab_rows = hex_to_lab_array(hex_colors1)
+    lab_cols = lab_rows if hex_colors2 is None else hex_to_lab_array(hex_colors2)
+    matrix = np.empty((len(lab_rows), len(lab_cols)), dtype=np.float32)
+    for row_start, col_start, tile in iter_matrix_tiles(lab_rows, lab_cols, metric, block_size):
+        matrix[row_start:row_start + tile.shape[0], col_start:col_start + tile.shape[1]] = tile
+    return matrix
+
+
+# Function to build the table of pairs (i, j): their indices, colors and all three Delta E values
+def pairs_frame(i, j, hex_colors1, hex_colors2, lab_rows, lab_cols):
+    lab1, lab2 = lab_rows[i], lab_cols[j]
+    return pd.DataFrame({
+        'Index 1': i,
+        'Index 2': j,
+        'Color 1 (Hex)': np.asarray(hex_colors1)[i],
+        'Color 2 (Hex)': np.asarray(hex_colors2)[j],
+        DELTA_E_COLUMNS[0]: np.round(delta_e_cie76_array(lab1, lab2), 2),
+        DELTA_E_COLUMNS[1]: np.round(delta_e_cie94_array(lab1, lab2), 2),
+        DELTA_E_COLUMNS[2]: np.round(delta_e_cie2000_array(lab1, lab2), 2),
+    })
+
+
+# Function to yield DataFrames of the pairs whose Delta E is at most the threshold, tile by tile
+def iter_close_pairs(hex_colors1, hex_colors2=None, threshold=2.0, metric=DEFAULT_METRIC,
+                     block_size=DEFAULT_BLOCK_SIZE):
+    """Yield (rows_done, pairs DataFrame) after each block of rows.
+
+    Each pair row has the two indices and colors and all three Delta E values (rounded to 2 places).
+    """
+    self_pairs = hex_colors2 is None
+    hex_colors2 = hex_colors1 if self_pairs else hex_colors2
+    lab_rows = hex_to_lab_array(hex_colors1)
+    lab_cols = lab_rows if self_pairs else hex_to_lab_array(hex_colors2)
+
+    for row_start in range(0, len(lab_rows), block_size):
+        rows = lab_rows[row_start:row_start + block_size]
+        found_rows, found_cols = [], []
+        # For a single set only the upper triangle (j > i) is needed
+        first_col = row_start if self_pairs else 0
+        for col_start in range(first_col, len(lab_cols), block_size):
+            tile = delta_e_tile(rows, lab_cols[col_start:col_start + block_size], metric)
+            with np.errstate(invalid='ignore'):
+                close = tile <= threshold
+            if self_pairs:
+                row_index = np.arange(row_start, row_start + len(rows))[:, None]
+                col_index = np.arange(col_start, col_start + tile.shape[1])[None, :]
+                close &= col_index > row_index
+            i, j = np.nonzero(close)
+            found_rows.append(i + row_start)
+            found_cols.append(j + col_start)
+
+        i = np.concatenate(found_rows) if found_rows else np.empty(0, dtype=np.intp)
+        j = np.concatenate(found_cols) if found_cols else np.empty(0, dtype=np.intp)
+        # All three Delta E values, only for the pairs that passed the threshold
+        yield row_start + len(rows), pairs_frame(i, j, hex_colors1, hex_colors2, lab_rows, lab_cols)
+
+
+# Function to write the dense matrix for one metric to a .npy file (tile by tile) or a CSV table
+# (strip by strip)
+def write_dense_matrix(output_path, hex_colors1, hex_colors2=None, metric=DEFAULT_METRIC, output_format='csv',
+                       block_size=DEFAULT_BLOCK_SIZE, progress_callback=None):
+    col_labels = hex_colors1 if hex_colors2 is None else hex_colors2
+    lab_rows = hex_to_lab_array(hex_colors1)
+    lab_cols = lab_rows if hex_colors2 is None else hex_to_lab_array(hex_colors2)
+
+    if output_format == 'npy':
+        matrix = np.lib.format.open_memmap(output_path, mode='w+', dtype=np.float32,
+                                           shape=(len(lab_rows), len(lab_cols)))
+        for row_start, col_start, tile in iter_matrix_tiles(lab_rows, lab_cols, metric, block_size):
+            matrix[row_start:row_start + tile.shape[0], col_start:col_start + tile.shape[1]] = tile
+            # Report progress once the last tile of a band of rows is written
+            if progress_callback is not None and col_start + tile.shape[1] == len(lab_cols):
+                progress_callback(row_start + tile.shape[0])
+        matrix.flush()
+        del matrix
+        return len(lab_rows) * len(lab_cols)
+
+    for row_start, block in iter_matrix_blocks(lab_rows, lab_cols, metric, block_size):
+        df = pd.DataFrame(np.round(block, 2), columns=col_labels)
+        df.insert(0, 'Color', hex_colors1[row_start:row_start + len(block)])
+        df.to_csv(output_path, mode='a' if row_start else 'w', header=row_start == 0, index=False)
+        if progress_callback is not None:
+            progress_callback(row_start + len(block))
+    if len(lab_rows) == 0:
+        pd.DataFrame(columns=['Color'] + list(col_labels)).to_csv(output_path, index=False)
+    return len(lab_rows) * len(lab_cols)
+
+
+# Function to write the pairs at or below the threshold to CSV or Parquet, block by block
+def write_close_pairs(output_path, hex_colors1, hex_colors2=None, threshold=2.0, metric=DEFAULT_METRIC,
+                      output_format='csv', block_size=DEFAULT_BLOCK_SIZE, progress_callback=None):
+    def write(pairs, first):
+        if output_format == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            nonlocal parquet_writer
+            table = pa.Table.from_pandas(pairs, preserve_index=False)
+            if parquet_writer is None:
+                parquet_writer = pq.ParquetWriter(output_path, table.schema)
+            parquet_writer.write_table(table.cast(parquet_writer.schema))
+        else:
+            pairs.to_csv(output_path, mode='w' if first else 'a', header=first, index=False)
+
+    parquet_writer = None
+    pairs_found = 0
+    blocks = 0
+    try:
+        for rows_done, pairs in iter_close_pairs(hex_colors1, hex_colors2, threshold, metric, block_size):
+            write(pairs, first=blocks == 0)
+            blocks += 1
+            pairs_found += len(pairs)
+            if progress_callback is not None:
+                progress_callback(rows_done)
+        if blocks == 0:
+            # Empty input: still write a file with the column headers
+            empty = np.empty(0, dtype=np.intp)
+            no_lab = np.empty((0, 3))
+            write(pairs_frame(empty, empty, hex_colors1, hex_colors1, no_lab, no_lab), first=True)
+    finally:
+        if parquet_writer is not None:
+            parquet_writer.close()
+    return pairs_found
+
+
+# Job function for the background queue: compute the matrix of an uploaded file inside its job directory
+def delta_e_matrix_job(job, input_path, output='dense', metric=DEFAULT_METRIC, threshold=None,
+                       output_format='csv', block_size=DEFAULT_BLOCK_SIZE):
+    try:
+        hex_colors1, hex_colors2 = read_color_sets(input_path)
+    finally:
+        os.remove(input_path)
+    total_rows = len(hex_colors1)
+    n_cols = total_rows if hex_colors2 is None else len(hex_colors2)
+
+    def report_progress(rows_done):
+        job.update(progress=rows_done / total_rows if total_rows else None,
+                   message=f'{rows_done} of {total_rows} rows of the {total_rows} x {n_cols} matrix done')
+
+    if output == 'sparse':
+        output_filename = f'delta_e_pairs.{output_format}'
+        pairs = write_close_pairs(job.path(output_filename), hex_colors1, hex_colors2, threshold=threshold,
+                                  metric=metric, output_format=output_format, block_size=block_size,
+                                  progress_callback=report_progress)
+    else:
+        output_filename = f'delta_e_matrix.{output_format}'
+        pairs = write_dense_matrix(job.path(output_filename), hex_colors1, hex_colors2, metric=metric,
+                                   output_format=output_format, block_size=block_size,
+                                   progress_callback=report_progress)
+    return {'rows': pairs, 'filename': output_filename, 'shape': [total_rows, n_cols]}
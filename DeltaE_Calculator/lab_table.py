@@ -0,0 +1,92 @@
+'''
+Precomputed sRGB -> XYZ / Lab Table
+
+There are only 2^24 (16.7 million) 8-bit sRGB colors, so instead of running every color
+through the companding, matrix and Lab transfer function, the XYZ and Lab values of all of
+them can be computed once and looked up afterwards.
+
+The table is a float32 .npy file of shape (2^24, 6): row (R << 16) | (G << 8) | B holds
+X, Y, Z, L, a, b for that color (384 MB). It is opened with mmap_mode='r', so it is never
+read into memory as a whole: the operating system pages in the parts that are used, and every
+process that opens the same file (the Flask app and its job workers) shares those pages.
+
+Values are stored as float32, which is within about 1e-5 of the float64 computation; that is
+far below the 4 (XYZ) and 2 (Lab, Delta E) decimal places the app reports, though a Delta E
+that lies exactly on a rounding boundary can come out 0.01 apart.
+
+Usage:
+    python lab_table.py [output path]
+
+'''
+import argparse
+import os
+import sys
+import numpy as np
+from numpy.lib.format import open_memmap
+from color_arrays import rgb_to_xyz_array, xyz_to_lab_array
+
+DEFAULT_LAB_TABLE = 'srgb_lab_table.npy'
+TABLE_SHAPE = (1 << 24, 6)
+BUILD_CHUNK_SIZE = 1 << 20
+
+
+# Function to pack an (N, 3) array of valid RGB values (0-255) into table row numbers
+def rgb_to_table_index(rgb):
+    rgb = np.asarray(rgb).astype(np.int64)
+    return (rgb[:, 0] << 16) | (rgb[:, 1] << 8) | rgb[:, 2]
+
+
+# Function to compute every row of the table and write it to a .npy file
+def build_lab_table(path=DEFAULT_LAB_TABLE, chunk_size=BUILD_CHUNK_SIZE):
+    """Build the table chunk by chunk into a temporary file, then move it into place,
+    so a process opening `path` never sees a half-written table."""
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    table = open_memmap(temp_path, mode='w+', dtype=np.float32, shape=TABLE_SHAPE)
+    for start in range(0, TABLE_SHAPE[0], chunk_size):
+        index = np.arange(start, min(start + chunk_size, TABLE_SHAPE[0]))
+        rgb = np.stack([(index >> 16) & 0xFF, (index >> 8) & 0xFF, index & 0xFF], axis=1)
+        xyz = rgb_to_xyz_array(rgb)
+        table[start:start + len(index), :3] = xyz
+        table[start:start + len(index), 3:] = xyz_to_lab_array(xyz)
+    table.flush()
+    del table
+    os.replace(temp_path, path)
+    return path
+
+
+# Function to open a table file read-only and memory-mapped
+def open_lab_table(path=DEFAULT_LAB_TABLE):
+    table = np.load(path, mmap_mode='r')
+    if table.shape != TABLE_SHAPE or table.dtype != np.float32:
+        raise ValueError(f'{path} is not an sRGB -> Lab table (expected float32 {TABLE_SHAPE}, '
+                         f'got {table.dtype} {table.shape})')
+    return table
+
+
+# Function to look up the XYZ and Lab values of an (N, 3) RGB array (NaN rows stay NaN)
+def lookup_xyz_lab(table, rgb):
+    """:return: ((N, 3) XYZ array, (N, 3) Lab array), both float64 like the direct conversion"""
+    rgb = np.asarray(rgb, dtype=np.float64)
+    values = np.full((rgb.shape[0], 6), np.nan)
+    valid = ~np.isnan(rgb).any(axis=1)
+    index = rgb_to_table_index(rgb[valid])
+    # Sorted indices make the gather walk the file in order instead of jumping between pages
+    order = np.argsort(index, kind='stable')
+    gathered = np.empty((len(index), 6))
+    gathered[order] = table[index[order]]
+    values[valid] = gathered
+    return values[:, :3], values[:, 3:]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build the precomputed sRGB -> XYZ / Lab lookup table.')
+    parser.add_argument('path', nargs='?', default=DEFAULT_LAB_TABLE, help=f'output .npy file ({DEFAULT_LAB_TABLE})')
+    args = parser.parse_args(argv)
+    print(f'Building {args.path} ({TABLE_SHAPE[0]:,} colors, {np.prod(TABLE_SHAPE) * 4 / 2**20:.0f} MB)...')
+    build_lab_table(args.path)
+    print('Done.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,57 @@
+'''
+Tests for color_arrays.py
+
+Checks compare_hex_arrays against Delta E values computed with colormath 3.0.0 (the library
+the vectorized formulas replaced), rounded to 2 places as the app reports them, so the formulas
+cannot drift from colormath's. Invalid colors must give NaN rather than a number.
+
+Usage:
+    python -m pytest test_color_arrays.py
+
+'''
+import numpy as np
+import pytest
+from color_arrays import compare_hex_arrays
+
+# (color 1, color 2, CIE76, CIE94, CIEDE2000) from colormath's delta_e_cie1976 / 1994 / 2000
+COLORMATH_DELTA_E = [
+    ('#000000', '#ffffff', 100.0, 100.0, 100.0),
+    ('#ff0000', '#00ff00', 170.56, 73.43, 86.61),
+    ('#0000ff', '#ffff00', 235.15, 98.65, 103.43),
+    ('#123456', '#123457', 0.71, 0.41, 0.31),
+    ('#808080', '#7f7f7f', 0.39, 0.39, 0.38),
+    ('#ff5733', '#33ff57', 144.18, 68.79, 78.05),
+    ('#e0b0ff', '#dda0dd', 11.74, 7.57, 6.87),
+    ('#00ffff', '#008080', 47.32, 43.3, 34.04),
+    ('#fedcba', '#abcdef', 43.69, 33.3, 30.11),
+    ('#654321', '#123456', 52.31, 37.39, 33.6),
+    ('#a52a2a', '#800000', 14.25, 12.6, 10.38),
+    ('#ffffff', '#ffffff', 0.0, 0.0, 0.0),
+    ('FF8800', '#ff8801', 0.14, 0.04, 0.05),
+    ('#3c3c3c', '#c3c3c3', 53.48, 53.48, 52.8),
+]
+
+# Pairs where at least one color is not a valid hex color
+INVALID_PAIRS = [
+    ('#zzzzzz', '#ffffff'),
+    ('#ffffff', '#12'),
+    ('', '#000000'),
+    (None, '#000000'),
+    ('#000000', None),
+]
+
+
+def test_matches_colormath():
+    colors1, colors2, *expected = zip(*COLORMATH_DELTA_E)
+    result = compare_hex_arrays(list(colors1), list(colors2))
+    for key, values in zip(('delta_e_76', 'delta_e_94', 'delta_e_00'), expected):
+        np.testing.assert_array_equal(result[key], np.array(values), err_msg=key)
+
+
+@pytest.mark.parametrize('color1, color2', INVALID_PAIRS)
+def test_invalid_colors_give_nan(color1, color2):
+    # Mixed in with a valid pair, which must be unaffected
+    result = compare_hex_arrays([color1, '#000000'], [color2, '#ffffff'])
+    for key in ('delta_e_76', 'delta_e_94', 'delta_e_00'):
+        assert np.isnan(result[key][0])
+        assert result[key][1] == 100.0
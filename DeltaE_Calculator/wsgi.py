@@ -0,0 +1,62 @@
+'''
+WSGI Entry Point
+
+Production entry point for the Delta E Calculator, served by gunicorn with gunicorn.conf.py:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+create_app() prepares the app defined in compute_DeltaE.py for serving from several worker processes:
+
+    - the Lab lookup table (when LAB_TABLE is set) and the color library index are loaded up front. With
+      preload_app this happens once, in the gunicorn master, and the forked workers share the
+      memory-mapped table and the index's arrays copy-on-write instead of each loading its own
+    - each web worker's job process pool gets an equal share of the CPUs
+    - back-pressure: a worker already handling MAX_IN_FLIGHT requests answers further ones with
+      503 (status polling and downloads excepted), and new batch and matrix jobs are refused with
+      503 while MAX_QUEUED_JOBS of this worker's jobs are waiting or running
+
+'''
+import compute_DeltaE
+from color_arrays import use_lab_table
+from serving import job_workers_per_process, limit_in_flight, shed_load
+
+# Serving settings; any of them (and any other app.config key) can be overridden with create_app(config)
+SERVING_CONFIG = {
+    'MAX_IN_FLIGHT': 3,  # gunicorn.conf.py runs 4 threads per worker, so one is always left for polling
+    'MAX_QUEUED_JOBS': None,  # None = 4 per job worker process
+}
+
+# Endpoints that are cheap to answer and never limited
+LIGHT_ENDPOINTS = {'index', 'job_status', 'cancel_job', 'download_job_result', 'library_info'}
+
+
+# Function to configure the Delta E Calculator for production serving
+def create_app(config=None):
+    app = compute_DeltaE.app
+    if 'serving' in app.extensions:
+        # The app is created once, when compute_DeltaE is imported, so a later config could not be applied
+        if config is not None and config != app.extensions['serving']:
+            raise RuntimeError('create_app() was already called with a different config; '
+                               'change the create_app() call in wsgi.py instead')
+        return app
+    app.config.update(SERVING_CONFIG)
+    app.config['MAX_WORKERS'] = job_workers_per_process()
+    app.config.update(config or {})
+    if app.config['MAX_QUEUED_JOBS'] is None:
+        app.config['MAX_QUEUED_JOBS'] = 4 * app.config['MAX_WORKERS']
+
+    job_manager = compute_DeltaE.job_manager
+    job_manager.max_workers = app.config['MAX_WORKERS']  # The pool itself is only started by the first job
+
+    # Shared read-only data, loaded before the workers are forked
+    use_lab_table(app.config['LAB_TABLE'])
+    compute_DeltaE.get_color_index()
+
+    limit_in_flight(app, app.config['MAX_IN_FLIGHT'], exempt=LIGHT_ENDPOINTS)
+    shed_load(app, lambda: job_manager.queue_depth() >= app.config['MAX_QUEUED_JOBS'],
+              endpoints={'upload_file', 'upload_matrix'})
+    app.extensions['serving'] = dict(config or {})
+    return app
+
+
+app = create_app()
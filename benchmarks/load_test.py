@@ -0,0 +1,304 @@
+'''
+Load Test
+
+Serves each tool with gunicorn (its wsgi.py and gunicorn.conf.py) at increasing worker counts and
+drives it with concurrent HTTP clients, to show how throughput scales with the number of worker
+processes and how the servers behave when they are saturated:
+
+    - deltae:       POST /process with random color pairs
+    - palette:      POST / uploading a training image in 'palette' mode (served from the result
+                    cache after the first upload, so this measures the web tier, not the job pool)
+    - image2prompt: POST / uploading a training image (decode, resize, preview, prompt cache hit)
+                    against the local stub API, without the InceptionV3 model
+
+Each run starts a fresh server in a temporary folder with WEB_CONCURRENCY workers, waits for it to
+answer /metrics, warms it up, and then runs closed-loop clients (each in its own process, one
+request at a time over a keep-alive connection) for --duration seconds. By default there are
+--clients-per-worker clients per worker, so every worker count sees the same load per worker.
+
+For each worker count the test records successful requests per second, latency percentiles of the
+successful requests, the number of requests turned away with 503 (back-pressure) and any other
+errors, and the speed-up over the smallest worker count.
+
+Usage:
+    python load_test.py --suite deltae
+    python load_test.py --suite palette --workers 1 2 4 8 --duration 20
+    python load_test.py --suite image2prompt --concurrency 32 --output image2prompt_load.json
+
+'''
+import argparse
+import http.client
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlencode
+from run_benchmarks import SUITE_ENV, SUITE_FOLDERS, STUB_JITTER, STUB_LATENCY, random_hex_pairs, training_images
+
+DEFAULT_WORKERS = (1, 2, 4)
+CLIENTS_PER_WORKER = 2
+DURATION = 15
+WARMUP = 3
+START_TIMEOUT = 120
+
+# Seconds a client waits after a 503 before sending its next request
+REJECTED_BACKOFF = 0.05
+
+
+# Function to find a free local TCP port
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# Function to encode form fields and files as multipart/form-data
+def multipart_body(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n'.encode() + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+
+
+# Function to read the first training image as (filename, bytes)
+def first_training_image():
+    images = training_images(quick=True)
+    if not images:
+        raise RuntimeError('No images found in training images/')
+    with open(images[0], 'rb') as file:
+        return os.path.basename(images[0]), file.read()
+
+
+# --- Requests sent by each suite: lists of (method, path, body, headers) -------------------------
+
+def deltae_requests():
+    hex_colors1, hex_colors2 = random_hex_pairs(1000)
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    return [('POST', '/process', urlencode({'color1': color1, 'color2': color2}).encode(), headers)
+            for color1, color2 in zip(hex_colors1, hex_colors2)]
+
+
+def palette_requests():
+    body, headers = multipart_body({'mode': 'palette', 'quantizer': 'kmeans'}, {'file': first_training_image()})
+    return [('POST', '/', body, headers)]
+
+
+def image2prompt_requests():
+    body, headers = multipart_body({}, {'file': first_training_image()})
+    return [('POST', '/', body, headers)]
+
+
+SUITE_REQUESTS = {
+    'deltae': deltae_requests,
+    'palette': palette_requests,
+    'image2prompt': image2prompt_requests,
+}
+
+
+# Function to send one request and return (status, response body)
+def send(connection, method, path, body=None, headers=None):
+    connection.request(method, path, body=body, headers=headers or {})
+    response = connection.getresponse()
+    return response.status, response.read()
+
+
+# Function to warm a server up with its first request (which fills the prompt or palette cache)
+def warm_up(suite, port, requests):
+    method, path, body, headers = requests[0]
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=300)
+    try:
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        if suite != 'palette':
+            return
+        # The first upload runs as a background job; wait for it, so later uploads are cache hits
+        job_id = response.getheader('Location', '').rstrip('/').rsplit('/', 1)[-1]
+        deadline = time.monotonic() + START_TIMEOUT
+        while time.monotonic() < deadline:
+            status, data = send(connection, 'GET', f'/jobs/{job_id}')
+            if status == 200 and json.loads(data)['status'] in ('done', 'failed', 'cancelled'):
+                return
+            time.sleep(0.5)
+        raise RuntimeError('The palette job did not finish during warm-up')
+    finally:
+        connection.close()
+
+
+# Client process: send requests in a loop until `until`, returning (start time, latency, status) tuples
+def run_client(port, requests, offset, until):
+    records = []
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    index = offset
+    while time.time() < until:
+        method, path, body, headers = requests[index % len(requests)]
+        index += 1
+        start = time.time()
+        try:
+            status, _ = send(connection, method, path, body, headers)
+        except (OSError, http.client.HTTPException):
+            status = 0
+            connection.close()
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        records.append((start, time.time() - start, status))
+        if status == 503:
+            time.sleep(REJECTED_BACKOFF)
+    connection.close()
+    return records
+
+
+# Function to start gunicorn for a suite in work_dir and wait until it answers
+def start_server(suite, workers, port, work_dir, env):
+    folder = SUITE_FOLDERS[suite]
+    env = dict(env, WEB_CONCURRENCY=str(workers))
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [folder, env.get('PYTHONPATH')]))
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', os.path.join(folder, 'gunicorn.conf.py'),
+                               '--bind', f'127.0.0.1:{port}', '--log-level', 'warning', 'wsgi:app'],
+                              cwd=work_dir, env=env)
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with code {server.returncode}')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            status, _ = send(connection, 'GET', '/metrics')
+            connection.close()
+            if status == 200:
+                return server
+        except OSError:
+            pass
+        time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError('gunicorn did not start in time')
+
+
+def stop_server(server):
+    server.terminate()
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+# Function to start the stub NOVITA API in this process, returning its URL
+def start_stub_api():
+    import logging
+    import threading
+    from werkzeug.serving import make_server
+    sys.path.insert(0, SUITE_FOLDERS['image2prompt'])
+    from stub_novita_server import create_stub_app
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, create_stub_app(latency=STUB_LATENCY, jitter=STUB_JITTER), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}/v3/img2prompt'
+
+
+# Function to summarize the records of one run
+def summarize(records, started, duration):
+    import numpy as np
+    measured = [record for record in records if record[0] >= started]
+    ok = [latency for _, latency, status in measured if 200 <= status < 400]
+    result = {
+        'requests': len(ok),
+        'throughput_per_s': len(ok) / duration,
+        'rejected': sum(1 for _, _, status in measured if status == 503),
+        'errors': sum(1 for _, _, status in measured if not (200 <= status < 400 or status == 503)),
+    }
+    if ok:
+        p50, p95, p99 = np.percentile(ok, [50, 95, 99]) * 1000
+        result.update(latency_p50_ms=float(p50), latency_p95_ms=float(p95), latency_p99_ms=float(p99))
+    return result
+
+
+# Function to load test one suite at one worker count
+def run_load(suite, workers, concurrency, duration, warmup, env):
+    requests = SUITE_REQUESTS[suite]()
+    port = free_port()
+    with tempfile.TemporaryDirectory(prefix=f'load_test_{suite}_') as work_dir:
+        if suite == 'image2prompt':
+            with open(os.path.join(work_dir, 'config.txt'), 'w') as file:
+                file.write('NOVITA_API_KEY=stub-key\n')
+        server = start_server(suite, workers, port, work_dir, env)
+        try:
+            warm_up(suite, port, requests)
+            started = time.time() + warmup
+            until = started + duration
+            with ProcessPoolExecutor(max_workers=concurrency) as clients:
+                futures = [clients.submit(run_client, port, requests, i * 97, until) for i in range(concurrency)]
+                records = [record for future in futures for record in future.result()]
+        finally:
+            stop_server(server)
+    return dict(workers=workers, concurrency=concurrency, **summarize(records, started, duration))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the tools under gunicorn at several worker counts.')
+    parser.add_argument('--suite', action='append', choices=list(SUITE_REQUESTS),
+                        help='suite to run (can be repeated; default: all)')
+    parser.add_argument('--workers', type=int, nargs='+', default=list(DEFAULT_WORKERS),
+                        help='worker counts to test')
+    parser.add_argument('--clients-per-worker', type=int, default=CLIENTS_PER_WORKER)
+    parser.add_argument('--concurrency', type=int, help='fixed number of clients for every worker count')
+    parser.add_argument('--duration', type=float, default=DURATION, help='measured seconds per run')
+    parser.add_argument('--warmup', type=float, default=WARMUP, help='seconds of load before measuring')
+    parser.add_argument('--output', default='load_test_results.json')
+    args = parser.parse_args(argv)
+
+    suites = args.suite or list(SUITE_REQUESTS)
+    stub_url = start_stub_api() if 'image2prompt' in suites else None
+
+    results = {}
+    for suite in suites:
+        env = dict(os.environ, **SUITE_ENV.get(suite, {}))
+        if suite == 'image2prompt':
+            env['NOVITA_API_URL'] = stub_url
+        runs = []
+        print(f'{suite}:')
+        for workers in sorted(args.workers):
+            concurrency = args.concurrency or workers * args.clients_per_worker
+            try:
+                run = run_load(suite, workers, concurrency, args.duration, args.warmup, env)
+            except Exception as e:
+                run = {'workers': workers, 'concurrency': concurrency, 'error': str(e)}
+                print(f'  {workers:>3} workers  error: {e}')
+                runs.append(run)
+                continue
+            base = next((r for r in runs if r.get('throughput_per_s')), run)
+            run['speedup'] = run['throughput_per_s'] / base['throughput_per_s'] if base['throughput_per_s'] else None
+            runs.append(run)
+            print(f"  {workers:>3} workers  {concurrency:>3} clients  {run['throughput_per_s']:>9.1f} req/s  "
+                  f"p50 {run.get('latency_p50_ms', float('nan')):>8.1f} ms  p95 {run.get('latency_p95_ms', float('nan')):>8.1f} ms  "
+                  f"503s {run['rejected']:>5}  errors {run['errors']:>4}  x{run['speedup'] or 0:.2f}")
+        results[suite] = runs
+
+    report = {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'duration': args.duration,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f'\nResults written to {args.output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
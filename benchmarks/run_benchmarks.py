@@ -0,0 +1,369 @@
+'''
+Benchmark Suite
+
+Runs reproducible workloads against all three tools and records the results as JSON:
+
+    - palette:      process_image over the training images/ corpus in 'palette' mode, in 'color'
+                    mode for every color in COLOR_HUE_RANGES, and process_image_all_colors ('all')
+    - deltae:       single-pair /process requests (through Flask's test client), the vectorized
+                    engine on 1k / 100k / 1M pairs (compare_hex_arrays, shared by /process and
+                    /upload), and the /upload batch pipeline on CSV files of 1k / 100k / 1M pairs
+    - image2prompt: the request path of image_to_prompt (decode, resize, prompt) for every training
+                    image against the local stub API (stub_novita_server.py), with a cache that never
+                    hits ('api') and with a warm prompt cache ('cached'). The model is not loaded.
+
+Every workload runs in a fresh Python process, started in a temporary folder (so the apps' uploads/,
+jobs/ and cache folders never touch the repository) with its tool's folder on the import path. The
+workload is called once to warm up, timed over --repeats passes, then run once more under
+tracemalloc. For each workload the suite records:
+
+    - latency percentiles (p50 / p95 / p99) per call: one image, one request, or one batch file
+    - throughput in items per second (images, requests or color pairs)
+    - peak resident memory (RSS) of the process
+    - peak memory allocated during one pass and the number of allocations still held afterwards
+
+Results are written to --output. With --baseline, each workload is compared with a stored result
+and the run fails (exit code 1) when latency, throughput or memory got worse by more than --tolerance.
+
+Usage:
+    python run_benchmarks.py
+    python run_benchmarks.py --suite deltae --quick
+    python run_benchmarks.py --save-baseline baseline.json
+    python run_benchmarks.py --baseline baseline.json --tolerance 0.25
+
+'''
+import argparse
+import functools
+import glob
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGE_FOLDER = os.path.join(REPO_FOLDER, 'training images')
+
+SUITE_FOLDERS = {
+    'palette': os.path.join(REPO_FOLDER, 'color_palette_extractor'),
+    'deltae': os.path.join(REPO_FOLDER, 'DeltaE_Calculator'),
+    'image2prompt': os.path.join(REPO_FOLDER, 'image2prompt_generator'),
+}
+
+# Environment set for a suite's processes (image2prompt runs without the InceptionV3 model)
+SUITE_ENV = {
+    'image2prompt': {'IMAGE2PROMPT_FEATURES': '0', 'IMAGE2PROMPT_WARMUP': '0'},
+}
+
+DELTAE_SIZES = {'1k': 1_000, '100k': 100_000, '1m': 1_000_000}
+PROCESS_REQUESTS = 1000
+QUICK_IMAGES = 3
+QUICK_PROCESS_REQUESTS = 200
+SEED = 0
+
+# Mean and standard deviation of the stub API's response time, in seconds
+STUB_LATENCY = 0.05
+STUB_JITTER = 0.005
+
+# Metrics compared with the baseline, and whether higher or lower is better
+COMPARED_METRICS = {
+    'latency_p50_ms': 'lower',
+    'latency_p95_ms': 'lower',
+    'throughput_per_s': 'higher',
+    'peak_rss_mb': 'lower',
+    'alloc_peak_mb': 'lower',
+}
+
+
+# Function to list the images of the training corpus (the first few in quick mode)
+def training_images(quick=False):
+    images = sorted(path for pattern in ('*.png', '*.jpg', '*.jpeg')
+                    for path in glob.glob(os.path.join(IMAGE_FOLDER, '**', pattern), recursive=True))
+    return images[:QUICK_IMAGES] if quick else images
+
+
+# Function to make two columns of random hex colors
+def random_hex_pairs(count, seed=SEED):
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    values = rng.integers(0, 1 << 24, size=(2, count))
+    return [[f'#{v:06x}' for v in column] for column in values.tolist()]
+
+
+# --- palette suite -------------------------------------------------------------------------------
+
+def palette_workloads(quick):
+    from color_palette_extractor import COLOR_HUE_RANGES
+    return ['palette', *(f'color:{color}' for color in COLOR_HUE_RANGES), 'all']
+
+
+def palette_setup(workload, quick):
+    from color_palette_extractor import process_image, process_image_all_colors
+    if workload == 'all':
+        extract = functools.partial(process_image_all_colors, save_images=False)
+    elif workload.startswith('color:'):
+        extract = functools.partial(process_image, mode='color', target_color=workload.split(':', 1)[1],
+                                    save_images=False)
+    else:
+        extract = functools.partial(process_image, mode='palette', save_images=False)
+    return [functools.partial(extract, image_path) for image_path in training_images(quick)], 1
+
+
+# --- deltae suite --------------------------------------------------------------------------------
+
+def deltae_workloads(quick):
+    sizes = [size for size in DELTAE_SIZES if not (quick and size == '1m')]
+    return ['process-request', *(f'compare-{size}' for size in sizes), *(f'upload-{size}' for size in sizes)]
+
+
+def deltae_setup(workload, quick):
+    kind, _, size = workload.partition('-')
+    if kind == 'process':
+        from compute_DeltaE import app
+        client = app.test_client()
+        hex_colors1, hex_colors2 = random_hex_pairs(QUICK_PROCESS_REQUESTS if quick else PROCESS_REQUESTS)
+        return [functools.partial(client.post, '/process', data={'color1': color1, 'color2': color2})
+                for color1, color2 in zip(hex_colors1, hex_colors2)], 1
+
+    count = DELTAE_SIZES[size]
+    hex_colors1, hex_colors2 = random_hex_pairs(count)
+    if kind == 'compare':
+        import numpy as np
+        from color_arrays import compare_hex_arrays
+        return [functools.partial(compare_hex_arrays, np.array(hex_colors1), np.array(hex_colors2))], count
+
+    import pandas as pd
+    from batch_processing import process_color_file
+    pd.DataFrame({'Color 1': hex_colors1, 'Color 2': hex_colors2}).to_csv('pairs.csv', index=False)
+    return [functools.partial(process_color_file, 'pairs.csv', 'results.csv', output_format='csv')], count
+
+
+# --- image2prompt suite --------------------------------------------------------------------------
+
+def image2prompt_workloads(quick):
+    return ['api', 'cached']
+
+
+# Function to run one upload through the request path, failing the benchmark if it did not get a prompt
+def image2prompt_call(process_bulk_image, filename, data):
+    result = process_bulk_image(filename, data)
+    if result['error']:
+        raise RuntimeError(f"{filename}: {result['error']}")
+
+
+def image2prompt_setup(workload, quick):
+    import logging
+    import threading
+    from werkzeug.serving import make_server
+    from stub_novita_server import create_stub_app
+
+    # The API URL and key are read when image2prompt is imported, so start the stub first
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, create_stub_app(latency=STUB_LATENCY, jitter=STUB_JITTER), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ['NOVITA_API_URL'] = f'http://127.0.0.1:{server.server_port}/v3/img2prompt'
+    with open('config.txt', 'w') as file:
+        file.write('NOVITA_API_KEY=stub-key\n')
+
+    import image2prompt
+    from prompt_cache import PromptCache
+
+    uploads = []
+    for image_path in training_images(quick):
+        with open(image_path, 'rb') as file:
+            uploads.append((os.path.basename(image_path), file.read()))
+    if workload == 'api':
+        # A negative distance never matches, so every call goes to the API
+        image2prompt.prompt_cache = PromptCache('benchmark_cache.sqlite3', max_distance=-1)
+    else:
+        for filename, data in uploads:
+            image2prompt_call(image2prompt.process_bulk_image, filename, data)
+    return [functools.partial(image2prompt_call, image2prompt.process_bulk_image, filename, data)
+            for filename, data in uploads], 1
+
+
+SUITES = {
+    'palette': (palette_workloads, palette_setup),
+    'deltae': (deltae_workloads, deltae_setup),
+    'image2prompt': (image2prompt_workloads, image2prompt_setup),
+}
+
+
+# Function to measure one workload inside its own process
+def measure_workload(suite, workload, repeats, quick, trace=True):
+    import numpy as np
+
+    calls, items_per_call = SUITES[suite][1](workload, quick)
+    if not calls:
+        raise ValueError(f'No inputs for {suite}/{workload}')
+    calls[0]()  # Warm up imports and caches
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for call in calls:
+            call_start = time.perf_counter()
+            call()
+            latencies.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    result = {
+        'calls': len(calls),
+        'items_per_call': items_per_call,
+        'repeats': repeats,
+        'latency_mean_ms': float(np.mean(latencies) * 1000),
+        'latency_p50_ms': float(p50),
+        'latency_p95_ms': float(p95),
+        'latency_p99_ms': float(p99),
+        'throughput_per_s': len(latencies) * items_per_call / elapsed,
+    }
+
+    if trace:
+        tracemalloc.start()
+        for call in calls:
+            call()
+        result['alloc_peak_mb'] = tracemalloc.get_traced_memory()[1] / 2**20
+        result['alloc_retained_blocks'] = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+        tracemalloc.stop()
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result['peak_rss_mb'] = peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+    return result
+
+
+# Function to run the benchmark script itself in a fresh process for one suite, in a temporary folder
+def run_child(suite, child_args, timeout=None):
+    env = dict(os.environ, **SUITE_ENV.get(suite, {}))
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [SUITE_FOLDERS[suite], env.get('PYTHONPATH')]))
+    with tempfile.TemporaryDirectory(prefix=f'benchmark_{suite}_') as work_dir:
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', suite, *child_args],
+                                   cwd=work_dir, env=env, capture_output=True, text=True, timeout=timeout)
+    if completed.returncode != 0 or not completed.stdout.strip():
+        error = completed.stderr.strip().splitlines()
+        raise RuntimeError(error[-1] if error else f'exit code {completed.returncode}')
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+# Function to compare results with a baseline, returning a list of regression messages
+def compare_with_baseline(results, baseline, tolerance, selected=lambda name: True):
+    """List the regressions of results against a baseline report.
+
+    Workloads that failed in this run, and baseline workloads that `selected` says should have run
+    but did not, count as regressions too.
+    """
+    regressions = []
+    for name, reference in baseline.get('results', {}).items():
+        if name not in results and selected(name) and not reference.get('error'):
+            regressions.append(f'{name}: missing from this run')
+    for name, result in results.items():
+        if result.get('error'):
+            regressions.append(f"{name}: failed ({result['error']})")
+            continue
+        reference = baseline.get('results', {}).get(name)
+        if reference is None or reference.get('error'):
+            continue
+        for metric, better in COMPARED_METRICS.items():
+            value, base = result.get(metric), reference.get(metric)
+            if value is None or not base:
+                continue
+            change = (value - base) / base
+            if (better == 'lower' and change > tolerance) or (better == 'higher' and -change > tolerance):
+                regressions.append(f'{name}: {metric} {base:.4g} -> {value:.4g} ({change:+.0%})')
+    return regressions
+
+
+def child_main(args):
+    suite, rest = args[0], args[1:]
+    if rest[0] == '--list':
+        print(json.dumps(SUITES[suite][0](quick='--quick' in rest)))
+        return 0
+    workload, repeats = rest[0], int(rest[1])
+    result = measure_workload(suite, workload, repeats, quick='--quick' in rest, trace='--no-trace' not in rest)
+    print(json.dumps(result))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the palette extractor, Delta E calculator and image2prompt.')
+    parser.add_argument('--suite', action='append', choices=list(SUITES),
+                        help='suite to run (can be repeated; default: all)')
+    parser.add_argument('--workload', action='append', help='only run workloads whose name contains this text')
+    parser.add_argument('--repeats', type=int, default=3, help='timed passes over each workload')
+    parser.add_argument('--quick', action='store_true', help=f'first {QUICK_IMAGES} images, no 1M-pair workloads')
+    parser.add_argument('--no-trace', action='store_true', help='skip the tracemalloc pass')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help='results file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression (0.2 = 20%%)')
+    parser.add_argument('--save-baseline', help='also write the results to this file, as the new baseline')
+    args = parser.parse_args(argv)
+
+    flags = (['--quick'] if args.quick else []) + (['--no-trace'] if args.no_trace else [])
+    suites = args.suite or list(SUITES)
+    results = {}
+    for suite in suites:
+        try:
+            workloads = run_child(suite, ['--list', *flags])
+        except Exception as e:
+            print(f'{suite}: could not start ({e})')
+            results[suite] = {'error': str(e)}
+            continue
+        for workload in workloads:
+            if args.workload and not any(text in workload for text in args.workload):
+                continue
+            name = f'{suite}/{workload}'
+            try:
+                result = run_child(suite, [workload, str(args.repeats), *flags])
+                print(f"{name:<28} p50 {result['latency_p50_ms']:>9.2f} ms  p95 {result['latency_p95_ms']:>9.2f} ms  "
+                      f"{result['throughput_per_s']:>12.1f}/s  RSS {result['peak_rss_mb']:>7.1f} MB  "
+                      f"alloc {result.get('alloc_peak_mb', float('nan')):>7.1f} MB")
+            except Exception as e:
+                result = {'error': str(e)}
+                print(f'{name:<28} error: {e}')
+            results[name] = result
+
+    report = {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'repeats': args.repeats,
+            'quick': args.quick,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f'\nResults written to {args.output}')
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f'Baseline written to {args.save_baseline}')
+
+    if args.baseline:
+        # Baseline workloads of the suites that were run (and that match --workload) are expected in the results
+        def selected(name):
+            suite, _, workload = name.partition('/')
+            return (suite in suites and suite not in results
+                    and (not args.workload or any(text in workload for text in args.workload)))
+
+        with open(args.baseline) as file:
+            regressions = compare_with_baseline(results, json.load(file), args.tolerance, selected)
+        if regressions:
+            print(f'\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}:')
+            for message in regressions:
+                print(f'  {message}')
+            return 1
+        print(f'No regressions beyond {args.tolerance:.0%} against {args.baseline}')
+    return 0
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        sys.exit(child_main(sys.argv[2:]))
+    sys.exit(main())
@@ -0,0 +1,199 @@
+'''
+Batch Palette Extraction
+
+Command-line batch mode for the Color Palette Extractor. It walks a folder of images (including
+subfolders), extracts a palette from each one with process_image (or process_image_all_colors in
+'all' mode) across a pool of worker processes, and writes one consolidated manifest of the results.
+
+The manifest can be CSV, Parquet or JSON Lines (chosen by its file extension). Results are written
+as they come in, so an interrupted run can simply be started again: images already in the manifest
+with the same mode, color, quantizer and number of clusters are skipped (including images that
+failed; remove their rows to try them again).
+
+Usage:
+    python batch_extract.py "../training images" palettes.csv
+    python batch_extract.py "../training images" palettes.parquet --mode all --quantizer minibatch --workers 8
+    python batch_extract.py "../training images" palettes.jsonl --mode color --color pink
+
+'''
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from quantizers import QUANTIZERS, DEFAULT_QUANTIZER
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp')
+
+# How many new results to collect between rewrites of a Parquet manifest
+PARQUET_CHECKPOINT_EVERY = 100
+
+
+# Function to list the images under a folder, as paths relative to that folder
+def find_images(input_dir, extensions=IMAGE_EXTENSIONS):
+    images = []
+    for root, _, files in os.walk(input_dir):
+        for name in files:
+            if name.lower().endswith(extensions):
+                images.append(os.path.relpath(os.path.join(root, name), input_dir))
+    return sorted(images)
+
+
+# Function to work out the manifest format from its file extension
+def manifest_format(manifest_path):
+    extension = os.path.splitext(manifest_path)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension == '.parquet':
+        return 'parquet'
+    if extension in ('.json', '.jsonl'):
+        return 'jsonl'
+    raise ValueError(f'Unsupported manifest type: {extension} (use .csv, .parquet, .json or .jsonl)')
+
+
+# Function to build the key a result is recorded under in the manifest (the same image extracted
+# with other settings is a different result)
+def result_key(image, mode, target_color, quantizer, n_clusters):
+    # Missing colors are read back from CSV and Parquet manifests as NaN
+    target_color = None if target_color is None or pd.isna(target_color) else str(target_color)
+    return str(image), mode, target_color, quantizer, int(n_clusters)
+
+
+# Function to load an existing manifest (an empty DataFrame if there is none yet)
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path) or os.path.getsize(manifest_path) == 0:
+        return pd.DataFrame()
+    fmt = manifest_format(manifest_path)
+    if fmt == 'csv':
+        return pd.read_csv(manifest_path, dtype={'image': str})
+    if fmt == 'parquet':
+        return pd.read_parquet(manifest_path)
+    return pd.read_json(manifest_path, lines=True, dtype={'image': str})
+
+
+# Writer that adds records to the manifest as they arrive
+class ManifestWriter:
+    def __init__(self, manifest_path, existing):
+        self.manifest_path = manifest_path
+        self.format = manifest_format(manifest_path)
+        self.existing = existing
+        self.pending = []
+
+    def add(self, record):
+        if self.format == 'jsonl':
+            with open(self.manifest_path, 'a') as file:
+                file.write(json.dumps(record) + '\n')
+            return
+        # CSV and Parquet store the palette as a JSON string column
+        record = dict(record, hex_codes=json.dumps(record['hex_codes']))
+        if self.format == 'csv':
+            write_header = not os.path.exists(self.manifest_path) or os.path.getsize(self.manifest_path) == 0
+            pd.DataFrame([record]).to_csv(self.manifest_path, mode='a', header=write_header, index=False)
+            return
+        self.pending.append(record)
+        if len(self.pending) >= PARQUET_CHECKPOINT_EVERY:
+            self.flush()
+
+    def flush(self):
+        # Parquet files cannot be appended to, so the whole manifest is rewritten (atomically)
+        if self.format != 'parquet' or not self.pending:
+            return
+        self.existing = pd.concat([self.existing, pd.DataFrame(self.pending)], ignore_index=True)
+        self.pending = []
+        temp_path = f'{self.manifest_path}.tmp'
+        self.existing.to_parquet(temp_path, index=False)
+        os.replace(temp_path, self.manifest_path)
+
+
+# Worker process setup: one thread per process for OpenCV/BLAS/OpenMP, so processes do not oversubscribe the CPU
+def _init_worker():
+    import cv2
+    from threadpoolctl import threadpool_limits
+    cv2.setNumThreads(1)
+    threadpool_limits(limits=1)
+
+
+# Function run in a worker process: extract the palette of one image and return a manifest record
+def extract_one(input_dir, image, mode, target_color, quantizer, n_clusters):
+    from color_palette_extractor import process_image, process_image_all_colors
+
+    record = {'image': image, 'mode': mode, 'target_color': target_color, 'quantizer': quantizer,
+              'n_clusters': n_clusters, 'hex_codes': None, 'error': None}
+    start = time.perf_counter()
+    try:
+        image_path = os.path.join(input_dir, image)
+        if mode == 'all':
+            colors = target_color.split(',') if target_color else None
+            record['hex_codes'] = process_image_all_colors(image_path, colors=colors, quantizer=quantizer,
+                                                           n_clusters=n_clusters, save_images=False)
+        else:
+            record['hex_codes'] = process_image(image_path, mode=mode, target_color=target_color,
+                                                quantizer=quantizer, n_clusters=n_clusters, save_images=False)
+    except Exception as e:
+        record['error'] = str(e)
+    record['seconds'] = round(time.perf_counter() - start, 4)
+    return record
+
+
+def run_batch(input_dir, manifest_path, mode='palette', target_color=None, quantizer=DEFAULT_QUANTIZER,
+              n_clusters=8, workers=None):
+    """Extract palettes for every image under input_dir that is not in the manifest yet.
+
+    :return: number of images processed in this run
+    """
+    existing = load_manifest(manifest_path)
+    done = set()
+    if not existing.empty:
+        done = {result_key(*row) for row in
+                existing[['image', 'mode', 'target_color', 'quantizer', 'n_clusters']].itertuples(index=False)}
+
+    all_images = find_images(input_dir)
+    images = [image for image in all_images
+              if result_key(image, mode, target_color, quantizer, n_clusters) not in done]
+    print(f'{len(images)} images to process ({len(all_images) - len(images)} already in {manifest_path})')
+    if not images:
+        return 0
+
+    writer = ManifestWriter(manifest_path, existing)
+    start = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+            futures = [executor.submit(extract_one, input_dir, image, mode, target_color, quantizer, n_clusters)
+                       for image in images]
+            for count, future in enumerate(as_completed(futures), start=1):
+                record = future.result()
+                writer.add(record)
+                status = f"error: {record['error']}" if record['error'] else f"{record['seconds']:.2f} s"
+                print(f"[{count}/{len(images)}] {record['image']} ({status})")
+    finally:
+        writer.flush()
+
+    elapsed = time.perf_counter() - start
+    print(f'Processed {len(images)} images in {elapsed:.1f} s ({len(images) / elapsed:.1f} images/s)')
+    return len(images)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Extract color palettes from every image in a folder.')
+    parser.add_argument('input_dir', help='folder of images (searched recursively)')
+    parser.add_argument('manifest', help='output manifest: .csv, .parquet, .json or .jsonl (JSON Lines)')
+    parser.add_argument('--mode', choices=['palette', 'color', 'all'], default='palette')
+    parser.add_argument('--color', dest='target_color', default=None,
+                        help="target color for 'color' mode, or comma-separated colors for 'all' mode")
+    parser.add_argument('--quantizer', choices=list(QUANTIZERS), default=DEFAULT_QUANTIZER)
+    parser.add_argument('--n-clusters', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per CPU)')
+    args = parser.parse_args(argv)
+
+    if args.mode == 'color' and not args.target_color:
+        parser.error("--color is required in 'color' mode")
+    manifest_format(args.manifest)  # Fail early on an unsupported manifest type
+
+    run_batch(args.input_dir, args.manifest, mode=args.mode, target_color=args.target_color,
+              quantizer=args.quantizer, n_clusters=args.n_clusters, workers=args.workers)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+'''
+Pixel Collection Benchmark
+
+Compares the way process_image used to gather pixels for clustering (a nested Python loop
+appending every masked pixel to a list, then wrapping the list in a pandas DataFrame) with the
+current array masking in collect_pixels(), on every image in the training images folder.
+
+For each image and mask ('palette' = every pixel, plus each hue in COLOR_HUE_RANGES) it reports
+the time taken and the peak memory allocated (measured with tracemalloc).
+
+Usage:
+    python benchmark_pixel_collection.py [image folder]
+
+'''
+import glob
+import os
+import sys
+import time
+import tracemalloc
+import cv2
+import numpy as np
+import pandas as pd
+from color_palette_extractor import COLOR_HUE_RANGES, collect_pixels
+
+DEFAULT_IMAGE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'training images')
+
+
+# The original per-pixel loop and DataFrame round-trip, kept here for comparison
+def collect_pixels_loop(img, mask):
+    height, width = mask.shape
+    pixels = []
+    for y in range(height):
+        for x in range(width):
+            if mask[y, x]:
+                b, g, r = img[y, x]
+                pixels.append([b, g, r])
+    if not pixels:
+        return np.empty((0, 3), dtype=np.uint8)
+    return pd.DataFrame(pixels, columns=['B', 'G', 'R']).values
+
+
+# Function to load and resize an image exactly as process_image does
+def load_resized(image_path):
+    img = cv2.imread(image_path)
+    height, width = img.shape[:2]
+    new_width = 400
+    new_height = int(new_width / (width / height))
+    return cv2.resize(img, (new_width, new_height))
+
+
+# Function to build the hue mask process_image uses in 'color' mode
+def hue_mask(hsv_img, hue_ranges):
+    mask = np.zeros(hsv_img.shape[:2], dtype=bool)
+    for (h_min, h_max) in hue_ranges:
+        mask |= (hsv_img[:, :, 0] >= h_min) & (hsv_img[:, :, 0] <= h_max)
+    return mask
+
+
+# Function to time one collection function and record its peak allocation
+def measure(collect, img, mask):
+    tracemalloc.start()
+    start = time.perf_counter()
+    pixels = collect(img, mask)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return pixels, elapsed, peak
+
+
+def main(image_folder):
+    image_paths = sorted(glob.glob(os.path.join(image_folder, '**', '*.png'), recursive=True))
+    if not image_paths:
+        print(f'No images found in {image_folder}')
+        return
+
+    print(f"{'image':<45} {'mask':<8} {'pixels':>7} {'loop ms':>9} {'array ms':>9} {'speedup':>8} "
+          f"{'loop MB':>8} {'array MB':>9}")
+    totals = np.zeros(4)
+    for image_path in image_paths:
+        img = load_resized(image_path)
+        hsv_img = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        masks = {'palette': np.ones(img.shape[:2], dtype=bool)}
+        masks.update({name: hue_mask(hsv_img, ranges) for name, ranges in COLOR_HUE_RANGES.items()})
+
+        for name, mask in masks.items():
+            old_pixels, old_time, old_peak = measure(collect_pixels_loop, img, mask)
+            new_pixels, new_time, new_peak = measure(collect_pixels, img, mask)
+            assert np.array_equal(np.asarray(old_pixels, dtype=np.uint8), new_pixels)
+            totals += [old_time, new_time, old_peak, new_peak]
+            label = os.path.relpath(image_path, image_folder)[:45]
+            print(f'{label:<45} {name:<8} {len(new_pixels):>7} {old_time * 1000:>9.1f} {new_time * 1000:>9.2f} '
+                  f'{old_time / max(new_time, 1e-9):>7.0f}x {old_peak / 2**20:>8.1f} {new_peak / 2**20:>9.2f}')
+
+    old_time, new_time, old_peak, new_peak = totals
+    print(f'\nTotal: loop {old_time:.2f} s, array {new_time:.3f} s ({old_time / max(new_time, 1e-9):.0f}x faster); '
+          f'allocated {old_peak / 2**20:.0f} MB vs {new_peak / 2**20:.1f} MB')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_IMAGE_FOLDER)
@@ -6,26 +6,59 @@ Color Palette Extractor
 This script is a Flask web application that allows users to upload an image and extract a color palette from it. 
 The user can choose between two modes: 
     - 'palette' mode, which extracts the most dominant colors, and 'color' mode, which filters colors based on predefined hue ranges
+    - 'video' mode extracts a global palette and one palette per scene from a video or animated GIF (see video_palette.py)
      
 The extracted colors are displayed as hex codes and saved as an image palette.
 The application uses OpenCV for image processing, scikit-learn for KMeans clustering, and Flask for the web interface. 
 The user can upload an image, select a mode, and view the resulting color palette.
 
 '''
-from flask import Flask, request, render_template, send_from_directory
+from flask import Flask, request, render_template, send_from_directory, redirect, url_for, jsonify
 import webbrowser
 import threading
 import cv2
-import pandas as pd
 import numpy as np
 import os
-from sklearn.cluster import KMeans
+from quantizers import QUANTIZERS, DEFAULT_QUANTIZER, quantize
+from job_queue import JobManager, DONE, FAILED, CANCELLED
+from palette_cache import PaletteCache, make_cache_key
+from image_decode import decode_reduced
+from video_palette import FRAME_STRIDE, extract_video_palettes, frame_count
+from metrics import REGISTRY, init_metrics_folder, instrument_app, record_cache_lookup, span
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads/'
 app.config['PALETTE_FOLDER'] = 'palettes/'
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs(app.config['PALETTE_FOLDER'], exist_ok=True)
+# Largest request accepted (videos included); bigger uploads are answered with 413 Request Entity Too Large
+app.config['MAX_CONTENT_LENGTH'] = 256 * 2**20
+# Uploads are processed as background jobs, each with its own folder for the resized image and palette
+app.config['JOBS_FOLDER'] = 'jobs/'
+app.config['MAX_WORKERS'] = None  # None = one worker process per CPU
+
+job_manager = JobManager(app.config['JOBS_FOLDER'], max_workers=app.config['MAX_WORKERS'])
+
+# Request, stage, cache and queue metrics are served at /metrics; job workers leave theirs in
+# METRICS_FOLDER. Set ENABLE_PROFILER=1 to also serve /debug/profile?seconds=10 (flame graph samples).
+app.config['METRICS_FOLDER'] = 'metrics/'
+app.config['PROFILING'] = os.environ.get('ENABLE_PROFILER', '0') == '1'
+init_metrics_folder(app.config['METRICS_FOLDER'])
+instrument_app(app, profiling=app.config['PROFILING'])
+REGISTRY.gauge('job_queue_depth', 'Jobs submitted by this process that have not finished yet.').set_function(
+    job_manager.queue_depth)
+
+# Results are cached by image content + settings, so repeat uploads skip decoding and clustering
+app.config['CACHE_FOLDER'] = 'cache/'
+app.config['CACHE_MEMORY_BYTES'] = 64 * 2**20
+app.config['CACHE_DISK_BYTES'] = 512 * 2**20
+
+palette_cache = PaletteCache(app.config['CACHE_FOLDER'], max_memory_bytes=app.config['CACHE_MEMORY_BYTES'],
+                             max_disk_bytes=app.config['CACHE_DISK_BYTES'])
+
+# Function to create the app's folders. Called when the app is served (below and in wsgi.py), not on
+# import, so tools that only use the extraction functions (e.g. batch_extract.py) leave the current folder alone
+def create_folders():
+    for key in ('UPLOAD_FOLDER', 'PALETTE_FOLDER', 'JOBS_FOLDER', 'CACHE_FOLDER'):
+        os.makedirs(app.config[key], exist_ok=True)
 
 # Define hue ranges for color filtering
 COLOR_HUE_RANGES = {
@@ -43,65 +76,94 @@ COLOR_HUE_RANGES = {
 MIN_SATURATION = 50
 MIN_VALUE = 50
 
-def process_image(image_path, mode='palette', target_color=None):
-    # Load original image
-    img = cv2.imread(image_path)
+# Number of colors extracted per palette
+N_CLUSTERS = 8
+
+# Width images are resized to before extraction
+TARGET_WIDTH = 400
+
+# Decode large images at reduced resolution (see image_decode.py) instead of at full size
+REDUCED_DECODE = True
+
+# Most pixels passed to clustering per palette; larger selections are randomly subsampled (None = no limit)
+SAMPLE_BUDGET = 250_000
+
+# Use every VIDEO_FRAME_STRIDE-th frame of videos and animated GIFs
+VIDEO_FRAME_STRIDE = FRAME_STRIDE
+
+# Function to gather the masked pixels as an (N, 3) BGR array without a per-pixel Python loop
+def collect_pixels(img, mask):
+    # A view of the image when nothing is masked out, one boolean-index copy otherwise
+    if mask.all():
+        return img.reshape(-1, 3)
+    return img[mask]
+
+# Function to cap the number of pixels passed to clustering with a repeatable random sample
+def sample_pixels(pixels, sample_budget=SAMPLE_BUDGET):
+    if sample_budget is None or len(pixels) <= sample_budget:
+        return pixels
+    # Fixed seed, so the same image always gives the same palette
+    rng = np.random.default_rng(0)
+    index = np.sort(rng.choice(len(pixels), size=sample_budget, replace=False))
+    return pixels[index]
+
+def palette_filename(image_path, mode='palette', target_color=None):
+    filename_without_ext = os.path.splitext(os.path.basename(image_path))[0]
+    suffix = "_palette" if mode == 'palette' else f"_{target_color}_palette"
+    return f"{filename_without_ext}{suffix}.png"
+
+# Function to pick the folders output images are saved to: output_dir if given (one folder per job),
+# otherwise the shared app folders (created if needed)
+def output_folders(output_dir=None):
+    upload_folder = output_dir or app.config['UPLOAD_FOLDER']
+    palette_folder = output_dir or app.config['PALETTE_FOLDER']
+    os.makedirs(upload_folder, exist_ok=True)
+    os.makedirs(palette_folder, exist_ok=True)
+    return upload_folder, palette_folder
+
+# Function to load an image and resize it to 400 pixels wide (returns the BGR image and its HSV version)
+def load_resized_image(image_path, reduced_decode=REDUCED_DECODE):
+    # Load the image, at reduced resolution when possible
+    with span('decode'):
+        img = decode_reduced(image_path, TARGET_WIDTH) if reduced_decode else cv2.imread(image_path)
     if img is None:
         raise ValueError("Invalid image path or corrupted image.")
-    
+
     # Resize for faster processing
-    height, width = img.shape[:2]
-    aspect_ratio = width / height
-    new_width = 400
-    new_height = int(new_width / aspect_ratio)
-    img_resized = cv2.resize(img, (new_width, new_height))
-    
-    hsv_img = cv2.cvtColor(img_resized, cv2.COLOR_BGR2HSV)
-    mask = np.ones((new_height, new_width), dtype=bool)
+    with span('resize'):
+        height, width = img.shape[:2]
+        aspect_ratio = width / height
+        new_width = TARGET_WIDTH
+        new_height = int(new_width / aspect_ratio)
+        img_resized = cv2.resize(img, (new_width, new_height))
 
-    # Filter by hue if in 'color' mode with target_color
-    if mode == 'color' and target_color:
-        hue_ranges = COLOR_HUE_RANGES.get(target_color.lower())
-        if hue_ranges:
-            combined_mask = np.zeros((new_height, new_width), dtype=bool)
-            for (h_min, h_max) in hue_ranges:
-                if h_min <= h_max:
-                    current_mask = (hsv_img[:, :, 0] >= h_min) & (hsv_img[:, :, 0] <= h_max)
-                else:
-                    current_mask = (hsv_img[:, :, 0] >= h_min) | (hsv_img[:, :, 0] <= h_max)
-                combined_mask = combined_mask | current_mask
-            mask = combined_mask
-        else:
-            return ["No colors found for the selected mode and color."]
+        hsv_img = cv2.cvtColor(img_resized, cv2.COLOR_BGR2HSV)
+    return img_resized, hsv_img
 
-    # Collect pixels based on mask
-    pixels = []
-    for y in range(new_height):
-        for x in range(new_width):
-            if mask[y, x]:
-                b, g, r = img_resized[y, x]
-                pixels.append([b, g, r])
-
-    if not pixels:
-        return ["No colors found for the selected mode and color."]
+# Function to check whether a hue falls in any of the given ranges
+def hue_in_ranges(h, hue_ranges):
+    for (h_min, h_max) in hue_ranges:
+        if h_min <= h_max:
+            if h >= h_min and h <= h_max:
+                return True
+        else:
+            if h >= h_min or h <= h_max:
+                return True
+    return False
 
+# Function to cluster an (N, 3) BGR pixel array and return the hex codes of the relevant colors
+def palette_hex_codes(pixels, mode='palette', target_color=None, quantizer=DEFAULT_QUANTIZER, n_clusters=N_CLUSTERS):
     # Handle very few pixels
     if len(pixels) < 10:
-        unique_colors = [list(x) for x in set(tuple(p) for p in pixels)]
-        hex_codes = ["#{:02x}{:02x}{:02x}".format(int(c[2]), int(c[1]), int(c[0])) for c in unique_colors]
-        save_palette_and_return(hex_codes, img_resized, mode, target_color, image_path)
-        return hex_codes
-
-    # Clustering
-    n_clusters = min(8, len(pixels))
-    df = pd.DataFrame(pixels, columns=['B', 'G', 'R'])
-    km = KMeans(n_clusters=n_clusters, init='k-means++', n_init=10)
-    km.fit(df.values)
-    centers_bgr = np.array(km.cluster_centers_, dtype=np.uint8)
+        unique_colors = np.unique(pixels, axis=0)
+        return ["#{:02x}{:02x}{:02x}".format(int(c[2]), int(c[1]), int(c[0])) for c in unique_colors]
+
+    # Clustering (on the unique colors weighted by pixel count, with the selected quantizer backend)
+    with span('quantize'):
+        centers_bgr = np.array(quantize(pixels, n_colors=n_clusters, quantizer=quantizer), dtype=np.uint8)
 
     centers_hsv = cv2.cvtColor(centers_bgr.reshape(-1, 1, 3), cv2.COLOR_BGR2HSV).reshape(-1, 3)
 
-    relevant_centers = []
     relevant_hex_codes = []
 
     for i, (b, g, r) in enumerate(centers_bgr):
@@ -115,51 +177,156 @@ def process_image(image_path, mode='palette', target_color=None):
             # Check hue range if target_color specified
             if target_color:
                 hue_ranges = COLOR_HUE_RANGES.get(target_color.lower())
-                hue_match = False
-                if hue_ranges:
-                    for (h_min, h_max) in hue_ranges:
-                        if h_min <= h_max:
-                            if h >= h_min and h <= h_max:
-                                hue_match = True
-                                break
-                        else:
-                            if h >= h_min or h <= h_max:
-                                hue_match = True
-                                break
-                if not hue_match:
+                if not hue_ranges or not hue_in_ranges(h, hue_ranges):
                     include_center = False
 
         # For 'palette' mode, include all centers
         if include_center:
-            relevant_centers.append([b, g, r])
             hex_code = "#{:02x}{:02x}{:02x}".format(int(r), int(g), int(b))
             relevant_hex_codes.append(hex_code)
 
-    if not relevant_centers:
+    return relevant_hex_codes
+
+def process_image(image_path, mode='palette', target_color=None, output_dir=None,
+                  quantizer=DEFAULT_QUANTIZER, n_clusters=N_CLUSTERS, save_images=True, sample_budget=SAMPLE_BUDGET):
+    img_resized, hsv_img = load_resized_image(image_path)
+    new_height, new_width = img_resized.shape[:2]
+    mask = np.ones((new_height, new_width), dtype=bool)
+
+    # Filter by hue if in 'color' mode with target_color
+    if mode == 'color' and target_color:
+        hue_ranges = COLOR_HUE_RANGES.get(target_color.lower())
+        if hue_ranges:
+            combined_mask = np.zeros((new_height, new_width), dtype=bool)
+            for (h_min, h_max) in hue_ranges:
+                if h_min <= h_max:
+                    current_mask = (hsv_img[:, :, 0] >= h_min) & (hsv_img[:, :, 0] <= h_max)
+                else:
+                    current_mask = (hsv_img[:, :, 0] >= h_min) | (hsv_img[:, :, 0] <= h_max)
+                combined_mask = combined_mask | current_mask
+            mask = combined_mask
+        else:
+            return ["No colors found for the selected mode and color."]
+
+    # Collect pixels based on mask
+    with span('collect_pixels'):
+        pixels = sample_pixels(collect_pixels(img_resized, mask), sample_budget)
+
+    if len(pixels) == 0:
+        return ["No colors found for the selected mode and color."]
+
+    relevant_hex_codes = palette_hex_codes(pixels, mode, target_color, quantizer, n_clusters)
+
+    if not relevant_hex_codes:
         return ["No relevant colors found in the current mode."]
 
-    # Generate palette image
-    n_colors = len(relevant_centers)
-    palette_img = np.zeros((60 + 20, n_colors * 100, 3), dtype=np.uint8)
-    for i, (b, g, r) in enumerate(relevant_centers):
-        # Fill color rectangle
-        palette_img[:60, i * 100:(i + 1) * 100, :] = [b, g, r]
-        # Add hex code text
-        cv2.putText(palette_img, relevant_hex_codes[i], 
-                    (i * 100 + 10, 75), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+    if not save_images:
+        return relevant_hex_codes
+    upload_folder, palette_folder = output_folders(output_dir)
 
     # Save the original resized image
-    cv2.imwrite(os.path.join(app.config['UPLOAD_FOLDER'], 'original_image.png'), img_resized)
+    with span('render'):
+        cv2.imwrite(os.path.join(upload_folder, 'original_image.png'), img_resized)
 
-    # Save palette image
-    filename_without_ext = os.path.splitext(os.path.basename(image_path))[0]
-    suffix = "_palette" if mode == 'palette' else f"_{target_color}_palette"
-    filename = f"{filename_without_ext}{suffix}.png"
-    cv2.imwrite(os.path.join(app.config['PALETTE_FOLDER'], filename), palette_img)
+    # Generate and save palette image
+    save_palette_and_return(relevant_hex_codes, img_resized, mode, target_color, image_path, palette_folder)
 
     return relevant_hex_codes
 
-def save_palette_and_return(hex_codes, img, mode, target_color, image_path):
+# Index of an image's pixels grouped by hue: the pixels with hue h are order[bounds[h]:bounds[h + 1]]
+def build_hue_index(hsv_img):
+    hues = hsv_img[:, :, 0].ravel()
+    order = np.argsort(hues, kind='stable')
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(hues, minlength=256))])
+    return order, bounds
+
+# Function to look up the indices of the pixels whose hue falls in the given ranges
+def pixels_in_hue_ranges(hue_index, hue_ranges):
+    order, bounds = hue_index
+    slices = []
+    for (h_min, h_max) in hue_ranges:
+        if h_min <= h_max:
+            slices.append(order[bounds[h_min]:bounds[h_max + 1]])
+        else:
+            slices.append(order[bounds[h_min]:])
+            slices.append(order[:bounds[h_max + 1]])
+    return np.concatenate(slices)
+
+# Function to extract a palette for every named hue (or the given subset) from a single decode
+def process_image_all_colors(image_path, colors=None, output_dir=None,
+                             quantizer=DEFAULT_QUANTIZER, n_clusters=N_CLUSTERS, save_images=True,
+                             sample_budget=SAMPLE_BUDGET):
+    """Equivalent to calling process_image in 'color' mode once per color, but the image is
+    decoded, resized and converted to HSV only once, and each hue's pixels come from one shared
+    hue index instead of a full-image mask per color.
+
+    :return: dict mapping each color name to its hex codes (or a "No ... found" message list)
+    """
+    colors = [c.lower() for c in colors] if colors else list(COLOR_HUE_RANGES)
+    unknown = [c for c in colors if c not in COLOR_HUE_RANGES]
+    if unknown:
+        raise ValueError(f"Unknown color(s): {', '.join(unknown)}. Choose from: {', '.join(COLOR_HUE_RANGES)}")
+
+    img_resized, hsv_img = load_resized_image(image_path)
+    if save_images:
+        upload_folder, palette_folder = output_folders(output_dir)
+        with span('render'):
+            cv2.imwrite(os.path.join(upload_folder, 'original_image.png'), img_resized)
+
+    all_pixels = img_resized.reshape(-1, 3)
+    with span('collect_pixels'):
+        hue_index = build_hue_index(hsv_img)
+
+    palettes = {}
+    for color in colors:
+        with span('collect_pixels'):
+            pixels = sample_pixels(all_pixels[pixels_in_hue_ranges(hue_index, COLOR_HUE_RANGES[color])], sample_budget)
+        if len(pixels) == 0:
+            palettes[color] = ["No colors found for the selected mode and color."]
+            continue
+        hex_codes = palette_hex_codes(pixels, 'color', color, quantizer, n_clusters)
+        if not hex_codes:
+            palettes[color] = ["No relevant colors found in the current mode."]
+            continue
+        if save_images:
+            save_palette_and_return(hex_codes, img_resized, 'color', color, image_path, palette_folder)
+        palettes[color] = hex_codes
+    return palettes
+
+# Function to extract the global palette and one palette per scene from a video or animated GIF
+def process_video(video_path, output_dir=None, n_clusters=N_CLUSTERS, stride=VIDEO_FRAME_STRIDE, save_images=True,
+                  progress=None):
+    """Frames are streamed and clustered one at a time, so memory does not grow with the video's length.
+
+    :param progress: optional callback called with the fraction (0.0 - 1.0) of the video read so far
+    :return: {'palettes': {'global': [...], 'scene_1': [...], ...}, 'scenes': {'scene_1': frame range, ...}}
+    """
+    on_frame = None
+    if progress is not None:
+        total = frame_count(video_path)
+        on_frame = lambda frames_read: progress(frames_read / total if total else 0.0)
+    result = extract_video_palettes(video_path, n_colors=n_clusters, stride=stride, width=TARGET_WIDTH,
+                                    progress=on_frame)
+
+    palettes = {'global': result['global']}
+    scenes = {}
+    for number, scene in enumerate(result['scenes'], start=1):
+        name = f'scene_{number}'
+        palettes[name] = scene.pop('hex_codes')
+        scenes[name] = scene
+
+    if save_images:
+        upload_folder, palette_folder = output_folders(output_dir)
+        # The first sampled frame stands in for the original image
+        with span('render'):
+            cv2.imwrite(os.path.join(upload_folder, 'original_image.png'), result['preview'])
+        for name, hex_codes in palettes.items():
+            if hex_codes:
+                save_palette_and_return(hex_codes, None, 'color', name, video_path, palette_folder)
+    return {'palettes': palettes, 'scenes': scenes}
+
+@span('render')
+def save_palette_and_return(hex_codes, img, mode, target_color, image_path, palette_folder=None):
     n_colors = len(hex_codes)
     palette_img = np.zeros((60 + 20, n_colors * 100, 3), dtype=np.uint8)
     for i, hex_code in enumerate(hex_codes):
@@ -169,10 +336,67 @@ def save_palette_and_return(hex_codes, img, mode, target_color, image_path):
         palette_img[:60, i * 100:(i + 1) * 100, :] = [b, g, r]
         cv2.putText(palette_img, hex_code, (i * 100 + 10, 75),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-    filename_without_ext = os.path.splitext(os.path.basename(image_path))[0]
-    suffix = "_palette" if mode == 'palette' else f"_{target_color}_palette"
-    filename = f"{filename_without_ext}{suffix}.png"
-    cv2.imwrite(os.path.join(app.config['PALETTE_FOLDER'], filename), palette_img)
+    filename = palette_filename(image_path, mode, target_color)
+    cv2.imwrite(os.path.join(palette_folder or app.config['PALETTE_FOLDER'], filename), palette_img)
+
+# Job function for the background queue: extract the palette into the job's own folder
+# (in 'all' mode, target_color is a comma-separated list of colors, or None for every color)
+def palette_job(job, image_path, mode='palette', target_color=None, quantizer=DEFAULT_QUANTIZER, cache_key=None):
+    job.update(progress=0.0, message='Extracting palette')
+    if mode == 'video':
+        # Progress updates also stop the job at the next frame if it is cancelled
+        hex_codes = process_video(image_path, output_dir=job.job_dir, progress=lambda fraction: job.update(progress=fraction))
+    elif mode == 'all':
+        colors = target_color.split(',') if target_color else None
+        hex_codes = process_image_all_colors(image_path, colors=colors, output_dir=job.job_dir, quantizer=quantizer)
+    else:
+        hex_codes = process_image(image_path, mode=mode, target_color=target_color, output_dir=job.job_dir,
+                                  quantizer=quantizer)
+    result = palette_result(hex_codes, image_path, mode, target_color, quantizer)
+    if cache_key is not None:
+        palette_cache.put(cache_key, hex_codes, {name: job.path(filename)
+                                                 for name, filename in cache_file_names(result).items()})
+    return result
+
+def palette_result(hex_codes, image_path, mode, target_color, quantizer, cached=False):
+    result = {
+        'quantizer': quantizer,
+        'original_image': 'original_image.png',
+        'cached': cached,
+    }
+    if mode == 'video':
+        # hex_codes holds the global and per-scene palettes and each scene's frame range
+        result['palettes'] = hex_codes['palettes']
+        result['scenes'] = hex_codes['scenes']
+        result['palette_images'] = {name: palette_filename(image_path, 'color', name)
+                                    for name, codes in hex_codes['palettes'].items() if codes}
+    elif mode == 'all':
+        # hex_codes maps each color name to its palette
+        result['palettes'] = hex_codes
+        result['palette_images'] = {color: palette_filename(image_path, 'color', color) for color in hex_codes}
+    else:
+        result['hex_codes'] = hex_codes
+        result['palette_image'] = palette_filename(image_path, mode, target_color)
+    return result
+
+# Function to map the file names used inside a cache entry to the job's output file names
+# (cache entries are shared between uploads of the same image under different file names)
+def cache_file_names(result):
+    names = {'original_image.png': result['original_image']}
+    if 'palette_images' in result:
+        names.update({f'{color}_palette.png': filename for color, filename in result['palette_images'].items()})
+    else:
+        names['palette.png'] = result['palette_image']
+    return names
+
+# Function to fill a job folder from a cached result (no OpenCV or sklearn involved)
+def restore_cached_result(entry, job_dir, image_path, mode, target_color, quantizer):
+    result = palette_result(entry['hex_codes'], image_path, mode, target_color, quantizer, cached=True)
+    output_names = cache_file_names(result)
+    for name, data in entry['files'].items():
+        with open(os.path.join(job_dir, output_names[name]), 'wb') as f:
+            f.write(data)
+    return result
 
 @app.route('/', methods=['GET', 'POST'])
 def upload():
@@ -180,16 +404,90 @@ def upload():
         file = request.files['file']
         mode = request.form.get('mode', 'palette')
         color_name = request.form.get('color_name', '').lower()
+        quantizer = request.form.get('quantizer', DEFAULT_QUANTIZER)
+        if mode == 'video':
+            quantizer = 'minibatch'  # Video frames are always clustered online with MiniBatchKMeans
+        if quantizer not in QUANTIZERS:
+            return f"Error processing image: unknown quantizer '{quantizer}'. Choose one of: {', '.join(QUANTIZERS)}"
+        if mode == 'all':
+            # Optional comma-separated subset of colors; all colors when left blank
+            colors = [c.strip() for c in color_name.split(',') if c.strip()]
+            unknown = [c for c in colors if c not in COLOR_HUE_RANGES]
+            if unknown:
+                return f"Error processing image: unknown color(s) {', '.join(unknown)}. Choose from: {', '.join(COLOR_HUE_RANGES)}"
         if file and file.filename != '':
-            filename = file.filename
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            try:
-                hex_codes = process_image(filepath, mode=mode, target_color=color_name if mode=='color' else None)
-            except Exception as e:
-                return f"Error processing image: {e}"
-            return render_template('color_palette_extractor.html', original_image='original_image.png', hex_codes=hex_codes)
-    return render_template('color_palette_extractor.html')
+            if mode == 'all':
+                target_color = ','.join(colors) or None
+            else:
+                target_color = color_name if mode=='color' else None
+            image_bytes = file.read()
+            cache_key = make_cache_key(image_bytes, mode, target_color, N_CLUSTERS, quantizer)
+
+            # Save the upload into a fresh job folder (under a fixed name, so it cannot replace the
+            # job's status or cancel files)
+            filename = os.path.basename(file.filename)
+            job_id, job_dir = job_manager.create(filename=filename, mode=mode, quantizer=quantizer)
+            extension = os.path.splitext(filename)[1].lower()
+            filepath = os.path.join(job_dir, f'input{extension}')
+            with open(filepath, 'wb') as f:
+                f.write(image_bytes)
+
+            # Serve repeat uploads from the cache, otherwise extract the palette in the background
+            entry = palette_cache.get(cache_key)
+            record_cache_lookup('palette', entry is not None)
+            if entry is not None:
+                job_manager.complete(job_id, restore_cached_result(entry, job_dir, filepath, mode, target_color, quantizer))
+            else:
+                job_manager.start(job_id, palette_job, filepath, mode=mode, target_color=target_color,
+                                  quantizer=quantizer, cache_key=cache_key)
+            return redirect(url_for('job_results', job_id=job_id))
+    return render_template('color_palette_extractor.html', quantizers=QUANTIZERS, default_quantizer=DEFAULT_QUANTIZER)
+
+# Page showing a job's results (or a progress message while it is still running)
+@app.route('/results/<job_id>')
+def job_results(job_id):
+    status = job_manager.status(job_id)
+    if status is None:
+        return "Job not found", 404
+    if status['status'] == FAILED:
+        return f"Error processing image: {status.get('error')}"
+    if status['status'] == DONE:
+        result = status['result']
+        return render_template('color_palette_extractor.html', hex_codes=result.get('hex_codes'),
+                               palettes=result.get('palettes'), scenes=result.get('scenes'),
+                               original_image=url_for('job_file', job_id=job_id, filename=result['original_image']),
+                               quantizer=result['quantizer'], cached=result.get('cached', False),
+                               quantizers=QUANTIZERS, default_quantizer=DEFAULT_QUANTIZER)
+    return render_template('color_palette_extractor.html', job_id=job_id,
+                           job_cancelled=status['status'] == CANCELLED,
+                           quantizers=QUANTIZERS, default_quantizer=DEFAULT_QUANTIZER)
+
+# Route for checking the status of a job
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    status = job_manager.status(job_id)
+    if status is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(status)
+
+# Route for cancelling a queued or running job
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    if job_manager.status(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if not job_manager.cancel(job_id):
+        return jsonify({'error': 'Job has already finished'}), 409
+    return jsonify({'message': 'Job cancelled.'})
+
+# Route for the images a job produced (only the files listed in its result are served)
+@app.route('/jobs/<job_id>/files/<filename>')
+def job_file(job_id, filename):
+    status = job_manager.status(job_id)
+    if status is None:
+        return "Job not found", 404
+    if status['status'] != DONE or filename not in cache_file_names(status['result']).values():
+        return "File not found", 404
+    return send_from_directory(os.path.abspath(job_manager.job_dir(job_id)), filename)
 
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
@@ -205,6 +503,7 @@ def open_browser():
     threading.Timer(1, lambda: webbrowser.open_new("http://127.0.0.1:5000/")).start()
 
 if __name__ == '__main__':
+    create_folders()
     # Open the browser in a separate thread
     open_browser()
     # Run the Flask application
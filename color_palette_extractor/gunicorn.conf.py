@@ -0,0 +1,36 @@
+'''
+Gunicorn configuration for serving the Color Palette Extractor in production:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+    WEB_CONCURRENCY=8 GUNICORN_BIND=0.0.0.0:8000 gunicorn -c gunicorn.conf.py wsgi:app
+
+'''
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '127.0.0.1:8000')
+
+# Worker processes (one per CPU by default), each running a few request threads
+workers = int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Import the app (OpenCV, scikit-learn) once in the master; the workers are forked from it
+preload_app = True
+
+# Connections waiting to be accepted; beyond this the kernel refuses new ones
+backlog = 256
+timeout = 300  # Video uploads can be large
+graceful_timeout = 30
+keepalive = 5
+
+# No max_requests: replacing a worker would drop the state that only lives in its process
+# (its jobs' process pool, job tracking and in-memory palette cache), leaving its running jobs unfinished
+
+# create_app() sizes each worker's job pool from the number of web workers
+os.environ['WEB_CONCURRENCY'] = str(workers)
+
+
+def worker_exit(server, worker):
+    # Leave the worker's last metrics for /metrics in the other workers
+    from metrics import flush_metrics
+    flush_metrics()
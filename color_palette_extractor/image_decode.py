@@ -0,0 +1,125 @@
+'''
+Reduced-Resolution Image Decoding
+
+process_image only ever works on a copy of the upload resized to 400 pixels wide, so decoding a
+10,000 x 10,000 print file at full resolution first (300 MB of pixels, seconds of decoding) is
+wasted work. decode_reduced() decodes an image at the smallest resolution that is still at least
+the target width, using the cheapest method available:
+
+    - pyvips (optional): Image.thumbnail shrinks on load (JPEG DCT scaling, WebP scaling, TIFF
+      pyramid levels) and streams the other formats through in strips, so memory stays flat
+      no matter how large the file is
+    - OpenCV: the image size is read from the file header (with Pillow, if installed) and the
+      image is decoded with IMREAD_REDUCED_COLOR_2/4/8. Only JPEGs are decoded directly at 1/2,
+      1/4 or 1/8 scale. PNG, TIFF and the other formats are still decoded at full size (and full
+      memory) and reduced afterwards; only pyvips avoids that.
+    - otherwise a plain cv2.imread, as before
+
+'''
+import struct
+import cv2
+import numpy as np
+
+try:
+    import pyvips
+except (ImportError, OSError):  # pyvips and libvips are optional
+    pyvips = None
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional
+    Image = None
+
+# OpenCV's reduced decoding flags by reduction factor
+REDUCED_FLAGS = {
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+}
+
+
+# JPEG start-of-frame markers, which hold the image size (SOF0-SOF15 except DHT, JPG and DAC)
+JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+# Function to read the (width, height) of a PNG or JPEG straight from its header bytes (None otherwise)
+def _header_size(image_path):
+    with open(image_path, 'rb') as file:
+        head = file.read(24)
+        if head[:8] == PNG_SIGNATURE and head[12:16] == b'IHDR':
+            return struct.unpack('>II', head[16:24])
+        if head[:2] != b'\xff\xd8':
+            return None
+        # Walk the JPEG segments up to the first start-of-frame
+        file.seek(2)
+        while True:
+            marker = file.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return None
+            if marker[1] == 0xFF:
+                file.seek(-1, 1)  # Fill byte before the marker
+                continue
+            if marker[1] == 0x01 or 0xD0 <= marker[1] <= 0xD7:
+                continue  # Markers without a length
+            (length,) = struct.unpack('>H', file.read(2))
+            if marker[1] in JPEG_SOF_MARKERS:
+                height, width = struct.unpack('>xHH', file.read(5))
+                return width, height
+            file.seek(length - 2, 1)
+
+
+# Function to read an image's (width, height) from its header without decoding it (None if unknown)
+def image_size(image_path):
+    if Image is None:
+        return None
+    try:
+        with Image.open(image_path) as img:
+            return img.size
+    except Image.DecompressionBombError:
+        # Pillow refuses images over twice MAX_IMAGE_PIXELS, which are exactly the ones that most
+        # need reduced decoding. PNG and JPEG headers are read directly instead; other formats
+        # are decoded at full size.
+        try:
+            return _header_size(image_path)
+        except (OSError, struct.error):
+            return None
+    except Exception:
+        return None
+
+
+# Function to pick the largest reduction factor that keeps the image at least min_side pixels across
+def reduction_factor(width, height, min_side):
+    # The smaller side is used because EXIF orientation may swap width and height after decoding
+    for factor in sorted(REDUCED_FLAGS, reverse=True):
+        if min(width, height) // factor >= min_side:
+            return factor
+    return 1
+
+
+# Function to decode an image with libvips, shrinking it to target_width on load (None on failure)
+def _decode_with_pyvips(image_path, target_width):
+    try:
+        # A very large height bound makes the width the only constraint; size='down' never enlarges
+        thumb = pyvips.Image.thumbnail(image_path, target_width, height=10_000_000, size='down')
+        if thumb.hasalpha():
+            thumb = thumb.flatten()
+        thumb = thumb.colourspace('srgb').cast('uchar')
+        rgb = np.ndarray(buffer=thumb.write_to_memory(), dtype=np.uint8,
+                         shape=(thumb.height, thumb.width, thumb.bands))
+        return cv2.cvtColor(rgb[:, :, :3], cv2.COLOR_RGB2BGR)
+    except pyvips.Error:
+        return None
+
+
+# Function to decode an image as a BGR array at least target_width wide, but no larger than needed
+def decode_reduced(image_path, target_width):
+    """:return: BGR uint8 image (not resized to exactly target_width), or None if it cannot be read"""
+    if pyvips is not None:
+        img = _decode_with_pyvips(image_path, target_width)
+        if img is not None:
+            return img
+
+    size = image_size(image_path)
+    factor = reduction_factor(*size, target_width) if size else 1
+    return cv2.imread(image_path, REDUCED_FLAGS.get(factor, cv2.IMREAD_COLOR))
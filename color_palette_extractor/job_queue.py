@@ -0,0 +1,239 @@
+'''
+Background Job Queue
+
+A small local job system for running heavy work outside of the HTTP request.
+Each job gets its own ID and output directory, runs in a process pool, and reports
+its state through a status.json file in that directory, so any web worker can answer
+"how far along is job X?" without sharing memory with the process doing the work.
+
+Job functions are called as fn(job, *args, **kwargs), where `job` is a JobContext they
+can use to report progress and to check whether the job has been cancelled.
+
+'''
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from metrics import REGISTRY, flush_metrics
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+STATUS_FILE = 'status.json'
+CANCEL_FILE = 'cancel'
+
+logger = logging.getLogger(__name__)
+
+JOB_SECONDS = REGISTRY.histogram('job_duration_seconds', 'Time from a job starting to finishing, by job function '
+                                 'and final state.', ['job', 'status'])
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when cancellation has been requested."""
+
+
+# Function to write a job's status file atomically (readers never see a half-written file)
+def _write_status(job_dir, **fields):
+    status_path = os.path.join(job_dir, STATUS_FILE)
+    status = _read_status(job_dir) or {}
+    status.update(fields, updated=time.time())
+    temp_path = f'{status_path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump(status, file)
+    os.replace(temp_path, status_path)
+
+
+# Function to read a job's status file (None if the job does not exist)
+def _read_status(job_dir):
+    try:
+        with open(os.path.join(job_dir, STATUS_FILE)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+# Handle passed to job functions for reporting progress and checking for cancellation
+class JobContext:
+    def __init__(self, job_id, job_dir):
+        self.job_id = job_id
+        self.job_dir = job_dir
+
+    def path(self, filename):
+        return os.path.join(self.job_dir, filename)
+
+    def is_cancelled(self):
+        return os.path.exists(self.path(CANCEL_FILE))
+
+    def check_cancelled(self):
+        if self.is_cancelled():
+            raise JobCancelled()
+
+    def update(self, progress=None, message=None):
+        """Report progress (0.0 - 1.0) and/or a short message. Raises JobCancelled if cancelled."""
+        fields = {}
+        if progress is not None:
+            fields['progress'] = max(0.0, min(1.0, float(progress)))
+        if message is not None:
+            fields['message'] = message
+        _write_status(self.job_dir, **fields)
+        self.check_cancelled()
+
+
+# Function run inside the worker process: wraps the job function and records the outcome
+def _run_job(fn, job_id, job_dir, args, kwargs):
+    job = JobContext(job_id, job_dir)
+    start = time.perf_counter()
+    status = DONE
+    try:
+        job.check_cancelled()
+        _write_status(job_dir, status=RUNNING, started=time.time())
+        result = fn(job, *args, **kwargs)
+        _write_status(job_dir, status=DONE, progress=1.0, result=result, finished=time.time())
+    except JobCancelled:
+        status = CANCELLED
+        _write_status(job_dir, status=CANCELLED, finished=time.time())
+    except Exception as e:
+        status = FAILED
+        logger.exception('Job %s (%s) failed', job_id, fn.__name__)
+        _write_status(job_dir, status=FAILED, error=str(e), finished=time.time())
+    finally:
+        # Leave this worker's metrics (including the job's stage timings) for the web process's /metrics
+        JOB_SECONDS.observe(time.perf_counter() - start, job=fn.__name__, status=status)
+        flush_metrics()
+
+
+class JobManager:
+    """Submits jobs to a process pool and tracks them through their job directories.
+
+    :param jobs_folder: directory under which each job gets its own subdirectory (created with the first job)
+    :param max_workers: number of worker processes (defaults to the number of CPUs)
+    :param max_age: seconds after which finished jobs and their files are removed
+    """
+
+    def __init__(self, jobs_folder, max_workers=None, max_age=24 * 60 * 60):
+        self.jobs_folder = jobs_folder
+        self.max_workers = max_workers
+        self.max_age = max_age
+        self._executor = None
+        self._broken = False
+        self._futures = {}
+
+    # The pool is created on first use so importing the app never starts worker processes, and
+    # replaced once a worker process has died (a broken pool rejects every further job)
+    @property
+    def executor(self):
+        if self._broken and self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._executor is None:
+            self._broken = False
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def job_dir(self, job_id):
+        # Job IDs are generated by us; reject anything else so IDs cannot escape jobs_folder
+        try:
+            job_id = uuid.UUID(job_id).hex
+        except (ValueError, TypeError, AttributeError):
+            return None
+        return os.path.join(self.jobs_folder, job_id)
+
+    def create(self, **info):
+        """Create a job directory in the queued state and return (job_id, job_dir).
+
+        Files the job needs (e.g. the uploaded input) can be saved into job_dir before
+        calling start().
+        """
+        self.cleanup()
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.jobs_folder, job_id)
+        os.makedirs(job_dir)
+        _write_status(job_dir, id=job_id, status=QUEUED, progress=0.0, created=time.time(), **info)
+        return job_id, job_dir
+
+    def start(self, job_id, fn, *args, **kwargs):
+        """Queue fn(job, *args, **kwargs) for a job created with create()."""
+        try:
+            future = self.executor.submit(_run_job, fn, job_id, self.job_dir(job_id), args, kwargs)
+        except BrokenProcessPool:
+            self._broken = True
+            future = self.executor.submit(_run_job, fn, job_id, self.job_dir(job_id), args, kwargs)
+        self._futures[job_id] = future
+        future.add_done_callback(lambda done: self._finished(job_id, done))
+        return job_id
+
+    # Done-callback of every job future
+    def _finished(self, job_id, future):
+        self._futures.pop(job_id, None)
+        if future.cancelled() or future.exception() is None:
+            return
+        # _run_job records the job's own errors, so this is the pool failing, e.g. the worker
+        # process was killed for running out of memory. The job would otherwise stay running forever.
+        error = future.exception()
+        if isinstance(error, BrokenProcessPool):
+            self._broken = True
+        status = self.status(job_id)
+        if status is not None and status.get('status') not in FINISHED_STATES:
+            logger.error('Job %s failed in the process pool: %r', job_id, error)
+            _write_status(self.job_dir(job_id), status=FAILED, error=f'Worker process failed: {error}',
+                          finished=time.time())
+
+    def complete(self, job_id, result=None):
+        """Mark a job created with create() as done without running anything (e.g. a cache hit)."""
+        _write_status(self.job_dir(job_id), status=DONE, progress=1.0, result=result, finished=time.time())
+
+    def submit(self, fn, *args, **kwargs):
+        """Create a job and queue fn(job, *args, **kwargs). Returns the job ID."""
+        job_id, _ = self.create()
+        return self.start(job_id, fn, *args, **kwargs)
+
+    def status(self, job_id):
+        """Return the job's status dict, or None if there is no such job."""
+        job_dir = self.job_dir(job_id)
+        if job_dir is None:
+            return None
+        return _read_status(job_dir)
+
+    def cancel(self, job_id):
+        """Request cancellation. Queued jobs are dropped; running jobs stop at their next update()."""
+        job_dir = self.job_dir(job_id)
+        status = self.status(job_id)
+        if status is None:
+            return False
+        if status['status'] in FINISHED_STATES:
+            return False
+        open(os.path.join(job_dir, CANCEL_FILE), 'w').close()
+        future = self._futures.get(job_id)
+        if future is not None and future.cancel():
+            _write_status(job_dir, status=CANCELLED, finished=time.time())
+        return True
+
+    def queue_depth(self):
+        """Number of jobs submitted from this process that have not finished yet."""
+        return len(self._futures)
+
+    def cleanup(self):
+        """Remove job directories for jobs that finished more than max_age seconds ago."""
+        if not os.path.isdir(self.jobs_folder):
+            return
+        cutoff = time.time() - self.max_age
+        for job_id in os.listdir(self.jobs_folder):
+            job_dir = os.path.join(self.jobs_folder, job_id)
+            status = _read_status(job_dir)
+            if status and status.get('status') in FINISHED_STATES and status.get('updated', 0) < cutoff:
+                shutil.rmtree(job_dir, ignore_errors=True)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,164 @@
+'''
+Palette Result Cache
+
+A content-addressed cache for palette extraction results. Entries are keyed by a hash of the
+uploaded image's bytes together with the extraction parameters (mode, target_color, n_clusters,
+quantizer), and hold the extracted hex codes plus the rendered images (the resized original and
+the palette PNG). A repeat upload of the same artwork with the same settings is served straight
+from the cache, without decoding the image or clustering again.
+
+Entries live in two tiers:
+    - in memory: an LRU of recently used entries, bounded by total bytes
+    - on disk:   one folder per entry under the cache folder, bounded by total bytes, least
+                 recently used entries are evicted first. The disk tier is shared by every
+                 process using the same cache folder (e.g. the job worker processes).
+
+'''
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+
+META_FILE = 'meta.json'
+
+
+# Function to compute a cache key from an image's bytes and the extraction parameters
+def make_cache_key(image_bytes, mode='palette', target_color=None, n_clusters=8, quantizer='kmeans'):
+    image_hash = hashlib.sha256(image_bytes).hexdigest()
+    params = json.dumps([mode, target_color, n_clusters, quantizer])
+    return hashlib.sha256(f'{image_hash}:{params}'.encode()).hexdigest()
+
+
+class PaletteCache:
+    """Two-tier (memory + disk) LRU cache of palette results.
+
+    :param cache_folder: directory for the on-disk entries
+    :param max_memory_bytes: size limit for entries kept in memory
+    :param max_disk_bytes: size limit for entries kept on disk
+    """
+
+    def __init__(self, cache_folder, max_memory_bytes=64 * 2**20, max_disk_bytes=512 * 2**20):
+        self.cache_folder = cache_folder
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._disk_bytes = sum(size for _, _, size in self._disk_entries())
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_folder, key[:2], key)
+
+    # Function to list on-disk entries as (last used time, folder, size in bytes)
+    def _disk_entries(self):
+        entries = []
+        if not os.path.isdir(self.cache_folder):
+            return entries  # Nothing has been stored yet
+        for prefix in os.listdir(self.cache_folder):
+            prefix_dir = os.path.join(self.cache_folder, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                entry_dir = os.path.join(prefix_dir, key)
+                try:
+                    last_used = os.path.getmtime(os.path.join(entry_dir, META_FILE))
+                    size = sum(os.path.getsize(os.path.join(entry_dir, name)) for name in os.listdir(entry_dir))
+                except OSError:
+                    continue
+                entries.append((last_used, entry_dir, size))
+        return entries
+
+    def _remember(self, key, entry):
+        size = sum(len(data) for data in entry['files'].values())
+        if size > self.max_memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = (entry, size)
+            self._memory_bytes += size
+            while self._memory_bytes > self.max_memory_bytes:
+                _, (_, evicted_size) = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted_size
+
+    def _load_from_disk(self, key):
+        entry_dir = self._entry_dir(key)
+        meta_path = os.path.join(entry_dir, META_FILE)
+        try:
+            with open(meta_path) as file:
+                meta = json.load(file)
+            files = {}
+            for name in meta['files']:
+                with open(os.path.join(entry_dir, name), 'rb') as file:
+                    files[name] = file.read()
+            os.utime(meta_path)  # Mark as recently used for disk eviction
+        except (OSError, ValueError, KeyError):
+            return None
+        return {'hex_codes': meta['hex_codes'], 'files': files}
+
+    def get(self, key):
+        """Return the cached entry {'hex_codes': [...], 'files': {name: bytes}} or None."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key][0]
+
+        entry = self._load_from_disk(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._remember(key, entry)
+        return entry
+
+    def put(self, key, hex_codes, files):
+        """Store a result. `files` maps names (e.g. 'palette.png') to paths of files to copy in."""
+        files = {name: path for name, path in files.items() if path and os.path.exists(path)}
+        entry_dir = self._entry_dir(key)
+        if os.path.exists(entry_dir):
+            return
+
+        # Write into a temporary folder and rename it into place, so readers never see a partial entry
+        temp_dir = os.path.join(self.cache_folder, f'.tmp-{uuid.uuid4().hex}')
+        os.makedirs(temp_dir)
+        for name, path in files.items():
+            shutil.copyfile(path, os.path.join(temp_dir, name))
+        with open(os.path.join(temp_dir, META_FILE), 'w') as file:
+            json.dump({'hex_codes': hex_codes, 'files': list(files)}, file)
+        os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+        try:
+            os.rename(temp_dir, entry_dir)
+        except OSError:
+            # Another process stored the same entry first
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            return
+
+        self._disk_bytes += sum(os.path.getsize(os.path.join(entry_dir, name)) for name in os.listdir(entry_dir))
+        if self._disk_bytes > self.max_disk_bytes:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        # Recount from disk (other processes share the folder), then drop least recently used entries
+        entries = sorted(self._disk_entries())
+        self._disk_bytes = sum(size for _, _, size in entries)
+        target = self.max_disk_bytes * 0.9
+        for _, entry_dir, size in entries:
+            if self._disk_bytes <= target:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            self._disk_bytes -= size
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'memory_entries': len(self._memory),
+            'memory_bytes': self._memory_bytes,
+            'disk_bytes': self._disk_bytes,
+        }
@@ -0,0 +1,103 @@
+'''
+Color Quantizers
+
+Interchangeable backends for reducing an image's pixels to a small palette of colors.
+Every backend works on the image's deduplicated colors, weighted by how many pixels
+have each color, which is much less data than the raw pixels for most artwork.
+
+Each quantizer is a function quantize(colors, counts, n_colors) -> (K, 3) float array of
+palette colors (K <= n_colors), where colors is an (M, 3) uint8 array of unique BGR colors
+and counts is an (M,) array of pixel counts. Backends are looked up by name in QUANTIZERS:
+
+    - 'kmeans':     scikit-learn KMeans (k-means++, 10 initializations). The most exact, and the slowest.
+    - 'minibatch':  scikit-learn MiniBatchKMeans. Close to KMeans at a fraction of the cost.
+    - 'histogram':  3D color histogram (popularity algorithm): the most populated color cells.
+    - 'median_cut': median cut: repeatedly split the widest color box at its weighted median.
+
+'''
+import numpy as np
+from sklearn.cluster import KMeans, MiniBatchKMeans
+
+DEFAULT_QUANTIZER = 'kmeans'
+
+
+# Function to deduplicate an (N, 3) uint8 pixel array into unique colors and their pixel counts
+def unique_colors(pixels):
+    pixels = np.asarray(pixels, dtype=np.uint8).reshape(-1, 3)
+    # Pack each color into a single integer so np.unique works on a flat array
+    keys = (pixels[:, 0].astype(np.uint32) << 16) | (pixels[:, 1].astype(np.uint32) << 8) | pixels[:, 2]
+    keys, counts = np.unique(keys, return_counts=True)
+    colors = np.stack([(keys >> 16) & 0xFF, (keys >> 8) & 0xFF, keys & 0xFF], axis=1).astype(np.uint8)
+    return colors, counts
+
+
+# KMeans on the unique colors, weighted by pixel count (same clustering as on the raw pixels)
+def quantize_kmeans(colors, counts, n_colors):
+    n_clusters = min(n_colors, len(colors))
+    km = KMeans(n_clusters=n_clusters, init='k-means++', n_init=10)
+    km.fit(colors, sample_weight=counts)
+    return km.cluster_centers_
+
+
+# MiniBatchKMeans: updates the centers from small random batches instead of the full data each step
+def quantize_minibatch(colors, counts, n_colors):
+    n_clusters = min(n_colors, len(colors))
+    km = MiniBatchKMeans(n_clusters=n_clusters, init='k-means++', n_init=3, batch_size=2048)
+    km.fit(colors, sample_weight=counts)
+    return km.cluster_centers_
+
+
+# 3D histogram: bin colors into a bins x bins x bins grid and keep the most populated cells
+def quantize_histogram(colors, counts, n_colors, bins=16):
+    cells = (colors.astype(np.int64) * bins) // 256
+    cell_index = (cells[:, 0] * bins + cells[:, 1]) * bins + cells[:, 2]
+    weights = counts.astype(np.float64)
+
+    cell_counts = np.bincount(cell_index, weights=weights, minlength=bins ** 3)
+    top_cells = np.argsort(cell_counts)[::-1][:n_colors]
+    top_cells = top_cells[cell_counts[top_cells] > 0]
+
+    # Each palette color is the pixel-weighted mean of the colors in its cell
+    centers = np.empty((len(top_cells), 3))
+    for channel in range(3):
+        channel_sums = np.bincount(cell_index, weights=weights * colors[:, channel], minlength=bins ** 3)
+        centers[:, channel] = channel_sums[top_cells] / cell_counts[top_cells]
+    return centers
+
+
+# Median cut: split the box with the widest channel range at its pixel-weighted median until there are n boxes
+def quantize_median_cut(colors, counts, n_colors):
+    boxes = [np.arange(len(colors))]
+    while len(boxes) < n_colors:
+        # Pick the box with the widest single-channel range
+        ranges = [np.ptp(colors[box], axis=0) for box in boxes]
+        widths = [r.max() if len(box) > 1 else -1 for r, box in zip(ranges, boxes)]
+        widest = int(np.argmax(widths))
+        if widths[widest] <= 0:
+            break  # Every remaining box holds a single color
+        box = boxes.pop(widest)
+        channel = int(np.argmax(ranges[widest]))
+
+        order = box[np.argsort(colors[box, channel], kind='stable')]
+        cumulative = np.cumsum(counts[order])
+        split = int(np.searchsorted(cumulative, cumulative[-1] / 2.0))
+        split = min(max(split, 1), len(order) - 1)
+        boxes.extend([order[:split], order[split:]])
+
+    return np.array([np.average(colors[box], axis=0, weights=counts[box]) for box in boxes])
+
+
+QUANTIZERS = {
+    'kmeans': quantize_kmeans,
+    'minibatch': quantize_minibatch,
+    'histogram': quantize_histogram,
+    'median_cut': quantize_median_cut,
+}
+
+
+# Function to quantize an (N, 3) pixel array to at most n_colors colors with the named backend
+def quantize(pixels, n_colors=8, quantizer=DEFAULT_QUANTIZER):
+    if quantizer not in QUANTIZERS:
+        raise ValueError(f"Unknown quantizer '{quantizer}'. Choose one of: {', '.join(QUANTIZERS)}")
+    colors, counts = unique_colors(pixels)
+    return QUANTIZERS[quantizer](colors, counts, n_colors)
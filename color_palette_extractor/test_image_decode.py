@@ -0,0 +1,45 @@
+'''
+Tests for image_decode.py
+
+Checks that image_size still reads the size of images over Pillow's decompression bomb limit
+(lowered for the test, so the images can stay small), without changing the limit itself.
+
+Usage:
+    python -m pytest test_image_decode.py
+
+'''
+import warnings
+import numpy as np
+import pytest
+from PIL import Image
+from image_decode import decode_reduced, image_size
+
+# Lowered pixel limit: Pillow refuses images over twice this many pixels
+TEST_MAX_PIXELS = 10_000
+SIZE = (640, 480)
+
+
+@pytest.fixture
+def low_pixel_limit(monkeypatch):
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', TEST_MAX_PIXELS)
+    warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+
+
+@pytest.mark.parametrize('extension', ['.png', '.jpg'])
+def test_image_size_over_the_pixel_limit(tmp_path, low_pixel_limit, extension):
+    path = str(tmp_path / f'large{extension}')
+    Image.fromarray(np.full((SIZE[1], SIZE[0], 3), 128, dtype=np.uint8)).save(path)
+    with pytest.raises(Image.DecompressionBombError):
+        Image.open(path)
+
+    assert image_size(path) == SIZE
+    assert Image.MAX_IMAGE_PIXELS == TEST_MAX_PIXELS
+    assert decode_reduced(path, 100).shape[1] == SIZE[0] // 4
+
+
+def test_image_size_over_the_pixel_limit_unknown_format(tmp_path, low_pixel_limit):
+    path = str(tmp_path / 'large.bmp')
+    Image.new('RGB', SIZE).save(path)
+
+    assert image_size(path) is None
+    assert decode_reduced(path, 100).shape[:2] == (SIZE[1], SIZE[0])
@@ -0,0 +1,49 @@
+'''
+Tests for video_palette.py
+
+Builds a small animated GIF with three scenes (a long blue one, then short green and red ones)
+and checks the scenes are found and each one's dominant color is in the global palette.
+
+Usage:
+    python -m pytest test_video_palette.py
+
+'''
+import numpy as np
+from PIL import Image
+from video_palette import extract_video_palettes
+
+# (RGB color, number of frames) of each scene
+SCENES = [((30, 60, 220), 24), ((40, 200, 60), 8), ((220, 40, 30), 8)]
+
+# Largest difference on any channel for two colors to count as the same
+COLOR_TOLERANCE = 32
+
+
+def _hex_to_rgb(hex_code):
+    return np.array([int(hex_code[i:i + 2], 16) for i in (1, 3, 5)])
+
+
+def _write_clip(path):
+    rng = np.random.default_rng(0)
+    frames = []
+    for color, count in SCENES:
+        for _ in range(count):
+            # A little noise, so every frame has more distinct colors than the palette size
+            pixels = np.clip(np.array(color) + rng.integers(-12, 13, size=(48, 64, 3)), 0, 255)
+            frames.append(Image.fromarray(pixels.astype(np.uint8)))
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=40, loop=0)
+
+
+def test_every_scene_is_in_the_global_palette(tmp_path):
+    path = str(tmp_path / 'clip.gif')
+    _write_clip(path)
+
+    result = extract_video_palettes(path, n_colors=4, stride=1)
+
+    assert len(result['scenes']) == len(SCENES)
+    global_colors = [_hex_to_rgb(hex_code) for hex_code in result['global']]
+    for scene, (color, _) in zip(result['scenes'], SCENES):
+        dominant = _hex_to_rgb(scene['hex_codes'][0])
+        assert np.abs(dominant - color).max() <= COLOR_TOLERANCE
+        assert any(np.abs(dominant - other).max() <= COLOR_TOLERANCE for other in global_colors), \
+            f"{scene['hex_codes'][0]} missing from the global palette {result['global']}"
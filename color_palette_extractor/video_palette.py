@@ -0,0 +1,310 @@
+'''
+Video and Animated GIF Palettes
+
+Extracts a global palette plus one palette per scene from a video or an animated GIF without
+ever holding more than one frame in memory:
+
+    - frames are streamed with cv2.VideoCapture (animated GIFs fall back to Pillow when the
+      OpenCV build cannot read them), and only every `stride`-th frame is decoded and used
+    - each sampled frame is resized to TARGET_WIDTH, reduced to its unique colors weighted by
+      pixel count, and fed to MiniBatchKMeans.partial_fit, so the palette is updated one frame
+      at a time instead of clustering all the frames' pixels at the end
+    - a scene cut is detected when a frame's hue/saturation histogram differs sharply from the
+      previous sampled frame's, and each scene gets its own online clusterer
+    - the global palette is built at the end by a weighted k-means over the scenes' centers (each
+      weighted by its pixel count), so every scene is represented. A single clusterer updated over
+      the whole video would keep its first scene's centers and let later scenes collapse into them.
+
+Palettes are ordered by how many sampled pixels fall into each color, most dominant first.
+
+Usage:
+    python video_palette.py clip.mp4
+    python video_palette.py animation.gif --stride 2 --n-colors 6 --scene-threshold 0.4
+
+'''
+import argparse
+import contextlib
+import json
+import sys
+import cv2
+import numpy as np
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from quantizers import unique_colors
+from metrics import span
+
+try:
+    from PIL import Image, ImageSequence
+except ImportError:  # Pillow is optional (only needed for GIFs OpenCV cannot read)
+    Image = None
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv', '.webm', '.m4v', '.gif')
+
+# Use every FRAME_STRIDE-th frame (1 = every frame)
+FRAME_STRIDE = 10
+
+# Width frames are resized to before clustering
+TARGET_WIDTH = 400
+
+# Most pixels per sampled frame passed to the clusterer (None = no limit)
+FRAME_SAMPLE_BUDGET = 50_000
+
+# A new scene starts when the Bhattacharyya distance between the hue/saturation histograms of two
+# consecutive sampled frames is above SCENE_THRESHOLD (0 = identical, 1 = nothing in common),
+# as long as the current scene already has MIN_SCENE_FRAMES sampled frames
+SCENE_THRESHOLD = 0.5
+MIN_SCENE_FRAMES = 3
+HIST_BINS = (30, 16)  # Hue, saturation
+
+
+# Function to yield (frame index, time in seconds or None, BGR frame) for every stride-th frame
+def _iter_capture(video_path, stride):
+    capture = cv2.VideoCapture(video_path)
+    try:
+        if not capture.isOpened():
+            return
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        index = 0
+        while True:
+            if index % stride == 0:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                yield index, index / fps if fps > 0 else None, frame
+            # Skipped frames are only grabbed, not converted to images
+            elif not capture.grab():
+                break
+            index += 1
+    finally:
+        capture.release()
+
+
+# Same as _iter_capture, for animated images read with Pillow
+def _iter_pil(video_path, stride):
+    if Image is None:
+        return
+    try:
+        img = Image.open(video_path)
+    except Exception:
+        return
+    with img:
+        seconds = 0.0
+        for index, frame in enumerate(ImageSequence.Iterator(img)):
+            if index % stride == 0:
+                rgb = np.asarray(frame.convert('RGB'))
+                yield index, seconds, cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+            seconds += frame.info.get('duration', 0) / 1000
+
+
+# Function to stream the sampled frames of a video or animated GIF
+def iter_frames(video_path, stride=FRAME_STRIDE):
+    """Yield (frame index, time in seconds or None, BGR frame) for every stride-th frame.
+
+    :raises ValueError: if no frame can be read
+    """
+    if stride < 1:
+        raise ValueError('stride must be at least 1')
+    count = 0
+    for item in _iter_capture(video_path, stride):
+        count += 1
+        yield item
+    if count == 0:
+        for item in _iter_pil(video_path, stride):
+            count += 1
+            yield item
+    if count == 0:
+        raise ValueError("Invalid video path or unsupported video format.")
+
+
+# Function to read the number of frames from the container (0 if unknown), for progress reporting
+def frame_count(video_path):
+    capture = cv2.VideoCapture(video_path)
+    try:
+        count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) if capture.isOpened() else 0
+    finally:
+        capture.release()
+    if count <= 0 and Image is not None:
+        try:
+            with Image.open(video_path) as img:
+                count = getattr(img, 'n_frames', 0)
+        except Exception:
+            count = 0
+    return max(count, 0)
+
+
+# Function to merge lists of (unique colors, counts) into one set of unique colors with summed counts
+def _merge_colors(colors, counts):
+    colors = np.concatenate(colors)
+    counts = np.concatenate(counts)
+    keys = (colors[:, 0].astype(np.uint32) << 16) | (colors[:, 1].astype(np.uint32) << 8) | colors[:, 2]
+    keys, inverse = np.unique(keys, return_inverse=True)
+    merged = np.stack([(keys >> 16) & 0xFF, (keys >> 8) & 0xFF, keys & 0xFF], axis=1).astype(np.uint8)
+    return merged, np.bincount(inverse.ravel(), weights=counts)
+
+
+def _hex_code(bgr):
+    b, g, r = (int(round(c)) for c in bgr)
+    return "#{:02x}{:02x}{:02x}".format(r, g, b)
+
+
+class OnlinePalette:
+    """A palette updated one frame at a time with MiniBatchKMeans.partial_fit.
+
+    :param n_colors: palette size. The clusterer starts with k-means++ on the first frames; frames
+        are held back (as unique colors) until together they have at least n_colors distinct colors.
+    """
+
+    def __init__(self, n_colors):
+        self.n_colors = n_colors
+        self.model = None
+        self.weights = np.zeros(n_colors)
+        self._pending = ([], [])
+
+    def update(self, colors, counts):
+        if self.model is None:
+            self._pending[0].append(colors)
+            self._pending[1].append(counts)
+            colors, counts = _merge_colors(*self._pending)
+            if len(colors) < self.n_colors:
+                self._pending = ([colors], [counts])
+                return
+            self._pending = ([], [])
+            self.model = MiniBatchKMeans(n_clusters=self.n_colors, init='k-means++', n_init=1,
+                                         batch_size=4096, random_state=0)
+        points = colors.astype(np.float64)
+        self.model.partial_fit(points, sample_weight=counts)
+        # Pixel counts per center, for ordering the palette by dominance
+        self.weights += np.bincount(self.model.predict(points), weights=counts, minlength=self.n_colors)
+
+    def weighted_centers(self):
+        """(centers, pixel counts) of the colors in use, most dominant first."""
+        if self.model is None:
+            # Fewer distinct colors than n_colors were seen: the palette is those colors
+            if not self._pending[0]:
+                return np.empty((0, 3)), np.empty(0)
+            colors, counts = _merge_colors(*self._pending)
+            order = np.argsort(-counts, kind='stable')
+            return colors[order].astype(np.float64), counts[order]
+        order = [i for i in np.argsort(-self.weights, kind='stable') if self.weights[i] > 0]
+        return self.model.cluster_centers_[order], self.weights[order]
+
+    def hex_codes(self):
+        return [_hex_code(center) for center in self.weighted_centers()[0]]
+
+
+# Function to combine several palettes into one of n_colors, by a k-means over their centers
+# weighted by pixel count
+def merge_palettes(palettes, n_colors):
+    centers, weights = zip(*(palette.weighted_centers() for palette in palettes))
+    centers, weights = np.concatenate(centers), np.concatenate(weights)
+    if len(centers) <= n_colors:
+        order = np.argsort(-weights, kind='stable')
+        return [_hex_code(centers[i]) for i in order]
+    model = KMeans(n_clusters=n_colors, n_init=4, random_state=0).fit(centers, sample_weight=weights)
+    totals = np.bincount(model.labels_, weights=weights, minlength=n_colors)
+    order = np.argsort(-totals, kind='stable')
+    return [_hex_code(model.cluster_centers_[i]) for i in order if totals[i] > 0]
+
+
+# Function to compute the normalized hue/saturation histogram used for scene cut detection
+def frame_histogram(hsv_frame):
+    hist = cv2.calcHist([hsv_frame], [0, 1], None, list(HIST_BINS), [0, 180, 0, 256])
+    return cv2.normalize(hist, hist).flatten()
+
+
+# Function to resize a frame to `width` pixels wide (frames are never enlarged)
+def resize_frame(frame, width=TARGET_WIDTH):
+    height, frame_width = frame.shape[:2]
+    if frame_width <= width:
+        return frame
+    return cv2.resize(frame, (width, max(1, round(height * width / frame_width))), interpolation=cv2.INTER_AREA)
+
+
+def extract_video_palettes(video_path, n_colors=8, stride=FRAME_STRIDE, width=TARGET_WIDTH,
+                           scene_threshold=SCENE_THRESHOLD, min_scene_frames=MIN_SCENE_FRAMES,
+                           sample_budget=FRAME_SAMPLE_BUDGET, progress=None):
+    """Stream a video or animated GIF and cluster its sampled frames incrementally.
+
+    :param progress: optional callback called with the number of frames read so far
+    :return: dict with 'global' (hex codes), 'scenes' (list of dicts with 'hex_codes',
+        'start_frame', 'end_frame', 'start_seconds', 'end_seconds' and 'sampled_frames', where
+        the frames are the first and last sampled frame of the scene), 'sampled_frames' and
+        'preview' (the first sampled frame, resized)
+    """
+    rng = np.random.default_rng(0)  # Fixed seed, so the same video always gives the same palettes
+    scenes = []
+    scene_palettes = []
+    scene = None
+    previous_hist = None
+    preview = None
+    sampled = 0
+
+    def finish_scene():
+        info = scene['info']
+        info['hex_codes'] = scene['palette'].hex_codes()
+        scenes.append(info)
+        scene_palettes.append(scene['palette'])
+
+    with contextlib.closing(iter_frames(video_path, stride)) as frames:
+        while True:
+            with span('decode'):
+                item = next(frames, None)
+            if item is None:
+                break
+            index, seconds, frame = item
+            with span('resize'):
+                frame = resize_frame(frame, width)
+                hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+            if preview is None:
+                preview = frame
+
+            with span('scene_detect'):
+                hist = frame_histogram(hsv)
+                cut = (previous_hist is not None and scene['info']['sampled_frames'] >= min_scene_frames
+                       and cv2.compareHist(previous_hist, hist, cv2.HISTCMP_BHATTACHARYYA) > scene_threshold)
+                previous_hist = hist
+            if scene is None or cut:
+                if scene is not None:
+                    finish_scene()
+                scene = {'palette': OnlinePalette(n_colors),
+                         'info': {'start_frame': index, 'start_seconds': seconds, 'sampled_frames': 0}}
+
+            with span('collect_pixels'):
+                pixels = frame.reshape(-1, 3)
+                if sample_budget is not None and len(pixels) > sample_budget:
+                    pixels = pixels[np.sort(rng.choice(len(pixels), size=sample_budget, replace=False))]
+                colors, counts = unique_colors(pixels)
+            with span('quantize'):
+                scene['palette'].update(colors, counts)
+
+            scene['info'].update(end_frame=index, end_seconds=seconds)
+            scene['info']['sampled_frames'] += 1
+            sampled += 1
+            if progress is not None:
+                progress(index + 1)
+
+    if scene is not None:
+        finish_scene()
+    with span('quantize'):
+        global_hex_codes = merge_palettes(scene_palettes, n_colors) if scene_palettes else []
+    return {'global': global_hex_codes, 'scenes': scenes, 'sampled_frames': sampled, 'preview': preview}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Extract the global and per-scene palettes of a video or animated GIF.')
+    parser.add_argument('video', help='video file or animated GIF')
+    parser.add_argument('--stride', type=int, default=FRAME_STRIDE, help='use every Nth frame')
+    parser.add_argument('--n-colors', type=int, default=8)
+    parser.add_argument('--scene-threshold', type=float, default=SCENE_THRESHOLD,
+                        help='histogram distance (0-1) above which a new scene starts')
+    parser.add_argument('--min-scene-frames', type=int, default=MIN_SCENE_FRAMES,
+                        help='sampled frames a scene must have before it can end')
+    args = parser.parse_args(argv)
+
+    result = extract_video_palettes(args.video, n_colors=args.n_colors, stride=args.stride,
+                                    scene_threshold=args.scene_threshold, min_scene_frames=args.min_scene_frames)
+    result.pop('preview')
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
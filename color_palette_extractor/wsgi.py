@@ -0,0 +1,57 @@
+'''
+WSGI Entry Point
+
+Production entry point for the Color Palette Extractor, served by gunicorn with gunicorn.conf.py:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+create_app() prepares the app defined in color_palette_extractor.py for serving from several worker
+processes:
+
+    - with preload_app, OpenCV, scikit-learn and the app are imported once, in the gunicorn master,
+      and shared by the forked workers
+    - each web worker's job process pool gets an equal share of the CPUs
+    - back-pressure: a worker already handling MAX_IN_FLIGHT requests answers further ones with
+      503 (result pages, status polling and images excepted), and new uploads are refused with 503
+      while MAX_QUEUED_JOBS of this worker's jobs are waiting or running
+
+'''
+import color_palette_extractor
+from serving import job_workers_per_process, limit_in_flight, shed_load
+
+# Serving settings; any of them (and any other app.config key) can be overridden with create_app(config)
+SERVING_CONFIG = {
+    'MAX_IN_FLIGHT': 3,  # gunicorn.conf.py runs 4 threads per worker, so one is always left for polling
+    'MAX_QUEUED_JOBS': None,  # None = 4 per job worker process
+}
+
+# Endpoints that are cheap to answer and never limited
+LIGHT_ENDPOINTS = {'job_results', 'job_status', 'cancel_job', 'job_file', 'uploaded_file', 'palette_file'}
+
+
+# Function to configure the Color Palette Extractor for production serving
+def create_app(config=None):
+    app = color_palette_extractor.app
+    if 'serving' in app.extensions:
+        # The app is created once, when color_palette_extractor is imported, so a later config could not be applied
+        if config is not None and config != app.extensions['serving']:
+            raise RuntimeError('create_app() was already called with a different config; '
+                               'change the create_app() call in wsgi.py instead')
+        return app
+    app.config.update(SERVING_CONFIG)
+    app.config['MAX_WORKERS'] = job_workers_per_process()
+    app.config.update(config or {})
+    color_palette_extractor.create_folders()
+    if app.config['MAX_QUEUED_JOBS'] is None:
+        app.config['MAX_QUEUED_JOBS'] = 4 * app.config['MAX_WORKERS']
+
+    job_manager = color_palette_extractor.job_manager
+    job_manager.max_workers = app.config['MAX_WORKERS']  # The pool itself is only started by the first job
+
+    limit_in_flight(app, app.config['MAX_IN_FLIGHT'], exempt=LIGHT_ENDPOINTS)
+    shed_load(app, lambda: job_manager.queue_depth() >= app.config['MAX_QUEUED_JOBS'], endpoints={'upload'})
+    app.extensions['serving'] = dict(config or {})
+    return app
+
+
+app = create_app()
@@ -0,0 +1,111 @@
+'''
+NOVITA Client Benchmark
+
+Measures latency and throughput of the img2prompt call against the local stub server
+(stub_novita_server.py, started in the background on a free port), comparing:
+
+    - requests.post: a new connection per call, one call at a time (how image_to_prompt used to call the API)
+    - client:        NovitaClient, pooled keep-alive connections, one call at a time
+    - bulk route:    image2prompt.generate_bulk, the /bulk code path (decode, resize, encode, call), with
+                     the pooled client and no prompt cache or features, so every image calls the API
+
+Usage:
+    python benchmark_novita_client.py --images 40 --latency 0.2 --error-rate 0.05
+
+'''
+import argparse
+import base64
+import io
+import logging
+import os
+import tempfile
+import threading
+import time
+import numpy as np
+import requests
+from PIL import Image
+from werkzeug.serving import make_server
+import image2prompt
+from novita_client import NovitaClient
+from prompt_cache import PromptCache
+from stub_novita_server import create_stub_app
+
+
+# Function to make JPEGs of random 299x299 images, like image_to_prompt sends
+def make_images(count, seed=0):
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        img = Image.fromarray(rng.integers(0, 256, (299, 299, 3), dtype=np.uint8))
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG')
+        images.append(buffer.getvalue())
+    return images
+
+
+# Function to time each call of a function over the payloads, as (per-call latencies, total seconds, failures)
+def timed_calls(call, payloads):
+    latencies = []
+
+    def timed(payload):
+        start = time.perf_counter()
+        result = call(payload)
+        latencies.append(time.perf_counter() - start)
+        return result
+
+    start = time.perf_counter()
+    results = [timed(payload) for payload in payloads]
+    return latencies, time.perf_counter() - start, sum(result is None for result in results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the NOVITA client against the local stub server.')
+    parser.add_argument('--images', type=int, default=40)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args(argv)
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)  # No per-request log lines from the stub
+    server = make_server('127.0.0.1', 0, create_stub_app(latency=args.latency, jitter=args.latency / 10,
+                                                         error_rate=args.error_rate), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/v3/img2prompt'
+    images = make_images(args.images)
+    payloads = [base64.b64encode(data).decode('utf-8') for data in images]
+    client = NovitaClient('stub-key', url=url, backoff_factor=0.05, max_concurrency=args.concurrency)
+
+    def plain_post(payload):
+        response = requests.post(url, json={"image_file": payload},
+                                 headers={"Authorization": "Bearer stub-key"})
+        return response.json() if response.status_code == 200 else None
+
+    runs = {
+        'requests.post': lambda: timed_calls(plain_post, payloads),
+        'client': lambda: timed_calls(client.img2prompt, payloads),
+    }
+
+    print(f"{'mode':<14} {'p50 ms':>8} {'p95 ms':>8} {'total s':>8} {'images/s':>9} {'failed':>7}")
+    for name, run in runs.items():
+        latencies, total, failed = run()
+        p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+        print(f'{name:<14} {p50:>8.1f} {p95:>8.1f} {total:>8.2f} {len(payloads) / total:>9.1f} {failed:>7}')
+
+    # The /bulk route's code path, calling the stub through the benchmark's client
+    image2prompt.novita_client = client
+    image2prompt.FEATURES_ENABLED = False
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # max_distance=-1: nothing is ever a cache hit
+        image2prompt.prompt_cache = PromptCache(os.path.join(cache_dir, 'cache.sqlite3'), max_distance=-1)
+        start = time.perf_counter()
+        results = image2prompt.generate_bulk([(f'{index}.jpg', data) for index, data in enumerate(images)])
+        total = time.perf_counter() - start
+    failed = sum(result['prompt'] is None for result in results)
+    print(f"{'bulk route':<14} {'-':>8} {'-':>8} {total:>8.2f} {len(payloads) / total:>9.1f} {failed:>7}")
+
+    client.close()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+'''
+Request Path Benchmark
+
+Compares the image handling of an upload before and after the single-decode pipeline, without
+the model or the API (both are the same either way):
+
+    - before: decode the full image, resize to 299x299, convert to an array, JPEG + base64 encode
+              the resized image for the API, then JPEG + base64 encode the full-size image again
+              to embed it in the page
+    - after:  prepare_upload() (one decode, reduced-scale for large JPEGs, one resize, a small
+              thumbnail file for the preview), then the array and the API's JPEG + base64
+
+Each path runs in its own process over the same images, as PNG and as JPEG copies, and reports
+the mean time per upload, the peak Python allocation per upload (tracemalloc) and the peak
+process memory (RSS), which also counts the image buffers PIL allocates outside Python.
+
+Usage:
+    python benchmark_request_path.py [image folder]
+
+'''
+import base64
+import glob
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from PIL import Image
+
+APP_FOLDER = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_IMAGE_FOLDER = os.path.join(APP_FOLDER, '..', 'training images')
+
+
+# The request path as it was: every step works on a full-resolution copy
+def before(data):
+    img = Image.open(io.BytesIO(data)).convert("RGB")
+    resized = img.resize((299, 299), Image.LANCZOS)
+    img_array = np.asarray(resized, dtype=np.float32)
+    buffer = io.BytesIO()
+    resized.save(buffer, format='JPEG')
+    encoded_image = base64.b64encode(buffer.getvalue()).decode('utf-8')
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG')
+    image_url = base64.b64encode(buffer.getvalue()).decode('utf-8')
+    return img_array, encoded_image, image_url
+
+
+def after(data):
+    from image2prompt import prepare_upload
+    img, preview_key = prepare_upload(data)
+    img_array = np.asarray(img, dtype=np.float32)
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG')
+    encoded_image = base64.b64encode(buffer.getvalue()).decode('utf-8')
+    return img_array, encoded_image, preview_key
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+# Run in a child process: time one path over the images and print the measurements as JSON
+def run_path(path_name, image_paths, work_dir):
+    os.chdir(work_dir)  # image2prompt creates its folders in the working directory
+    sys.path.insert(0, APP_FOLDER)
+    path = {'before': before, 'after': after}[path_name]
+    uploads = []
+    for image_path in image_paths:
+        with open(image_path, 'rb') as file:
+            uploads.append(file.read())
+    warmup = io.BytesIO()
+    Image.new('RGB', (32, 32)).save(warmup, format='PNG')
+    path(warmup.getvalue())  # Warm up imports
+    baseline_rss = peak_rss_mb()
+
+    times, peaks = [], []
+    for data in uploads:
+        tracemalloc.start()
+        start = time.perf_counter()
+        path(data)
+        times.append(time.perf_counter() - start)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    print(json.dumps({'ms': 1000 * float(np.mean(times)), 'python_mb': float(np.mean(peaks)) / 2**20,
+                      'rss_growth_mb': peak_rss_mb() - baseline_rss}))
+
+
+def measure(path_name, image_paths, work_dir):
+    completed = subprocess.run([sys.executable, __file__, '--run', path_name, work_dir] + image_paths,
+                               capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main(image_folder):
+    png_paths = sorted(glob.glob(os.path.join(image_folder, '**', '*.png'), recursive=True))
+    if not png_paths:
+        print(f'No images found in {image_folder}')
+        return
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        jpeg_paths = []
+        for index, png_path in enumerate(png_paths):
+            jpeg_path = os.path.join(work_dir, f'{index}.jpg')
+            Image.open(png_path).convert('RGB').save(jpeg_path, quality=90)
+            jpeg_paths.append(jpeg_path)
+
+        print(f'{len(png_paths)} images')
+        print(f"{'input':<6} {'path':<7} {'ms/upload':>10} {'Python MB':>10} {'RSS growth MB':>14}")
+        for label, paths in (('PNG', png_paths), ('JPEG', jpeg_paths)):
+            for path_name in ('before', 'after'):
+                result = measure(path_name, paths, work_dir)
+                print(f"{label:<6} {path_name:<7} {result['ms']:>10.1f} {result['python_mb']:>10.2f} "
+                      f"{result['rss_growth_mb']:>14.1f}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == '--run':
+        run_path(sys.argv[2], sys.argv[4:], sys.argv[3])
+    else:
+        main(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_IMAGE_FOLDER)
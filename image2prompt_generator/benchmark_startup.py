@@ -0,0 +1,96 @@
+'''
+Startup Benchmark
+
+Measures how long image2prompt.py takes to import and how much memory it uses, each scenario in a
+fresh Python process:
+
+    - no-model:   IMAGE2PROMPT_FEATURES=0, import only (the model is never loaded)
+    - lazy:       import only, the model is not loaded yet (the default until the first request)
+    - model-load: import, then build the InceptionV3 model (what warmup or the first request pays)
+
+For each scenario it reports the import time, the model load time and the peak resident memory
+(RSS) of the process. Pass --max-import-seconds / --max-rss-mb to fail (exit code 1) when the
+lazy import gets slower or bigger than expected, so startup regressions are caught.
+
+Usage:
+    python benchmark_startup.py
+    python benchmark_startup.py --skip-model --max-import-seconds 2 --max-rss-mb 300
+
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+APP_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+# Code run in the child process; prints one JSON line of measurements
+CHILD_CODE = '''
+import json, resource, sys, time
+start = time.perf_counter()
+import image2prompt
+result = {'import_seconds': time.perf_counter() - start, 'load_seconds': None, 'error': None}
+if sys.argv[1] == 'model-load':
+    try:
+        image2prompt.model.get()
+        result['load_seconds'] = image2prompt.model.load_seconds
+    except Exception as e:
+        result['error'] = f'{type(e).__name__}: {e}'
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+result['peak_rss_mb'] = peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+print(json.dumps(result))
+'''
+
+SCENARIOS = {
+    'no-model': {'IMAGE2PROMPT_FEATURES': '0'},
+    'lazy': {},
+    'model-load': {},
+}
+
+
+# Function to run one scenario in a fresh interpreter and return its measurements
+def run_scenario(name):
+    env = dict(os.environ, **SCENARIOS[name])
+    completed = subprocess.run([sys.executable, '-c', CHILD_CODE, name], cwd=APP_FOLDER, env=env,
+                               capture_output=True, text=True)
+    if completed.returncode != 0:
+        return {'error': completed.stderr.strip().splitlines()[-1] if completed.stderr else 'failed'}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure image2prompt startup time and memory.')
+    parser.add_argument('--skip-model', action='store_true', help='skip the model-load scenario')
+    parser.add_argument('--max-import-seconds', type=float, default=None)
+    parser.add_argument('--max-rss-mb', type=float, default=None)
+    args = parser.parse_args(argv)
+
+    names = [name for name in SCENARIOS if not (args.skip_model and name == 'model-load')]
+    results = {}
+    print(f"{'scenario':<12} {'import s':>9} {'load s':>8} {'peak RSS MB':>12}")
+    for name in names:
+        result = results[name] = run_scenario(name)
+        if result.get('import_seconds') is None:
+            print(f"{name:<12} error: {result['error']}")
+            continue
+        load = f"{result['load_seconds']:.2f}" if result['load_seconds'] is not None else '-'
+        line = f"{name:<12} {result['import_seconds']:>9.2f} {load:>8} {result['peak_rss_mb']:>12.0f}"
+        print(line + (f"  ({result['error']})" if result['error'] else ''))
+
+    failures = []
+    lazy = results['lazy']
+    if lazy.get('import_seconds') is None:
+        failures.append(f"lazy import failed: {lazy['error']}")
+    else:
+        if args.max_import_seconds is not None and lazy['import_seconds'] > args.max_import_seconds:
+            failures.append(f"lazy import took {lazy['import_seconds']:.2f} s (limit {args.max_import_seconds} s)")
+        if args.max_rss_mb is not None and lazy['peak_rss_mb'] > args.max_rss_mb:
+            failures.append(f"lazy import used {lazy['peak_rss_mb']:.0f} MB (limit {args.max_rss_mb} MB)")
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,226 @@
+'''
+Batched, Cached Feature Extraction
+
+Helpers for computing InceptionV3 image embeddings efficiently:
+
+    - BatchingPredictor: coalesces concurrent requests into one model.predict call. Requests that
+      arrive within a short window (max_wait seconds, or until max_batch_size is reached) are
+      stacked into a single batch, which is much cheaper per image than one predict per request.
+    - FeatureStore: persists feature vectors on disk as .npy files keyed by a hash of the image
+      content, and reads them back memory-mapped, so each image's embedding is computed only once.
+    - FeatureExtractor: puts the two together: look up the store first, predict (batched) on a miss.
+    - LazyModel: builds the model on first use (thread-safe), or ahead of time in a background warmup
+      thread, so importing the app does not pay for TensorFlow and the InceptionV3 weights.
+
+'''
+import hashlib
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+import numpy as np
+
+INCEPTION_INPUT_SHAPE = (299, 299, 3)
+
+
+# Function to compute the content key of an image array (e.g. the resized 299x299 RGB image)
+def feature_key(img_array):
+    img_array = np.ascontiguousarray(img_array)
+    digest = hashlib.sha256(str(img_array.shape).encode())
+    digest.update(img_array.tobytes())
+    return digest.hexdigest()
+
+
+# Function to build the InceptionV3 feature model (the network up to its last pooling layer).
+# TensorFlow is imported here rather than at module level, so it is only loaded when the model is needed.
+def build_inception_model():
+    from tensorflow.keras.applications import InceptionV3
+    from tensorflow.keras.models import Model
+
+    base_model = InceptionV3(weights='imagenet')
+    model = Model(inputs=base_model.input, outputs=base_model.layers[-2].output)
+    # Run one prediction now so the predict function is built here rather than on the first request
+    model.predict(np.zeros((1,) + INCEPTION_INPUT_SHAPE, dtype=np.float32), verbose=0)
+    return model
+
+
+# Function to scale pixel values to [-1, 1], the same as keras' inception_v3.preprocess_input
+def preprocess_inception(img_array):
+    return img_array / 127.5 - 1.0
+
+
+class LazyModel:
+    """Holds a model that is built on first use by build_fn, at most once, from any thread."""
+
+    def __init__(self, build_fn):
+        self.build_fn = build_fn
+        self.load_seconds = None
+        self.error = None
+        self._model = None
+        self._lock = threading.Lock()
+        self._warmup_thread = None
+
+    @property
+    def loaded(self):
+        return self._model is not None
+
+    def get(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    start = time.perf_counter()
+                    try:
+                        model = self.build_fn()
+                    except Exception as e:
+                        self.error = str(e)
+                        raise
+                    self.load_seconds = time.perf_counter() - start
+                    self.error = None
+                    self._model = model
+        return self._model
+
+    def _warmup(self):
+        try:
+            self.get()
+        except Exception:
+            pass  # Recorded in self.error; requests will try loading again
+
+    def start_warmup(self):
+        """Start loading the model in a background thread."""
+        with self._lock:
+            if self._model is None and self._warmup_thread is None:
+                self._warmup_thread = threading.Thread(target=self._warmup, name='model-warmup', daemon=True)
+                self._warmup_thread.start()
+
+    def status(self):
+        if self._model is not None:
+            return 'loaded'
+        if self._warmup_thread is not None and self._warmup_thread.is_alive():
+            return 'loading'
+        if self.error is not None:
+            return 'failed'
+        return 'not_loaded'
+
+
+class BatchingPredictor:
+    """Runs predict_fn on batches built from concurrent single-item requests.
+
+    :param predict_fn: function taking a stacked (N, ...) array and returning N outputs
+    :param max_batch_size: largest batch passed to predict_fn
+    :param max_wait: seconds to wait for more requests after the first one arrives
+    """
+
+    def __init__(self, predict_fn, max_batch_size=16, max_wait=0.02):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batches_run = 0
+        self.items_predicted = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def queue_depth(self):
+        """Number of items waiting for a batch."""
+        return self._queue.qsize()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='batching-predictor', daemon=True)
+                self._thread.start()
+
+    def predict(self, item):
+        """Predict a single item (without a batch dimension); blocks until its batch has run."""
+        future = Future()
+        self._queue.put((item, future))
+        self._ensure_worker()
+        return future.result()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                outputs = self.predict_fn(np.stack([item for item, _ in batch]))
+                if len(outputs) != len(batch):
+                    raise ValueError(f'predict_fn returned {len(outputs)} outputs for a batch of {len(batch)}')
+            except Exception as e:
+                # Fail every caller rather than leaving some of them waiting forever
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches_run += 1
+            self.items_predicted += len(batch)
+            for (_, future), output in zip(batch, outputs):
+                future.set_result(output)
+
+
+class FeatureStore:
+    """On-disk store of feature vectors, one memory-mapped .npy file per content key."""
+
+    def __init__(self, folder):
+        self.folder = folder  # Created by the first put
+
+    def path(self, key):
+        return os.path.join(self.folder, key[:2], f'{key}.npy')
+
+    def get(self, key):
+        try:
+            return np.load(self.path(key), mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, features):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file and rename, so readers never see a partial file
+        temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(temp_path, 'wb') as file:
+            np.save(file, np.asarray(features, dtype=np.float32))
+        os.replace(temp_path, path)
+
+
+class FeatureExtractor:
+    """Returns (key, features) for an image array, computing each embedding at most once.
+
+    :param store: FeatureStore for persisted embeddings
+    :param predictor: BatchingPredictor wrapping the model
+    :param preprocess_fn: model-specific preprocessing applied to a copy of the array before predicting
+    """
+
+    def __init__(self, store, predictor, preprocess_fn=None):
+        self.store = store
+        self.predictor = predictor
+        self.preprocess_fn = preprocess_fn
+        self.hits = 0
+        self.misses = 0
+
+    def extract(self, img_array):
+        key = feature_key(img_array)
+        features = self.store.get(key)
+        if features is not None:
+            self.hits += 1
+            return key, features
+
+        self.misses += 1
+        model_input = np.array(img_array, dtype=np.float32)
+        if self.preprocess_fn is not None:
+            model_input = self.preprocess_fn(model_input)
+        features = self.predictor.predict(model_input)
+        self.store.put(key, features)
+        return key, features
@@ -0,0 +1,38 @@
+'''
+Gunicorn configuration for serving the Image to Prompt Generator in production:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+    WEB_CONCURRENCY=4 GUNICORN_BIND=0.0.0.0:8000 gunicorn -c gunicorn.conf.py wsgi:app
+
+'''
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '127.0.0.1:8000')
+
+# A few worker processes (each loads its own InceptionV3 model) with many request threads each:
+# requests mostly wait on the NOVITA API, and a worker's threads share its model and predict batches
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Import the app once in the master (everything but the model); the workers are forked from it
+preload_app = True
+
+# Connections waiting to be accepted; beyond this the kernel refuses new ones
+backlog = 256
+timeout = 300  # A /bulk request can carry 100 images
+graceful_timeout = 30
+keepalive = 5
+# No max_requests: a replacement worker would have to load the model again
+
+
+def post_fork(server, worker):
+    # Build the model in the worker: TensorFlow cannot be shared across a fork
+    from wsgi import start_worker
+    start_worker()
+
+
+def worker_exit(server, worker):
+    # Leave the worker's last metrics for /metrics in the other workers
+    from metrics import flush_metrics
+    flush_metrics()
@@ -11,16 +11,23 @@ This generator will take an image as input and generate a prompt based on the co
 image. The prompt can then be used to generate new images using text-to-image models.
 '''
 # Flask application for Image to Prompt Generator using NOVITA API
-from flask import Flask, request, render_template, send_file
-import requests
+from flask import Flask, request, render_template, send_file, send_from_directory, jsonify, abort, url_for
 import numpy as np
 import base64
 from PIL import Image
-from tensorflow.keras.applications import InceptionV3
-from tensorflow.keras.applications.inception_v3 import preprocess_input
-from tensorflow.keras.preprocessing.image import img_to_array
-from tensorflow.keras.models import Model
+from feature_extraction import (BatchingPredictor, FeatureStore, FeatureExtractor, LazyModel,
+                                build_inception_model, preprocess_inception)
+from novita_client import NovitaClient, NOVITA_API_URL
+from prompt_cache import PromptCache
+from metrics import REGISTRY, instrument_app, record_cache_lookup, span
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import hashlib
 import io
+import logging
+import os
+import re
+import time
 import webbrowser  # To open the browser automatically
 from threading import Timer  # To delay the browser open
 
@@ -32,54 +39,211 @@ def load_api_key(file_path):
                 return line.split('=')[1].strip()
     raise Exception("API Key not found in the configuration file.")
 
-# Load NOVITA API Key
-NOVITA_API_KEY = load_api_key('config.txt')
+CONFIG_FILE = 'config.txt'
+
+# Load NOVITA API Key (on first use, so the app can start without it)
+@functools.lru_cache(maxsize=None)
+def get_api_key():
+    return load_api_key(CONFIG_FILE)
+
+logger = logging.getLogger(__name__)
 
 # Initialize Flask app
 app = Flask(__name__)
+# Largest request accepted (a /bulk request carries up to BULK_MAX_FILES images);
+# bigger uploads are answered with 413 Request Entity Too Large
+app.config['MAX_CONTENT_LENGTH'] = 64 * 2**20
+
+# Request and stage metrics are served at /metrics. Set ENABLE_PROFILER=1 to also serve
+# /debug/profile?seconds=10, which samples the app's threads for a flame graph.
+app.config['PROFILING'] = os.environ.get('ENABLE_PROFILER', '0') == '1'
+instrument_app(app, profiling=app.config['PROFILING'])
+
+# Set IMAGE2PROMPT_FEATURES=0 to run without the InceptionV3 model (prompts only, no feature vectors)
+FEATURES_ENABLED = os.environ.get('IMAGE2PROMPT_FEATURES', '1') != '0'
+# Set IMAGE2PROMPT_WARMUP=0 to load the model on the first request instead of in the background at startup
+WARMUP = os.environ.get('IMAGE2PROMPT_WARMUP', '1') != '0'
+
+# The InceptionV3 model for feature extraction, built the first time it is needed
+model = LazyModel(build_inception_model)
+
+# Feature vectors are stored here, one .npy file per image (keyed by a hash of the resized image)
+FEATURES_FOLDER = 'features'
+# Concurrent requests arriving within BATCH_MAX_WAIT seconds share one model.predict call
+BATCH_MAX_SIZE = 16
+BATCH_MAX_WAIT = 0.02
+
+feature_extractor = FeatureExtractor(
+    FeatureStore(FEATURES_FOLDER),
+    BatchingPredictor(lambda batch: model.get().predict(batch, verbose=0),
+                      max_batch_size=BATCH_MAX_SIZE, max_wait=BATCH_MAX_WAIT),
+    preprocess_inception,
+)
+REGISTRY.gauge('feature_batch_queue_depth', 'Images waiting for a feature extraction batch.').set_function(
+    feature_extractor.predictor.queue_depth)
+
+# Set NOVITA_API_URL to point at another server, e.g. stub_novita_server.py for offline benchmarking
+url = os.environ.get('NOVITA_API_URL', NOVITA_API_URL)
+# At most this many NOVITA calls are in flight at once
+NOVITA_MAX_CONCURRENCY = 8
+# Most images accepted by one /bulk request
+BULK_MAX_FILES = 100
 
-# Initialize the InceptionV3 model for feature extraction
-base_model = InceptionV3(weights='imagenet')
-model = Model(inputs=base_model.input, outputs=base_model.layers[-2].output)
+# Pooled, retrying NOVITA client shared by all requests; it alone limits the calls in flight
+novita_client = NovitaClient(get_api_key, url=url, max_concurrency=NOVITA_MAX_CONCURRENCY)
+# Threads processing the images of /bulk requests, as many as the client lets call the API at once
+bulk_executor = ThreadPoolExecutor(max_workers=novita_client.max_concurrency)
 
-url = "https://api.novita.ai/v3/img2prompt"
+# Prompts are cached by a perceptual hash of the resized image; near-duplicates within
+# PROMPT_CACHE_MAX_DISTANCE differing bits (out of 64) reuse the cached prompt
+PROMPT_CACHE_FILE = 'prompt_cache.sqlite3'
+PROMPT_CACHE_MAX_DISTANCE = 6
+PROMPT_CACHE_MAX_COLOR_DIFFERENCE = 24  # Per channel (0-255) of each quarter's mean color
+PROMPT_CACHE_TTL = 30 * 24 * 3600  # 30 days
+PROMPT_CACHE_MAX_ENTRIES = 10000
 
-def resize_image(image, target_size=(299, 299)):
-    img = image.resize(target_size, Image.LANCZOS)
+prompt_cache = PromptCache(PROMPT_CACHE_FILE, max_distance=PROMPT_CACHE_MAX_DISTANCE,
+                           max_color_difference=PROMPT_CACHE_MAX_COLOR_DIFFERENCE,
+                           ttl=PROMPT_CACHE_TTL, max_entries=PROMPT_CACHE_MAX_ENTRIES)
+
+# Size of the image sent to the API and the model
+TARGET_SIZE = (299, 299)
+# Uploaded images are shown from a thumbnail (at most PREVIEW_SIZE pixels wide/high) saved here
+PREVIEW_FOLDER = 'previews'
+PREVIEW_SIZE = 600
+# Previews are removed PREVIEW_MAX_AGE seconds after their image was last uploaded, and the oldest
+# beyond PREVIEW_MAX_FILES; each process checks at most every PREVIEW_CLEANUP_INTERVAL seconds
+PREVIEW_MAX_AGE = 24 * 3600
+PREVIEW_MAX_FILES = 10000
+PREVIEW_CLEANUP_INTERVAL = 60
+last_preview_cleanup = 0.0
+
+# Function to create the app's folders. Called when the app is served (below and in wsgi.py), not on
+# import, so tools that only import the module (e.g. the benchmarks) leave the current folder alone.
+# The prompt cache creates its database on first use.
+def create_folders():
+    for folder in (PREVIEW_FOLDER, FEATURES_FOLDER):
+        os.makedirs(folder, exist_ok=True)
+
+# Function to remove previews that are too old, then the oldest ones beyond max_files
+def cleanup_previews(folder=PREVIEW_FOLDER, max_age=PREVIEW_MAX_AGE, max_files=PREVIEW_MAX_FILES):
+    if not os.path.isdir(folder):
+        return
+    entries = []
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        try:
+            entries.append((os.path.getmtime(path), path))
+        except OSError:
+            continue  # Removed by another process
+    entries.sort(reverse=True)  # Newest first
+    cutoff = time.time() - max_age
+    for index, (modified, path) in enumerate(entries):
+        if index >= max_files or modified < cutoff:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+# Resizing first reduces the image by an integer factor (fast box filter) while it stays at least
+# 3x the target size, then finishes with LANCZOS; the result is visually the same as LANCZOS alone
+def resize_image(image, target_size=TARGET_SIZE):
+    img = image.resize(target_size, Image.LANCZOS, reducing_gap=3.0)
     return img
 
+# Function to decode an upload once and return (299x299 image, preview key).
+# Large JPEGs are decoded at a reduced scale (draft mode), only as large as the preview needs.
+# With preview=True a thumbnail is saved for /thumbnail/<key> (reusing the upload itself if it is
+# already a small JPEG), instead of the page embedding the full-size image.
+def prepare_upload(data, preview=True):
+    global last_preview_cleanup
+    with span('decode'):
+        img = Image.open(io.BytesIO(data))
+        is_jpeg = img.format == 'JPEG'
+        original_size = img.size
+        if is_jpeg:
+            img.draft('RGB', (PREVIEW_SIZE, PREVIEW_SIZE))
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        else:
+            img.load()  # PIL decodes lazily; load now so the time counts as decoding
+    with span('resize'):
+        model_img = resize_image(img)
+
+    if not preview:
+        return model_img, None
+    key = hashlib.sha256(data).hexdigest()
+    preview_path = os.path.join(PREVIEW_FOLDER, f'{key}.jpg')
+    if time.monotonic() - last_preview_cleanup > PREVIEW_CLEANUP_INTERVAL:
+        last_preview_cleanup = time.monotonic()
+        cleanup_previews()
+    if os.path.exists(preview_path):
+        os.utime(preview_path)  # Uploaded again: keep the preview as long as a new one
+    else:
+        with span('preview'):
+            os.makedirs(PREVIEW_FOLDER, exist_ok=True)
+            temp_path = f'{preview_path}.{os.getpid()}.tmp'
+            if is_jpeg and max(original_size) <= PREVIEW_SIZE:
+                with open(temp_path, 'wb') as file:
+                    file.write(data)
+            else:
+                img.thumbnail((PREVIEW_SIZE, PREVIEW_SIZE), Image.LANCZOS)  # In place: img is not needed after this
+                img.save(temp_path, format='JPEG', quality=85)
+            os.replace(temp_path, preview_path)
+    return model_img, key
+
+# Function to get the InceptionV3 feature vector of an image, as (key, features).
+# Each image's features are computed once and then read back from the feature store.
+def extract_features(image):
+    img = image if image.size == TARGET_SIZE else resize_image(image)
+    with span('features'):
+        return feature_extractor.extract(np.asarray(img, dtype=np.float32))
+
 def image_to_prompt(image):
-    img = resize_image(image)
-    img_array = img_to_array(img)
-    img_array = np.expand_dims(img_array, axis=0)
-    img_array = preprocess_input(img_array)
-    features = model.predict(img_array)
-
-    img_byte_arr = io.BytesIO()
-    img.save(img_byte_arr, format='JPEG')
-    encoded_image = base64.b64encode(img_byte_arr.getvalue()).decode('utf-8')
-
-    payload = {
-        "image_file": encoded_image
-    }
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {NOVITA_API_KEY}"
-    }
-
-    response = requests.post(url, json=payload, headers=headers)
-
-    if response.status_code == 200:
-        prompt = response.json()
+    img = image if image.size == TARGET_SIZE else resize_image(image)
+
+    # Serve repeat uploads (and near-duplicates) from the cache, without calling the API
+    with span('prompt_cache'):
+        prompt = prompt_cache.get(img)
+    record_cache_lookup('prompt', prompt is not None)
+    if prompt is not None:
         return prompt
-    else:
-        print("Error:", response.status_code, response.text)
-        return None
+
+    with span('encode'):
+        img_byte_arr = io.BytesIO()
+        img.save(img_byte_arr, format='JPEG')
+        encoded_image = base64.b64encode(img_byte_arr.getvalue()).decode('utf-8')
+
+    with span('novita_call'):
+        prompt = novita_client.img2prompt(encoded_image)
+    if prompt is not None:
+        prompt_cache.put(img, prompt)
+    return prompt
+
+# Function to generate the prompt (and feature vector) for one image of a bulk request
+def process_bulk_image(filename, data):
+    result = {'filename': filename, 'prompt': None, 'feature_key': None, 'error': None}
+    try:
+        img, _ = prepare_upload(data, preview=False)
+        result['prompt'] = image_to_prompt(img)
+        if FEATURES_ENABLED:
+            result['feature_key'], _ = extract_features(img)
+        if result['prompt'] is None:
+            result['error'] = 'Prompt generation failed'
+    except Exception as e:
+        logger.exception('Bulk image %s failed', filename)
+        result['error'] = str(e)
+    return result
+
+# Function to process the (filename, data) uploads of a bulk request concurrently, returning results in order
+def generate_bulk(uploads):
+    return list(bulk_executor.map(lambda upload: process_bulk_image(*upload), uploads))
 
 @app.route("/", methods=["GET", "POST"])
 def upload_image():
     prompt = None
     image_url = None  # Initialize image_url for rendering the uploaded image
+    feature_key = None
 
     if request.method == "POST":
         if 'file' not in request.files:
@@ -88,16 +252,59 @@ def upload_image():
         if file.filename == '':
             return "No selected file"
         
-        # Load the uploaded image
-        img = Image.open(file.stream).convert("RGB")
+        # Decode the uploaded image once: the 299x299 copy is shared by the prompt and the features
+        img, preview_key = prepare_upload(file.read())
         prompt = image_to_prompt(img)  # Generate prompt from the image
+        if FEATURES_ENABLED:
+            feature_key, _ = extract_features(img)  # Store the image's feature vector for later use
 
-        # Save the uploaded image to a BytesIO object
-        img_byte_arr = io.BytesIO()
-        img.save(img_byte_arr, format='JPEG')
-        image_url = base64.b64encode(img_byte_arr.getvalue()).decode('utf-8')  # To encode to base64 for HTML
+        image_url = url_for('thumbnail', key=preview_key)  # The page loads the preview from the thumbnail route
+
+    return render_template("image_to_prompt_generator.html", prompt=prompt, image_url=image_url,
+                           feature_key=feature_key)
+
+@app.route('/bulk', methods=['POST'])
+def bulk_prompts():
+    # Generate prompts for many images (form field 'files') concurrently
+    files = [file for file in request.files.getlist('files') if file.filename]
+    if not files:
+        return jsonify({'error': 'No files uploaded'}), 400
+    if len(files) > BULK_MAX_FILES:
+        return jsonify({'error': f'At most {BULK_MAX_FILES} files per request'}), 400
+
+    uploads = [(file.filename, file.read()) for file in files]
+    return jsonify({'results': generate_bulk(uploads)})
+
+@app.route('/ready')
+def ready():
+    # Readiness check: 503 while the model is still warming up (or failed to load)
+    model_status = model.status() if FEATURES_ENABLED else 'disabled'
+    body = {'ready': model_status not in ('loading', 'failed'), 'model': model_status,
+            'load_seconds': model.load_seconds, 'error': model.error}
+    return jsonify(body), 200 if body['ready'] else 503
+
+@app.route('/cache/stats')
+def cache_stats():
+    # Prompt cache hit/miss counters
+    return jsonify(prompt_cache.stats())
+
+@app.route('/features/<key>')
+def get_features(key):
+    # Return a stored feature vector as JSON
+    if not re.fullmatch(r'[0-9a-f]{64}', key):
+        abort(404)
+    features = feature_extractor.store.get(key)
+    if features is None:
+        abort(404)
+    return jsonify({'key': key, 'features': np.asarray(features).tolist()})
 
-    return render_template("image_to_prompt_generator.html", prompt=prompt, image_url=image_url)
+@app.route('/thumbnail/<key>')
+def thumbnail(key):
+    # Serve the preview of an uploaded image (content-addressed, so it can be cached by the browser)
+    if not re.fullmatch(r'[0-9a-f]{64}', key):
+        abort(404)
+    return send_from_directory(os.path.abspath(PREVIEW_FOLDER), f'{key}.jpg', mimetype='image/jpeg',
+                               max_age=24 * 3600)
 
 @app.route('/image/<filename>')
 def uploaded_file(filename):
@@ -105,5 +312,9 @@ def uploaded_file(filename):
     return send_file(filename)
 
 if __name__ == "__main__":
+    create_folders()
+    # With debug=True the app is served from a reloader child process; only warm up the model there
+    if FEATURES_ENABLED and WARMUP and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        model.start_warmup()
     Timer(1, lambda: webbrowser.open('http://127.0.0.1:5000/')).start()
     app.run(debug=True)
@@ -0,0 +1,358 @@
+'''
+Metrics and Profiling
+
+Dependency-free, Prometheus-style instrumentation shared by the Flask apps:
+
+    - Counter, Histogram and Gauge metrics kept in a MetricsRegistry and rendered in the
+      Prometheus text format (version 0.0.4) at /metrics
+    - span(stage): a context manager (or decorator) that records how long a processing stage
+      took in the stage_duration_seconds histogram
+    - instrument_app(app): request latency and exception counts for every route, plus the
+      /metrics endpoint and, when enabled, the /debug/profile sampling profiler
+
+Work done in job worker processes is recorded in their own registries. With a metrics folder set
+(init_metrics_folder), each worker writes its counters and histograms to a <pid>.json file there
+after every job (flush_metrics), and /metrics adds them to the web process's own values. When the
+app is served by several web worker processes (gunicorn), each of them also writes its file at most
+every FLUSH_INTERVAL seconds after a request, so /metrics covers every worker whichever one answers.
+Gauges are only reported by the process that serves /metrics.
+
+The profiler samples the Python stack of every thread of the web process and returns them in the
+"folded" format (one `frame;frame;frame count` line per distinct stack), which flamegraph.pl,
+speedscope and most flame graph viewers read directly.
+
+'''
+import atexit
+import collections
+import glob
+import json
+import math
+import os
+import shutil
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram buckets (seconds) suited to everything from array operations to upstream API calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Environment variable naming the folder where worker processes leave their metrics
+METRICS_FOLDER_ENV = 'APP_METRICS_FOLDER'
+
+PROFILE_MAX_SECONDS = 60
+
+# Web processes write their metrics to the metrics folder at most this often (seconds)
+FLUSH_INTERVAL = 1.0
+
+
+# Function to escape a label value for the text format
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def state(self):
+        """JSON-able copy of the current values, as [[label values], value] pairs."""
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+
+class Counter(_Metric):
+    """A value that only goes up (name it with a _total suffix)."""
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    @staticmethod
+    def merge(value, other):
+        return value + other
+
+    def samples(self, values):
+        for key, value in values.items():
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class Histogram(_Metric):
+    """Counts observations into buckets; also tracks their sum and count."""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            counts = list(counts)
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    @staticmethod
+    def merge(value, other):
+        return [a + b for a, b in zip(value[0], other[0])], value[1] + other[1]
+
+    def samples(self, values):
+        for key, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labelnames, key)
+            yield f'{self.name}_sum{labels} {_format_value(float(total))}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, set directly or read from a function at scrape time."""
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, fn):
+        self._function = fn
+
+    def samples(self, values):
+        if self._function is not None:
+            values = {(): self._function()}
+        for key, value in values.items():
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class MetricsRegistry:
+    """Holds metrics by name and renders them; also merges in metrics left by worker processes."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, *args, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def reset(self):
+        for metric in self._metrics.values():
+            with metric._lock:
+                metric._values.clear()
+
+    def state(self):
+        """Counter and histogram values of this process (gauges are not shared)."""
+        return {name: metric.state() for name, metric in self._metrics.items() if metric.type != 'gauge'}
+
+    # Function to read the states other processes left in the metrics folder
+    def _worker_states(self, folder):
+        own_file = f'{os.getpid()}.json'
+        for path in glob.glob(os.path.join(folder, '*.json')):
+            if os.path.basename(path) == own_file:
+                continue
+            try:
+                with open(path) as file:
+                    yield json.load(file)
+            except (OSError, ValueError):
+                continue
+
+    def render(self):
+        """Return every metric in the Prometheus text format, including worker processes' values."""
+        folder = os.environ.get(METRICS_FOLDER_ENV)
+        worker_states = list(self._worker_states(folder)) if folder else []
+
+        lines = []
+        for name, metric in list(self._metrics.items()):
+            with metric._lock:
+                values = dict(metric._values)
+            if metric.type != 'gauge':
+                for state in worker_states:
+                    for key, value in state.get(name, []):
+                        key = tuple(key)
+                        values[key] = metric.merge(values[key], value) if key in values else value
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            lines.extend(metric.samples(values))
+        return '\n'.join(lines) + '\n'
+
+    def flush(self, min_interval=0):
+        """Write this process's values to the metrics folder (no-op when no folder is set, or when
+        the last write was less than min_interval seconds ago)."""
+        folder = os.environ.get(METRICS_FOLDER_ENV)
+        if not folder:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if min_interval and now - self._last_flush < min_interval:
+                return
+            self._last_flush = now
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f'{os.getpid()}.json')
+        temp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(self.state(), file)
+        os.replace(temp_path, path)
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram('stage_duration_seconds', 'Time spent in each processing stage.', ['stage'])
+REQUEST_SECONDS = REGISTRY.histogram('http_request_duration_seconds', 'HTTP request latency.',
+                                     ['method', 'endpoint', 'status'])
+REQUEST_EXCEPTIONS = REGISTRY.counter('http_request_exceptions_total', 'Unhandled exceptions raised by requests.',
+                                      ['endpoint', 'exception'])
+CACHE_REQUESTS = REGISTRY.counter('cache_requests_total', 'Cache lookups by cache and result (hit or miss).',
+                                  ['cache', 'result'])
+
+# A forked worker starts with a copy of the web process's values; clear them so they are not counted twice
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=REGISTRY.reset)
+
+
+# Context manager (or decorator) timing one stage of a pipeline
+@contextmanager
+def span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+# Function to record a cache lookup
+def record_cache_lookup(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+# Function to write this process's metrics to the metrics folder (called by job workers after each job)
+def flush_metrics():
+    REGISTRY.flush()
+
+
+# Function to give the web process a metrics folder that its worker processes inherit
+def init_metrics_folder(parent_folder='metrics'):
+    """Worker processes inherit the folder through the environment (and keep it if they import the
+    app again), so only the process that created it removes it on exit. The folder itself is created
+    by the first worker that flushes its metrics."""
+    if os.environ.get(METRICS_FOLDER_ENV):
+        return os.environ[METRICS_FOLDER_ENV]
+    folder = os.path.join(parent_folder, str(os.getpid()))
+    shutil.rmtree(folder, ignore_errors=True)  # Left over from an earlier process with the same pid
+    os.environ[METRICS_FOLDER_ENV] = folder
+    owner = os.getpid()
+    atexit.register(lambda: os.getpid() == owner and shutil.rmtree(folder, ignore_errors=True))
+    return folder
+
+
+# Function to describe a frame for the folded stack format
+def _frame_label(frame):
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+# Function to sample every thread's Python stack for a while and return the stacks in folded format
+def sample_stacks(seconds, interval=0.005):
+    own_thread = threading.get_ident()
+    stacks = collections.Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            stacks[';'.join(reversed(labels))] += 1
+        time.sleep(interval)
+    return '\n'.join(f'{stack} {count}' for stack, count in stacks.most_common()) + '\n'
+
+
+# Function to add request metrics, /metrics and (optionally) /debug/profile to a Flask app
+def instrument_app(app, registry=REGISTRY, profiling=False):
+    from flask import Response, g, request
+
+    @app.before_request
+    def _start_request_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, method=request.method,
+                                    endpoint=request.endpoint or 'unknown', status=response.status_code)
+        registry.flush(min_interval=FLUSH_INTERVAL)
+        return response
+
+    @app.teardown_request
+    def _record_exception(exc):
+        if exc is not None:
+            REQUEST_EXCEPTIONS.inc(endpoint=request.endpoint or 'unknown', exception=type(exc).__name__)
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+    if profiling:
+        @app.route('/debug/profile')
+        def profile():
+            # e.g. /debug/profile?seconds=10 > app.folded, then: flamegraph.pl app.folded > app.svg
+            try:
+                seconds = min(float(request.args.get('seconds', 10)), PROFILE_MAX_SECONDS)
+                interval = max(float(request.args.get('interval', 0.005)), 0.001)
+            except ValueError:
+                return Response('seconds and interval must be numbers\n', status=400, mimetype='text/plain')
+            return Response(sample_stacks(seconds, interval), mimetype='text/plain')
@@ -0,0 +1,81 @@
+'''
+NOVITA Image to Prompt Client
+
+A reusable HTTP client for the NOVITA img2prompt API:
+
+    - one keep-alive requests.Session, so connections are pooled and reused between calls
+    - connect/read timeouts, so a slow upstream cannot stall a Flask worker indefinitely
+    - retries with exponential backoff on 429 and 5xx responses (honouring Retry-After)
+    - bounded concurrency: at most max_concurrency calls are in flight at once, across all threads
+
+'''
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from metrics import REGISTRY
+
+NOVITA_API_URL = "https://api.novita.ai/v3/img2prompt"
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+logger = logging.getLogger(__name__)
+
+NOVITA_ERRORS = REGISTRY.counter('novita_errors_total', 'Failed img2prompt calls (after retries), by HTTP status '
+                                 'or exception type.', ['reason'])
+
+
+class NovitaClient:
+    """Pooled, retrying client for the img2prompt endpoint.
+
+    :param api_key: the API key, or a function returning it (so it can be loaded on first use)
+    :param url: img2prompt endpoint (e.g. a local stub server for benchmarking)
+    :param timeout: (connect, read) timeout in seconds
+    :param max_retries: retries per call on 429/5xx responses and connection errors
+    :param backoff_factor: retries wait backoff_factor * 2 ** (retry - 1) seconds
+    :param max_concurrency: calls allowed in flight at once (also the connection pool size)
+    """
+
+    def __init__(self, api_key, url=NOVITA_API_URL, timeout=(5, 60), max_retries=3, backoff_factor=0.5,
+                 max_concurrency=8):
+        self.api_key = api_key
+        self.url = url
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+        retry = Retry(total=max_retries, backoff_factor=backoff_factor, status_forcelist=RETRY_STATUSES,
+                      allowed_methods=frozenset({'POST'}), respect_retry_after_header=True, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _headers(self):
+        api_key = self.api_key() if callable(self.api_key) else self.api_key
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}"
+        }
+
+    def img2prompt(self, encoded_image):
+        """Send one base64-encoded image; return the API's JSON response, or None on failure."""
+        payload = {
+            "image_file": encoded_image
+        }
+        with self._slots:
+            try:
+                response = self.session.post(self.url, json=payload, headers=self._headers(), timeout=self.timeout)
+            except requests.RequestException as e:
+                logger.error('img2prompt request failed: %s', e)
+                NOVITA_ERRORS.inc(reason=type(e).__name__)
+                return None
+
+        if response.status_code == 200:
+            return response.json()
+        logger.error('img2prompt returned %s: %s', response.status_code, response.text)
+        NOVITA_ERRORS.inc(reason=response.status_code)
+        return None
+
+    def close(self):
+        self.session.close()
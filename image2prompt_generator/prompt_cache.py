@@ -0,0 +1,174 @@
+'''
+Prompt Cache
+
+A persistent cache of NOVITA prompts keyed by a perceptual hash of the image, so re-uploads
+(and near-duplicates such as re-saved or slightly cropped copies) of the same artwork are
+answered without calling the API again.
+
+    - Key: a 64-bit difference hash (dHash) of the image: it is shrunk to 9x8 grayscale and each bit
+      records whether a pixel is brighter than its right-hand neighbour. Similar images get hashes
+      that differ in only a few bits. dHash only sees brightness (every flat image hashes to 0, and a
+      recolored copy keeps its hash), so the key also holds a coarse color signature: the mean RGB
+      color of each quarter of the image.
+    - Lookup: the cached entry with the smallest Hamming distance to the image's hash is a hit if the
+      distance is at most max_distance (0 = exact matches only) and no channel of its color signature
+      differs by more than max_color_difference.
+    - Storage: an SQLite file, shared by every process using it. Entries older than ttl seconds are
+      ignored and removed. When there are more than max_entries, the least recently used are evicted.
+
+'''
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+from PIL import Image
+
+
+# Function to compute the 64-bit difference hash of a PIL image
+def perceptual_hash(image):
+    small = image.convert('L').resize((9, 8), Image.LANCZOS)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+# Function to compute the color signature of a PIL image: the mean RGB color of each quarter (12 bytes)
+def color_signature(image):
+    small = image.convert('RGB').resize((2, 2), Image.BOX)
+    return np.asarray(small, dtype=np.uint8).reshape(-1)
+
+
+# Function to count the differing bits between a hash and an array of hashes
+def hamming_distances(hashes, value):
+    xor = hashes ^ np.uint64(value)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(xor)
+    return np.unpackbits(xor.view(np.uint8)).reshape(len(xor), 64).sum(axis=1)
+
+
+class PromptCache:
+    """Persistent prompt cache with near-duplicate lookup.
+
+    :param db_path: SQLite file holding the cache
+    :param max_distance: largest Hamming distance (out of 64 bits) still treated as the same image
+    :param max_color_difference: largest difference (0-255) of any channel of the color signature
+        still treated as the same image
+    :param ttl: seconds a cached prompt stays valid
+    :param max_entries: entries kept before least recently used ones are evicted
+    """
+
+    def __init__(self, db_path, max_distance=6, max_color_difference=24, ttl=30 * 24 * 3600, max_entries=10000):
+        self.db_path = db_path
+        self.max_distance = max_distance
+        self.max_color_difference = max_color_difference
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._ids = None  # The database is opened on first use, so constructing the cache creates no file
+
+    def open(self):
+        """Create the database (if needed) and load the index. Called by get/put, or earlier to preload it."""
+        with self._lock:
+            if self._ids is not None:
+                return
+            with self._connect() as conn:
+                columns = [row[1] for row in conn.execute('PRAGMA table_info(prompts)')]
+                if columns and 'colors' not in columns:
+                    conn.execute('DROP TABLE prompts')  # Written before color signatures were part of the key
+                conn.execute('CREATE TABLE IF NOT EXISTS prompts (id INTEGER PRIMARY KEY, hash TEXT, colors TEXT, '
+                             'prompt TEXT, created REAL, last_used REAL, UNIQUE (hash, colors))')
+            self._load_index()
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            with conn:  # Commits on success, rolls back on error
+                yield conn
+        finally:
+            conn.close()
+
+    # Function to turn (id, hash, colors) rows into the index arrays
+    @staticmethod
+    def _index_arrays(rows):
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        hashes = np.array([int(row[1], 16) for row in rows], dtype=np.uint64)
+        colors = np.array([list(bytes.fromhex(row[2])) for row in rows], dtype=np.uint8).reshape(-1, 12)
+        return ids, hashes, colors
+
+    # In-memory copy of the (id, hash, colors) rows, so lookups scan NumPy arrays instead of the database
+    def _load_index(self):
+        with self._connect() as conn:
+            rows = conn.execute('SELECT id, hash, colors FROM prompts ORDER BY id').fetchall()
+        self._ids, self._hashes, self._colors = self._index_arrays(rows)
+
+    # Pick up entries added by other processes since the index was loaded
+    def _sync_index(self, conn):
+        last_id = int(self._ids[-1]) if len(self._ids) else 0
+        rows = conn.execute('SELECT id, hash, colors FROM prompts WHERE id > ? ORDER BY id', (last_id,)).fetchall()
+        if rows:
+            ids, hashes, colors = self._index_arrays(rows)
+            self._ids = np.concatenate([self._ids, ids])
+            self._hashes = np.concatenate([self._hashes, hashes])
+            self._colors = np.concatenate([self._colors, colors])
+
+    def get(self, image):
+        """Return the cached prompt for a PIL image (or a near-duplicate of it), or None."""
+        value = perceptual_hash(image)
+        colors = color_signature(image)
+        now = time.time()
+        self.open()
+        with self._lock, self._connect() as conn:
+            self._sync_index(conn)
+            if len(self._hashes):
+                distances = hamming_distances(self._hashes, value)
+                color_differences = np.abs(self._colors.astype(np.int16) - colors).max(axis=1)
+                # Entries with other colors are never a match, however close their hash
+                distances = np.where(color_differences <= self.max_color_difference, distances, 65)
+                for index in np.argsort(distances, kind='stable'):
+                    if distances[index] > self.max_distance:
+                        break
+                    entry_id = int(self._ids[index])
+                    row = conn.execute('SELECT prompt, created FROM prompts WHERE id = ?', (entry_id,)).fetchone()
+                    if row is None or now - row[1] > self.ttl:
+                        continue  # Evicted by another process, or expired (removed on the next put)
+                    conn.execute('UPDATE prompts SET last_used = ? WHERE id = ?', (now, entry_id))
+                    self.hits += 1
+                    if distances[index] > 0:
+                        self.near_hits += 1
+                    return json.loads(row[0])
+            self.misses += 1
+            return None
+
+    def put(self, image, prompt):
+        """Cache the prompt generated for a PIL image."""
+        value = perceptual_hash(image)
+        colors = color_signature(image)
+        now = time.time()
+        self.open()
+        with self._lock, self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO prompts (hash, colors, prompt, created, last_used) '
+                         'VALUES (?, ?, ?, ?, ?)', (f'{value:016x}', colors.tobytes().hex(), json.dumps(prompt), now, now))
+            conn.execute('DELETE FROM prompts WHERE created < ?', (now - self.ttl,))
+            count = conn.execute('SELECT COUNT(*) FROM prompts').fetchone()[0]
+            if count > self.max_entries:
+                conn.execute('DELETE FROM prompts WHERE id IN (SELECT id FROM prompts ORDER BY last_used LIMIT ?)',
+                             (count - self.max_entries,))
+        # Replacements and evictions change ids, so rebuild the index
+        with self._lock:
+            self._load_index()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'near_hits': self.near_hits,
+            'misses': self.misses,
+            'entries': len(self._ids) if self._ids is not None else 0,
+            'max_distance': self.max_distance,
+            'max_color_difference': self.max_color_difference,
+        }
@@ -0,0 +1,100 @@
+'''
+Production Serving
+
+Helpers used by the apps' wsgi.py entry points when they are served by gunicorn (gunicorn.conf.py)
+instead of the Flask development server:
+
+    - limit_in_flight(app, max_in_flight): back-pressure. Once a worker process is handling
+      max_in_flight requests, further ones are answered straight away with 503 Service Unavailable
+      and a Retry-After header, instead of queueing behind the slow ones until the client or a
+      load balancer times out. Lightweight endpoints (status polling, /metrics, health checks,
+      static files) are neither counted nor limited, so they stay responsive while a worker is busy.
+    - shed_load(app, is_saturated, endpoints): answers requests to the given endpoints with 503
+      while is_saturated() is true, e.g. while the background job queue is full.
+    - job_workers_per_process(): splits the CPUs between the web workers' job process pools.
+
+Rejected requests are counted in http_requests_rejected_total on /metrics.
+
+'''
+import os
+import threading
+from flask import Response, g, request
+from metrics import REGISTRY
+
+# Seconds clients are asked to wait before retrying a rejected request
+RETRY_AFTER = 1
+
+# Endpoints no app counts towards its in-flight limit
+EXEMPT_ENDPOINTS = frozenset({'metrics', 'profile', 'static'})
+
+REJECTED = REGISTRY.counter('http_requests_rejected_total',
+                            'Requests answered with 503 because the server was saturated.', ['endpoint', 'reason'])
+
+
+class InFlightLimiter:
+    """Counts the requests being handled by this process, up to max_in_flight."""
+
+    def __init__(self, max_in_flight):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.in_flight >= self.max_in_flight:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+
+# Function to build the response sent to rejected requests
+def busy_response(retry_after=RETRY_AFTER):
+    return Response('Server busy, please retry shortly.\n', status=503, mimetype='text/plain',
+                    headers={'Retry-After': str(retry_after)})
+
+
+# Function to answer requests beyond max_in_flight at once (in this process) with 503
+def limit_in_flight(app, max_in_flight, exempt=(), retry_after=RETRY_AFTER):
+    limiter = InFlightLimiter(max_in_flight)
+    exempt = EXEMPT_ENDPOINTS | set(exempt)
+    REGISTRY.gauge('http_requests_in_flight', 'Requests being handled by this process (exempt endpoints '
+                   'not counted).').set_function(lambda: limiter.in_flight)
+
+    @app.before_request
+    def _acquire_slot():
+        if request.endpoint in exempt:
+            return None
+        if not limiter.acquire():
+            REJECTED.inc(endpoint=request.endpoint or 'unknown', reason='in_flight')
+            return busy_response(retry_after)
+        g.serving_slot = True
+        return None
+
+    @app.teardown_request
+    def _release_slot(exc):
+        if g.pop('serving_slot', False):
+            limiter.release()
+
+    return limiter
+
+
+# Function to answer requests to `endpoints` with 503 while is_saturated() returns True
+def shed_load(app, is_saturated, endpoints, methods=('POST',), reason='queue_full', retry_after=RETRY_AFTER):
+    endpoints = set(endpoints)
+
+    @app.before_request
+    def _shed_load():
+        if request.endpoint in endpoints and request.method in methods and is_saturated():
+            REJECTED.inc(endpoint=request.endpoint, reason=reason)
+            return busy_response(retry_after)
+        return None
+
+
+# Function to share the CPUs between the job process pools of WEB_CONCURRENCY web workers
+def job_workers_per_process():
+    web_workers = max(1, int(os.environ.get('WEB_CONCURRENCY', 1)))
+    return max(1, (os.cpu_count() or 1) // web_workers)
@@ -0,0 +1,67 @@
+'''
+Stub NOVITA Server
+
+A local stand-in for the NOVITA img2prompt API (POST /v3/img2prompt), for running and
+benchmarking the Image to Prompt Generator offline. It checks the request has the same shape
+as the real API's (a bearer token and a base64 "image_file"), waits a configurable time to
+imitate upstream latency, and answers with a made-up prompt. A share of requests can be made
+to fail with 429 or 503, to exercise the client's retries.
+
+Usage:
+    python stub_novita_server.py --latency 0.5 --error-rate 0.1
+    NOVITA_API_URL=http://127.0.0.1:8765/v3/img2prompt python image2prompt.py
+
+'''
+import argparse
+import base64
+import binascii
+import hashlib
+import random
+import time
+from flask import Flask, request, jsonify
+
+STUB_PORT = 8765
+
+
+def create_stub_app(latency=0.5, jitter=0.1, error_rate=0.0):
+    app = Flask(__name__)
+    app.config['REQUEST_COUNT'] = 0
+
+    @app.route('/v3/img2prompt', methods=['POST'])
+    def img2prompt():
+        app.config['REQUEST_COUNT'] += 1
+        if not request.headers.get('Authorization', '').startswith('Bearer '):
+            return jsonify({'message': 'missing API key'}), 401
+        payload = request.get_json(silent=True) or {}
+        try:
+            image_bytes = base64.b64decode(payload.get('image_file', ''), validate=True)
+        except (binascii.Error, TypeError):
+            image_bytes = b''
+        if not image_bytes:
+            return jsonify({'message': 'image_file is required'}), 400
+
+        time.sleep(max(0.0, random.gauss(latency, jitter)))
+        if random.random() < error_rate:
+            status = random.choice((429, 503))
+            return jsonify({'message': 'stub error'}), status, {'Retry-After': '0'}
+
+        digest = hashlib.sha256(image_bytes).hexdigest()[:8]
+        return jsonify({'prompt': f'a stub prompt for image {digest}, digital art, soft colors'})
+
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a local stand-in for the NOVITA img2prompt API.')
+    parser.add_argument('--port', type=int, default=STUB_PORT)
+    parser.add_argument('--latency', type=float, default=0.5, help='mean response time in seconds')
+    parser.add_argument('--jitter', type=float, default=0.1, help='standard deviation of the response time')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with 429/503')
+    args = parser.parse_args(argv)
+
+    app = create_stub_app(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    app.run(port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+'''
+WSGI Entry Point
+
+Production entry point for the Image to Prompt Generator, served by gunicorn with gunicorn.conf.py:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+create_app() prepares the app defined in image2prompt.py for serving from several worker processes:
+
+    - with preload_app, the app, its libraries and the prompt cache's hash index are loaded once, in
+      the gunicorn master, and shared by the forked workers
+    - the InceptionV3 model is the exception: TensorFlow's runtime does not survive a fork, so each
+      worker builds its own copy right after it is forked (start_worker, called from post_fork in
+      gunicorn.conf.py) and reports ready on /ready once it is loaded. That is why the default is a
+      few worker processes with many threads: the threads of a worker share its model, and their
+      concurrent requests are combined into the same model.predict batches.
+    - every worker's metrics are gathered in METRICS_FOLDER, so /metrics covers all of them
+    - back-pressure: a worker already handling MAX_IN_FLIGHT requests answers further ones with 503
+      (thumbnails, stored features and health checks excepted), and uploads are refused with 503
+      while MAX_FEATURE_QUEUE images are waiting for a feature extraction batch
+
+'''
+import image2prompt
+from metrics import init_metrics_folder
+from serving import limit_in_flight, shed_load
+
+# Serving settings; any of them (and any other app.config key) can be overridden with create_app(config)
+SERVING_CONFIG = {
+    'MAX_IN_FLIGHT': 6,  # gunicorn.conf.py runs 8 threads per worker
+    'MAX_FEATURE_QUEUE': 4 * image2prompt.BATCH_MAX_SIZE,
+    'METRICS_FOLDER': 'metrics',
+}
+
+# Endpoints that are cheap to answer and never limited
+LIGHT_ENDPOINTS = {'ready', 'cache_stats', 'get_features', 'thumbnail', 'uploaded_file'}
+
+
+# Function to configure the Image to Prompt Generator for production serving
+def create_app(config=None):
+    app = image2prompt.app
+    if 'serving' in app.extensions:
+        # The app is created once, when image2prompt is imported, so a later config could not be applied
+        if config is not None and config != app.extensions['serving']:
+            raise RuntimeError('create_app() was already called with a different config; '
+                               'change the create_app() call in wsgi.py instead')
+        return app
+    app.config.update(SERVING_CONFIG)
+    app.config.update(config or {})
+
+    init_metrics_folder(app.config['METRICS_FOLDER'])
+    image2prompt.create_folders()
+    image2prompt.prompt_cache.open()  # Load the hash index here, so preloaded workers share it
+    predictor = image2prompt.feature_extractor.predictor
+    limit_in_flight(app, app.config['MAX_IN_FLIGHT'], exempt=LIGHT_ENDPOINTS)
+    shed_load(app, lambda: predictor.queue_depth() >= app.config['MAX_FEATURE_QUEUE'],
+              endpoints={'upload_image', 'bulk_prompts'})
+    app.extensions['serving'] = dict(config or {})
+    return app
+
+
+# Function run in each worker process right after it is forked
+def start_worker():
+    if image2prompt.FEATURES_ENABLED and image2prompt.WARMUP:
+        image2prompt.model.start_warmup()
+
+
+app = create_app()